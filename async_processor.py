@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+基于 asyncio 子进程的异步处理器
+Async Processor Built on asyncio Subprocesses
+
+AsyncM4SProcessor 提供与 M4SProcessor 相同的方法（merge_video_segments、merge_audio_segments、
+merge_av、mux_segments、process_all），但它们是协程：FFmpeg 通过 asyncio.create_subprocess_exec
+启动，进度在事件循环中读取，因此一个事件循环即可驱动大量并发合并，而不必为每个任务占用一个线程。
+原生拼接、缓存指纹等阻塞的文件操作在默认线程池中执行。
+
+AsyncM4SProcessor offers the same methods as M4SProcessor (merge_video_segments, merge_audio_segments,
+merge_av, mux_segments, process_all), but as coroutines: FFmpeg is started with
+asyncio.create_subprocess_exec and its progress is read on the event loop, so one loop can drive many
+concurrent merges without a thread per job. Blocking file work (native concat, cache fingerprints)
+runs on the default thread pool.
+
+取消 / Cancellation:
+    取消调用所在的任务即可：FFmpeg 会被立即终止，未完成的输出会被删除，然后抛出 asyncio.CancelledError。
+    Cancel the calling task: FFmpeg is killed at once, partial output is removed, and
+    asyncio.CancelledError propagates.
+
+超时 / Timeouts:
+    timeout 限制每条 FFmpeg 命令的运行时间；整个调用的时限可用 asyncio.wait_for 设置。
+    `timeout` bounds each FFmpeg command; use asyncio.wait_for to bound a whole call.
+
+进度回调总是在事件循环线程中调用。
+Progress callbacks always run on the event loop thread.
+
+示例 / Example:
+    processor = AsyncM4SProcessor(max_ffmpeg=8)
+    outputs = await asyncio.gather(*(processor.process_all(v, a, "out") for v, a in jobs))
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import shutil
+import subprocess
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ffmpeg_runner import FFmpegResult, ProgressCallback, run_ffmpeg_async
+from m4s_job import JobCancelledError, M4SJob
+from m4s_processor import CONCAT_PIPE_ARGS, M4SProcessor
+from metrics import MergeResult, total_size
+from segment_validator import SegmentValidationError
+from staging import discard, make_staging_dir, plan_staging, remove_stale_partials
+
+# 每条 FFmpeg 命令的默认超时（秒），与 M4SProcessor 一致 / Default per-command timeout (s), as in M4SProcessor
+FFMPEG_TIMEOUT = 3600
+
+
+def _instrumented(operation: str):
+    """m4s_processor._instrumented 的协程版本 / Coroutine version of m4s_processor._instrumented"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with self.metrics.job(operation) as stats:
+                output = await func(self, *args, **kwargs)
+            return MergeResult(output, stats)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _translate_errors(message: str, timeout_message: str):
+    """按 M4SProcessor 的方式把异常包装为 RuntimeError / Wrap errors in RuntimeError the way M4SProcessor does"""
+    try:
+        yield
+    except (asyncio.CancelledError, JobCancelledError, SegmentValidationError):
+        # Python 3.7 中 CancelledError 仍是 Exception 的子类 / CancelledError is still an Exception on Python 3.7
+        raise
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(timeout_message)
+    except Exception as e:
+        raise RuntimeError(f"{message}: {str(e)}\n详细信息 / Details: {traceback.format_exc()}")
+
+
+class AsyncM4SProcessor:
+    """
+    M4SProcessor 的 asyncio 版本 / asyncio counterpart of M4SProcessor
+    """
+
+    def __init__(self, processor: Optional[M4SProcessor] = None, max_ffmpeg: Optional[int] = None,
+                 timeout: float = FFMPEG_TIMEOUT, **kwargs):
+        """
+        Args:
+            processor: 共用其配置、缓存和指标的同步处理器；为 None 时用 kwargs 创建
+                       Sync processor whose settings, caches and metrics are shared; created from kwargs when None
+            max_ffmpeg: 同时运行的 FFmpeg 进程上限，默认不限 / Cap on concurrent FFmpeg processes, unlimited by default
+            timeout: 每条 FFmpeg 命令的超时秒数 / Timeout per FFmpeg command in seconds
+            **kwargs: 传给 M4SProcessor 的参数 / Arguments for M4SProcessor
+        """
+        self.processor = processor if processor is not None else M4SProcessor(**kwargs)
+        self.max_ffmpeg = max_ffmpeg
+        self.timeout = timeout
+        # 在事件循环中首次使用时创建（Python 3.7 的 Semaphore 创建时绑定事件循环）
+        # Created on first use inside the loop (a Python 3.7 Semaphore binds its loop on creation)
+        self._ffmpeg_slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def metrics(self):
+        return self.processor.metrics
+
+    @property
+    def ffmpeg_path(self) -> str:
+        return self.processor.ffmpeg_path
+
+    # --- 辅助 / Helpers ---
+    @staticmethod
+    async def _in_thread(func, *args):
+        """在默认线程池中运行阻塞操作，span 仍记入当前任务 / Run blocking work on the default pool; spans still go to this task"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(context.run, func, *args))
+
+    async def _run_ffmpeg(self, cmd: List[str], stage: str, total_duration_us: Optional[int],
+                          progress_callback: Optional[ProgressCallback], inputs: List[str],
+                          output: Path, input_data: Optional[bytes] = None) -> FFmpegResult:
+        """运行一条 FFmpeg 命令（受 max_ffmpeg 限制） / Run one FFmpeg command (bounded by max_ffmpeg)"""
+        if self.max_ffmpeg is not None and self._ffmpeg_slots is None:
+            self._ffmpeg_slots = asyncio.Semaphore(self.max_ffmpeg)
+        if self._ffmpeg_slots is not None:
+            await self._ffmpeg_slots.acquire()
+        try:
+            # 逐个 stat 输入也放到线程池，不阻塞事件循环 / Stat the inputs on the pool too, off the event loop
+            bytes_read = await self._in_thread(total_size, inputs)
+            with self.metrics.span(f"ffmpeg_{stage}", bytes_read, len(inputs)) as span:
+                result = await run_ffmpeg_async(cmd, stage, total_duration_us, progress_callback, self.timeout,
+                                                input_data)
+                span.exit_code = result.returncode
+                if os.path.exists(output):
+                    span.bytes_written = os.path.getsize(output)
+        finally:
+            if self._ffmpeg_slots is not None:
+                self._ffmpeg_slots.release()
+        self.metrics.record("ffmpeg_spawn", result.spawn_started, result.spawn_seconds)
+        return result
+
+    async def _try_native_concat(self, files: List[str], output_file: Path, stage: str,
+                                 progress_callback: Optional[ProgressCallback]) -> bool:
+        """在线程池中尝试原生拼接 / Try the native concat engine on the thread pool"""
+        return await self._in_native_thread(self.processor._try_native_concat, stage, progress_callback,
+                                            files, output_file, stage)
+
+    async def _try_native_mux(self, video_files: List[str], audio_files: List[str], output_file: Path,
+                              progress_callback: Optional[ProgressCallback]) -> bool:
+        """在线程池中尝试原生混流 / Try the native muxer on the thread pool"""
+        return await self._in_native_thread(self.processor._try_native_mux, "mux", progress_callback,
+                                            video_files, audio_files, output_file)
+
+    async def _in_native_thread(self, func, stage: str, progress_callback: Optional[ProgressCallback], *args) -> bool:
+        """
+        在线程池中运行原生引擎；任务被取消时通知拷贝线程停止并等它退出
+        Run a native engine on the thread pool; on cancellation, tell the copy to stop and wait for it
+        """
+        if not self.processor.use_native:
+            return False
+        loop = asyncio.get_running_loop()
+
+        def callback(*args):
+            # 拷贝线程中的进度转回事件循环 / Hand progress from the copy thread back to the loop
+            if progress_callback is not None:
+                loop.call_soon_threadsafe(progress_callback, *args)
+
+        handle = M4SJob(f"native-{stage}")
+        future = asyncio.ensure_future(self._in_thread(func, *args, callback, handle))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            handle.cancel()
+            try:
+                await future
+            except Exception:
+                # 已在取消，拷贝线程的结果不再重要 / Already cancelling; the copy's outcome no longer matters
+                pass
+            raise
+
+    @staticmethod
+    def _check_result(result: FFmpegResult, output_file: Path, message: str):
+        if result.returncode != 0:
+            raise RuntimeError(f"{message}: {result.error_text()}")
+        if not output_file.exists():
+            raise RuntimeError(f"输出文件未生成 / Output file not generated: {output_file}")
+
+    def _remove_list_files(self, list_files: List[str]):
+        with self.metrics.span("cleanup"):
+            for list_file in list_files:
+                try:
+                    os.unlink(list_file)
+                except OSError:
+                    pass
+
+    async def _concat(self, files: List[str], output_dir: str, output_name: Optional[str], stage: str,
+                      prefix: str, failure: str, progress_callback: Optional[ProgressCallback]) -> str:
+        """merge_video_segments / merge_audio_segments 的共同实现 / Shared body of the two merge methods"""
+        output_file = None
+        try:
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            final_file = output_dir / (output_name or self.processor._generate_output_name(prefix))
+            output_file = self.processor._begin_output(final_file, None)
+
+            if await self._try_native_concat(files, output_file, stage, progress_callback):
+                return self.processor._finish_output(output_file, final_file, None)
+
+            await self._in_thread(self.processor._validate_segments, files)
+            concat_list = await self._in_thread(self.processor._concat_list, files)
+            cmd = [self.ffmpeg_path] + CONCAT_PIPE_ARGS + ["-c", "copy", "-y", str(output_file)]
+            total_us = await self._in_thread(self.processor._estimate_duration_us, files)
+            result = await self._run_ffmpeg(cmd, stage, total_us, progress_callback, files, output_file, concat_list)
+            self._check_result(result, output_file, failure)
+            return self.processor._finish_output(output_file, final_file, None)
+        finally:
+            discard(output_file)
+
+    # --- 公共方法 / Public methods ---
+    @_instrumented("merge_video")
+    async def merge_video_segments(self, video_files: List[str], output_dir: str, output_name: Optional[str] = None,
+                                   progress_callback: Optional[ProgressCallback] = None) -> str:
+        """合并视频片段，参见 M4SProcessor.merge_video_segments / Merge video segments; see M4SProcessor.merge_video_segments"""
+        if not video_files:
+            raise ValueError("视频文件列表为空 / Video file list is empty")
+        with _translate_errors("合并视频时出错 / Error merging video",
+                               f"视频合并超时（超过 {self.timeout:g} 秒） / Video merge timed out (over {self.timeout:g}s)"):
+            return await self._concat(video_files, output_dir, output_name, "video", "Merged_Video",
+                                      "FFmpeg 合并视频失败 / FFmpeg merge video failed", progress_callback)
+
+    @_instrumented("merge_audio")
+    async def merge_audio_segments(self, audio_files: List[str], output_dir: str, output_name: Optional[str] = None,
+                                   progress_callback: Optional[ProgressCallback] = None) -> str:
+        """合并音频片段，参见 M4SProcessor.merge_audio_segments / Merge audio segments; see M4SProcessor.merge_audio_segments"""
+        if not audio_files:
+            raise ValueError("音频文件列表为空 / Audio file list is empty")
+        with _translate_errors("合并音频时出错 / Error merging audio",
+                               f"音频合并超时（超过 {self.timeout:g} 秒） / Audio merge timed out (over {self.timeout:g}s)"):
+            return await self._concat(audio_files, output_dir, output_name, "audio", "Merged_Audio",
+                                      "FFmpeg 合并音频失败 / FFmpeg merge audio failed", progress_callback)
+
+    @_instrumented("merge_av")
+    async def merge_av(self, video_file: str, audio_file: str, output_dir: str, output_name: Optional[str] = None,
+                       progress_callback: Optional[ProgressCallback] = None) -> str:
+        """合并音视频，参见 M4SProcessor.merge_av / Mux audio and video; see M4SProcessor.merge_av"""
+        return await self._mux([video_file], [audio_file], output_dir, output_name, progress_callback)
+
+    @_instrumented("mux")
+    async def mux_segments(self, video_files: List[str], audio_files: List[str], output_dir: str,
+                           output_name: Optional[str] = None,
+                           progress_callback: Optional[ProgressCallback] = None) -> str:
+        """单次调用混流，参见 M4SProcessor.mux_segments / Single-pass mux; see M4SProcessor.mux_segments"""
+        if not video_files:
+            raise ValueError("视频文件列表为空 / Video file list is empty")
+        if not audio_files:
+            raise ValueError("音频文件列表为空 / Audio file list is empty")
+        return await self._mux(video_files, audio_files, output_dir, output_name, progress_callback)
+
+    async def _mux(self, video_files: List[str], audio_files: List[str], output_dir: str,
+                   output_name: Optional[str], progress_callback: Optional[ProgressCallback]) -> str:
+        """merge_av / mux_segments 的共同实现 / Shared body of merge_av and mux_segments"""
+        output_file = None
+        list_files = []
+        with _translate_errors("混流时出错 / Error during muxing",
+                               f"音视频混流超时（超过 {self.timeout:g} 秒） / Muxing timed out (over {self.timeout:g}s)"):
+            try:
+                output_dir = Path(output_dir)
+                output_dir.mkdir(parents=True, exist_ok=True)
+                final_file = output_dir / (output_name or self.processor._generate_output_name("Muxed_Output"))
+                output_file = self.processor._begin_output(final_file, None)
+
+                if await self._try_native_mux(video_files, audio_files, output_file, progress_callback):
+                    return self.processor._finish_output(output_file, final_file, None)
+
+                for files in (video_files, audio_files):
+                    await self._in_thread(self.processor._validate_segments, files)
+                inputs, concat_list = await self._in_thread(
+                    self.processor._concat_inputs, [video_files, audio_files], list_files)
+                cmd = [self.ffmpeg_path] + inputs + ["-map", "0:v:0", "-map", "1:a:0", "-c", "copy", "-y", str(output_file)]
+
+                video_us = await self._in_thread(self.processor._estimate_duration_us, video_files)
+                audio_us = await self._in_thread(self.processor._estimate_duration_us, audio_files)
+                total_us = max(video_us, audio_us) if video_us and audio_us else None
+                result = await self._run_ffmpeg(cmd, "mux", total_us, progress_callback,
+                                                video_files + audio_files, output_file, concat_list)
+                self._check_result(result, output_file, "FFmpeg 混流失败 / FFmpeg muxing failed")
+                return self.processor._finish_output(output_file, final_file, None)
+            finally:
+                discard(output_file)
+                self._remove_list_files(list_files)
+
+    @_instrumented("process_all")
+    async def process_all(self, video_files: List[str], audio_files: List[str], output_dir: str,
+                          single_pass: bool = True, stage_bytes: Optional[Dict[str, int]] = None,
+                          output_name: Optional[str] = None,
+                          progress_callback: Optional[ProgressCallback] = None) -> str:
+        """一键处理，参见 M4SProcessor.process_all / One-click processing; see M4SProcessor.process_all"""
+        if stage_bytes is None:
+            stage_bytes = {}
+        processor = self.processor
+        with _translate_errors("一键处理失败 / Processing failed", "处理超时 / Processing timed out"):
+            if not video_files and not audio_files:
+                raise ValueError("至少需要提供视频文件或音频文件 / At least one video or audio file is required")
+
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            # 清理崩溃进程留在输出目录中的临时文件和中间文件目录
+            # Clean up temp files and staging directories crashed processes left in the output directory
+            await self._in_thread(remove_stale_partials, str(output_dir))
+
+            if video_files and audio_files:
+                mode, prefix = ("mux" if single_pass else "mux-staged"), "Muxed_Output"
+            elif video_files:
+                mode, prefix = "video", "Merged_Video"
+            else:
+                mode, prefix = "audio", "Merged_Audio"
+            with self.metrics.span("cache_lookup", segments=len(video_files) + len(audio_files)) as span:
+                cache_key = await self._in_thread(processor._result_cache_key, [video_files, audio_files], mode)
+                cached = None
+                if cache_key is not None:
+                    cached = await self._in_thread(processor.result_cache.materialize, cache_key, str(output_dir),
+                                                   output_name, processor._generate_output_name(prefix))
+                if cached:
+                    span.bytes_written = os.path.getsize(cached)
+            if cached:
+                print(f"[Cache] 复用已有结果 / Reusing cached result: {cached}")
+                # 命中缓存时同样报告输出大小 / Report the output size on a cache hit as well
+                stage_bytes[mode.split("-")[0]] = span.bytes_written
+                return cached
+
+            output = await self._process_uncached(video_files, audio_files, output_dir, single_pass, stage_bytes,
+                                                  output_name, progress_callback)
+            if cache_key is not None:
+                with self.metrics.span("cache_store"):
+                    await self._in_thread(processor.result_cache.store, cache_key, output)
+            return output
+
+    async def _process_uncached(self, video_files: List[str], audio_files: List[str], output_dir: Path,
+                                single_pass: bool, stage_bytes: Dict[str, int], output_name: Optional[str],
+                                progress_callback: Optional[ProgressCallback]) -> str:
+        """M4SProcessor._process_uncached 的协程版本 / Coroutine version of M4SProcessor._process_uncached"""
+        # 每个片段一次 stat、每个候选文件系统一次 statvfs，网络盘上可能很慢，放到线程池执行
+        # One stat per segment and one statvfs per candidate filesystem can be slow on network mounts; run them on the pool
+        video_bytes = await self._in_thread(total_size, video_files)
+        audio_bytes = await self._in_thread(total_size, audio_files)
+        temp_bytes = 0
+        if video_files and audio_files and not single_pass:
+            temp_bytes = (video_bytes if len(video_files) > 1 else 0) + (audio_bytes if len(audio_files) > 1 else 0)
+        plan = await self._in_thread(plan_staging, str(output_dir), video_bytes + audio_bytes, temp_bytes)
+
+        if video_files and not audio_files:
+            output = await self.merge_video_segments(video_files, str(output_dir), output_name, progress_callback)
+            stage_bytes["video"] = os.path.getsize(output)
+            return output
+        if audio_files and not video_files:
+            output = await self.merge_audio_segments(audio_files, str(output_dir), output_name, progress_callback)
+            stage_bytes["audio"] = os.path.getsize(output)
+            return output
+
+        if single_pass:
+            output = await self.mux_segments(video_files, audio_files, str(output_dir), output_name, progress_callback)
+            stage_bytes["mux"] = os.path.getsize(output)
+            return output
+
+        if plan.temp_root != str(output_dir):
+            await self._in_thread(remove_stale_partials, plan.temp_root)
+        temp_dir = await self._in_thread(make_staging_dir, plan.temp_root)
+        try:
+            video_input, audio_input = await self._prepare_streams(video_files, audio_files, temp_dir, progress_callback)
+            stage_bytes["video"] = os.path.getsize(video_input) if len(video_files) > 1 else 0
+            stage_bytes["audio"] = os.path.getsize(audio_input) if len(audio_files) > 1 else 0
+            output = await self.merge_av(video_input, audio_input, str(output_dir), output_name, progress_callback)
+            stage_bytes["mux"] = os.path.getsize(output)
+            return output
+        finally:
+            with self.metrics.span("cleanup"):
+                await self._in_thread(functools.partial(shutil.rmtree, temp_dir, ignore_errors=True))
+
+    async def _prepare_streams(self, video_files: List[str], audio_files: List[str], temp_dir: str,
+                               progress_callback: Optional[ProgressCallback]) -> Tuple[str, str]:
+        """
+        同时准备视频流和音频流；一方失败时取消另一方
+        Prepare the video and audio streams concurrently; if one fails the other is cancelled
+        """
+        tasks = [asyncio.ensure_future(self._prepare_stream_for_mux(video_files, temp_dir, True, progress_callback)),
+                 asyncio.ensure_future(self._prepare_stream_for_mux(audio_files, temp_dir, False, progress_callback))]
+        try:
+            video_input, audio_input = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return video_input, audio_input
+
+    async def _prepare_stream_for_mux(self, files: List[str], temp_dir: str, is_video: bool,
+                                      progress_callback: Optional[ProgressCallback]) -> str:
+        """M4SProcessor._prepare_stream_for_mux 的协程版本 / Coroutine version of M4SProcessor._prepare_stream_for_mux"""
+        if not files:
+            raise ValueError("Stream list is empty / 流列表为空")
+        if len(files) == 1:
+            return files[0]
+        if is_video:
+            return await self.merge_video_segments(files, temp_dir, "temp_video.mp4", progress_callback)
+        return await self.merge_audio_segments(files, temp_dir, "temp_audio.mp4", progress_callback)
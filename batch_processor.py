@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+M4S 批量处理引擎
+M4S Batch Processing Engine
+
+把大量 (视频片段, 音频片段, 输出) 任务分发到有界线程池中并行处理。
+FFmpeg 进程（CPU 阶段）和原生拷贝（I/O 阶段）的并发数分别可调。
+
+Runs many (video segments, audio segments, output) jobs on a bounded thread pool.
+Concurrency for FFmpeg processes (CPU stage) and native copies (I/O stage) is tuned separately.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Optional
+
+from m4s_job import M4SJob
+
+if TYPE_CHECKING:
+    # 运行时按需导入，命令行解析参数时无需加载处理模块
+    # Imported lazily at runtime so the CLI can build its parser without loading the processor
+    from m4s_processor import M4SProcessor
+
+
+class BatchJob(NamedTuple):
+    """单个批处理任务 / One batch job"""
+    video_files: List[str]
+    audio_files: List[str]
+    output_dir: str
+    output_name: Optional[str] = None
+    job_id: str = ""
+
+
+class BatchResult(NamedTuple):
+    """单个任务的结果 / Result of one job"""
+    job: BatchJob
+    success: bool
+    output: Optional[str]
+    error: Optional[str]
+    elapsed: float
+    stage_bytes: Dict[str, int]
+    cancelled: bool = False
+
+
+class BatchSummary(NamedTuple):
+    """整批任务的汇总 / Summary of a whole batch"""
+    total: int
+    succeeded: int
+    failed: int
+    cancelled: int
+    elapsed: float
+    bytes_written: int
+    results: List[BatchResult]
+
+    def format(self) -> str:
+        """生成可读的汇总文本 / Build a human-readable summary"""
+        mb = self.bytes_written / 1024 / 1024
+        rate = mb / self.elapsed if self.elapsed > 0 else 0.0
+        return (
+            f"完成 / Done: {self.succeeded}/{self.total} 成功 / succeeded, {self.failed} 失败 / failed, "
+            f"{self.cancelled} 取消 / cancelled, "
+            f"{mb:.1f} MB 写入 / written in {self.elapsed:.1f}s ({rate:.1f} MB/s)"
+        )
+
+
+def default_cpu_workers() -> int:
+    """默认的 FFmpeg 并发数：一半的 CPU 核心 / Default FFmpeg concurrency: half the CPU cores"""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class BatchProcessor:
+    """批量处理器 / Batch processor"""
+
+    def __init__(self, processor: "M4SProcessor", cpu_workers: Optional[int] = None, io_workers: int = 2):
+        """
+        Args:
+            processor: 共享的 M4SProcessor 实例 / Shared M4SProcessor instance
+            cpu_workers: 同时运行的 FFmpeg 进程数 / Concurrent FFmpeg processes
+            io_workers: 同时进行的原生拷贝数 / Concurrent native copies
+        """
+        self.processor = processor
+        self.cpu_workers = max(1, cpu_workers or default_cpu_workers())
+        self.io_workers = max(1, io_workers)
+        # 批处理自己的闸门，只在本批的任务线程中生效，共享的处理器保持不变
+        # The batch's own gates apply only on its job threads; the shared processor is left untouched
+        self.ffmpeg_slots = threading.BoundedSemaphore(self.cpu_workers)
+        self.io_slots = threading.BoundedSemaphore(self.io_workers)
+        self._cancel_event = threading.Event()
+        self._active_jobs: List[M4SJob] = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """
+        取消整批：正在运行的任务立即终止 FFmpeg 并清理输出，排队中的任务直接跳过
+        Cancel the batch: running jobs kill FFmpeg and clean up, queued jobs are skipped
+        """
+        self._cancel_event.set()
+        with self._lock:
+            active = list(self._active_jobs)
+        for job in active:
+            job.cancel()
+
+    def run(self, jobs: List[BatchJob],
+            on_result: Optional[Callable[[BatchResult], None]] = None) -> BatchSummary:
+        """
+        并行运行所有任务；单个任务失败不会中断整批
+        Run all jobs in parallel; one failing job never stops the batch
+
+        Args:
+            jobs: 任务列表 / Job list
+            on_result: 每完成一个任务时调用（在工作线程中） / Called per finished job (on a worker thread)
+        """
+        started = time.monotonic()
+        results: List[BatchResult] = []
+        workers = self.cpu_workers + self.io_workers
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="m4s-batch") as pool:
+            futures = [pool.submit(self._run_job, index, job) for index, job in enumerate(jobs)]
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+            except KeyboardInterrupt:
+                # Ctrl+C：终止所有 FFmpeg 进程后再退出 / Ctrl+C: kill every FFmpeg process before exiting
+                self.cancel()
+                raise
+
+        order = {id(job): index for index, job in enumerate(jobs)}
+        results.sort(key=lambda r: order.get(id(r.job), 0))
+        succeeded = sum(1 for r in results if r.success)
+        cancelled = sum(1 for r in results if r.cancelled)
+        return BatchSummary(
+            total=len(jobs),
+            succeeded=succeeded,
+            failed=len(jobs) - succeeded - cancelled,
+            cancelled=cancelled,
+            elapsed=time.monotonic() - started,
+            bytes_written=sum(sum(r.stage_bytes.values()) for r in results),
+            results=results,
+        )
+
+    def _run_job(self, index: int, job: BatchJob) -> BatchResult:
+        started = time.monotonic()
+        stage_bytes: Dict[str, int] = {}
+        if self._cancel_event.is_set():
+            return BatchResult(job, False, None, "任务已取消 / Job cancelled", 0.0, stage_bytes, cancelled=True)
+        # 同一秒内启动的任务也要有不同的默认文件名 / Jobs started in the same second still need distinct names
+        output_name = job.output_name or self.processor._generate_output_name(f"Muxed_Output_{index + 1:05d}")
+        handle = M4SJob(job.job_id or str(index + 1))
+        with self._lock:
+            self._active_jobs.append(handle)
+        try:
+            with self.processor.concurrency_gates(self.ffmpeg_slots, self.io_slots):
+                handle.run(lambda: self.processor.process_all(
+                    job.video_files, job.audio_files, job.output_dir,
+                    stage_bytes=stage_bytes, output_name=output_name, job=handle,
+                ))
+        finally:
+            with self._lock:
+                self._active_jobs.remove(handle)
+        elapsed = time.monotonic() - started
+        if handle.status == M4SJob.SUCCEEDED:
+            return BatchResult(job, True, handle.result, None, elapsed, stage_bytes)
+        cancelled = handle.status == M4SJob.CANCELLED
+        return BatchResult(job, False, None, str(handle.error), elapsed, stage_bytes, cancelled=cancelled)
+
+
+def load_jobs(path: str) -> List[BatchJob]:
+    """
+    读取任务文件（JSON 数组或 JSON Lines）
+    Load a job file (JSON array or JSON Lines)
+
+    每个任务 / Each job: {"video": [...], "audio": [...], "output": "dir or dir/name.mp4", "id": "..."}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    stripped = text.lstrip()
+    if stripped.startswith("["):
+        entries = json.loads(stripped)
+    else:
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    jobs = []
+    for index, entry in enumerate(entries):
+        output = entry.get("output") or entry.get("output_dir") or os.getcwd()
+        output_dir, output_name = output, entry.get("output_name")
+        if output_name is None and Path(output).suffix:
+            output_dir, output_name = str(Path(output).parent), Path(output).name
+        jobs.append(BatchJob(
+            video_files=list(entry.get("video", [])),
+            audio_files=list(entry.get("audio", [])),
+            output_dir=output_dir,
+            output_name=output_name,
+            job_id=str(entry.get("id", index + 1)),
+        ))
+    return jobs
+
+
+def write_report(summary: BatchSummary, path: str):
+    """把每个任务的结果写成 JSON / Write per-job results as JSON"""
+    report = {
+        "total": summary.total,
+        "succeeded": summary.succeeded,
+        "failed": summary.failed,
+        "cancelled": summary.cancelled,
+        "elapsed": round(summary.elapsed, 3),
+        "bytes_written": summary.bytes_written,
+        "jobs": [
+            {
+                "id": r.job.job_id,
+                "success": r.success,
+                "cancelled": r.cancelled,
+                "output": r.output,
+                "error": r.error,
+                "elapsed": round(r.elapsed, 3),
+                "stage_bytes": r.stage_bytes,
+                # 各阶段耗时（秒），来自 MergeResult.stats / Seconds per stage, from MergeResult.stats
+                "stages": r.output.stats.by_stage() if getattr(r.output, "stats", None) else None,
+            }
+            for r in summary.results
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def add_batch_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("jobs", help="任务文件（JSON / JSON Lines） / Job file (JSON / JSON Lines)")
+    parser.add_argument("--cpu-workers", type=int, default=None,
+                        help="同时运行的 FFmpeg 进程数 / Concurrent FFmpeg processes")
+    parser.add_argument("--io-workers", type=int, default=2,
+                        help="同时进行的原生拷贝数 / Concurrent native copies")
+    parser.add_argument("--report", help="结果 JSON 输出路径 / Path for the JSON result report")
+
+
+def run_batch_cli(args: argparse.Namespace, processor: "M4SProcessor") -> int:
+    jobs = load_jobs(args.jobs)
+    batch = BatchProcessor(processor, cpu_workers=args.cpu_workers, io_workers=args.io_workers)
+    print(f"[Batch] {len(jobs)} 个任务 / jobs, FFmpeg 并发 / CPU workers: {batch.cpu_workers}, "
+          f"I/O 并发 / I/O workers: {batch.io_workers}")
+
+    def report(result: BatchResult):
+        if result.success:
+            print(f"[OK] {result.job.job_id}: {result.output} ({result.elapsed:.1f}s)")
+        elif result.cancelled:
+            print(f"[取消/CANCELLED] {result.job.job_id}")
+        else:
+            first_line = (result.error or "").splitlines()[0] if result.error else ""
+            print(f"[失败/FAIL] {result.job.job_id}: {first_line}")
+
+    try:
+        summary = batch.run(jobs, on_result=report)
+    except KeyboardInterrupt:
+        print("[Batch] 已中断，所有 FFmpeg 进程已终止 / Interrupted, all FFmpeg processes stopped")
+        return 130
+    print(f"[Batch] {summary.format()}")
+    if args.report:
+        write_report(summary, args.report)
+    return 0 if summary.failed == 0 else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="批量合并 M4S 音视频 / Batch-merge M4S audio and video")
+    add_batch_arguments(parser)
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="FFmpeg 可执行文件路径 / FFmpeg executable path")
+    args = parser.parse_args(argv)
+    from m4s_processor import M4SProcessor
+    return run_batch_cli(args, M4SProcessor(ffmpeg_path=args.ffmpeg))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+端到端合并基准测试
+End-to-End Merge Benchmarks
+
+用 fmp4_fixtures.py 在本地生成合成片段（无需网络），对 merge_video_segments、
+merge_audio_segments、merge_av 和 process_all 逐一计时，记录吞吐 (MB/s)、峰值内存
+和写入字节数，并把结果保存为 JSON，便于在不同提交之间对比。每次测量都在独立的子进程
+中运行，峰值内存互不影响。
+
+Synthetic segments are generated locally with fmp4_fixtures.py (no network). Each merge path
+(merge_video_segments, merge_audio_segments, merge_av, process_all) is timed and its
+throughput (MB/s), peak RSS and bytes written are recorded as JSON for comparison across
+commits. Every measurement runs in its own child process so peak RSS figures stay independent.
+
+用法 / Usage:
+    python benchmarks/bench_merge.py run                          # 快速矩阵 / quick matrix
+    python benchmarks/bench_merge.py run --preset full            # 1..10000 片段, 1 MB..20 GB
+    python benchmarks/bench_merge.py run --counts 1,100 --sizes 1GB --paths video,process_all
+    python benchmarks/bench_merge.py compare old.json new.json
+    python benchmarks/bench_merge.py check                        # 用真实 FFmpeg 检查 concat 回退 / concat fallback vs a real FFmpeg
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(ROOT))
+
+from fmp4_fixtures import AUDIO, VIDEO, parse_size, write_segments  # noqa: E402
+
+SCHEMA_VERSION = 1
+MB = 1024 * 1024
+
+PRESETS = {
+    "quick": {"counts": [1, 10, 100], "sizes": ["1MB", "32MB"]},
+    "full": {"counts": [1, 10, 100, 1000, 10000], "sizes": ["1MB", "100MB", "1GB", "20GB"]},
+}
+# process_all 为单次混流，process_all_staged 为先分别合并再混流
+# process_all is the single-pass mux; process_all_staged merges each stream first, then muxes
+ALL_PATHS = ["video", "audio", "merge_av", "process_all", "process_all_staged"]
+ENGINES = ["native", "ffmpeg"]
+# 拼接和混流都有原生实现，每条路径都分别测量两种引擎；只有 ffmpeg 引擎需要 FFmpeg
+# Both joining and muxing have native implementations, so every path is measured with both engines;
+# only the ffmpeg engine needs FFmpeg
+ENGINE_PATHS = {"video", "audio", "merge_av", "process_all", "process_all_staged"}
+
+
+class Scenario(NamedTuple):
+    """一组合成输入 / One set of synthetic inputs"""
+    count: int
+    video_bytes: int
+    audio_bytes: int
+    fragment_seconds: float
+
+    @property
+    def name(self) -> str:
+        return f"{self.count}x{_human(self.video_bytes + self.audio_bytes)}"
+
+
+def _human(n: int) -> str:
+    for unit, size in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)):
+        if n >= size:
+            return f"{n / size:g}{unit}"
+    return f"{n}B"
+
+
+def _peak_rss():
+    """
+    返回 (本进程, 子进程) 的峰值常驻内存字节数；平台不支持时为 None
+    Peak RSS in bytes for (this process, child processes); None where unsupported
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # Linux 以 KB 为单位，macOS 以字节为单位 / Linux reports KB, macOS reports bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def _git_info() -> Dict[str, Optional[str]]:
+    def git(*args):
+        try:
+            out = subprocess.run(["git"] + list(args), cwd=str(ROOT), stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        return out.stdout.decode("utf-8", errors="ignore").strip() if out.returncode == 0 else None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+# --- 子进程：执行单次测量 / Child process: one measurement ---
+def run_one(spec: dict) -> dict:
+    """在当前进程中执行一次测量并返回结果 / Run one measurement in this process and return the record"""
+    from m4s_processor import M4SProcessor
+
+    processor = M4SProcessor(ffmpeg_path=spec["ffmpeg"], check_ffmpeg=False,
+                             use_native=spec["engine"] == "native", use_result_cache=False)
+    path, out_dir = spec["path"], spec["output_dir"]
+    stage_bytes: Dict[str, int] = {}
+    start = time.perf_counter()
+    if path == "video":
+        output = processor.merge_video_segments(spec["video"], out_dir, output_name="out.mp4")
+    elif path == "audio":
+        output = processor.merge_audio_segments(spec["audio"], out_dir, output_name="out.m4a")
+    elif path == "merge_av":
+        output = processor.merge_av(spec["video"][0], spec["audio"][0], out_dir, output_name="out.mp4")
+    else:
+        output = processor.process_all(spec["video"], spec["audio"], out_dir,
+                                       single_pass=path == "process_all", stage_bytes=stage_bytes,
+                                       output_name="out.mp4")
+    seconds = time.perf_counter() - start
+    rss, child_rss = _peak_rss()
+    # 写入量包括分阶段模式的中间文件 / Bytes written include intermediates in the staged mode
+    written = sum(stage_bytes.values()) if stage_bytes else os.path.getsize(output)
+    return {"seconds": seconds, "bytes_written": written, "output_bytes": os.path.getsize(output),
+            "peak_rss_bytes": rss, "ffmpeg_peak_rss_bytes": child_rss}
+
+
+def _measure(spec: dict, timeout: Optional[float]) -> dict:
+    """在新的 Python 进程中测量，避免峰值内存互相污染 / Measure in a fresh interpreter so peak RSS is not shared"""
+    fd, result_file = tempfile.mkstemp(prefix="bench_", suffix=".json")
+    os.close(fd)
+    try:
+        cmd = [sys.executable, str(Path(__file__).resolve()), "_one", json.dumps(spec), result_file]
+        try:
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {"status": "timeout"}
+        with open(result_file, "r", encoding="utf-8") as f:
+            text = f.read()
+        if proc.returncode != 0 or not text:
+            stderr = proc.stderr.decode("utf-8", errors="ignore").strip().splitlines()
+            return {"status": "failed", "error": stderr[-1] if stderr else f"exit code {proc.returncode}"}
+        record = json.loads(text)
+        record["status"] = "ok"
+        return record
+    finally:
+        os.unlink(result_file)
+
+
+# --- 父进程：生成输入并遍历矩阵 / Parent process: generate inputs and walk the matrix ---
+def _prepare_merged(processor, files: List[str], out_dir: Path, name: str) -> str:
+    """为 merge_av 准备已合并的单个输入（不计时） / Build the single merged input merge_av needs (untimed)"""
+    if len(files) == 1:
+        return files[0]
+    return processor.merge_video_segments(files, str(out_dir), output_name=name)
+
+
+def run_scenario(scenario: Scenario, paths: List[str], engines: List[str], ffmpeg: Optional[str],
+                 work_dir: Path, timeout: Optional[float]) -> List[dict]:
+    from m4s_processor import M4SProcessor
+    from staging import free_bytes
+
+    base = {"scenario": scenario.name, "count": scenario.count, "fragment_seconds": scenario.fragment_seconds}
+    input_bytes = scenario.video_bytes + scenario.audio_bytes
+    # 输入、中间文件和输出各需一份空间 / Room for inputs, intermediates and the output
+    needed = input_bytes * 3
+    free = free_bytes(str(work_dir))
+    if free < needed:
+        print(f"[Bench] {scenario.name}: 空间不足，跳过 / not enough space, skipped "
+              f"(need {needed / MB:.0f} MB, free {free / MB:.0f} MB)")
+        return [dict(base, path=p, status="skipped", error="insufficient disk space") for p in paths]
+
+    scenario_dir = work_dir / scenario.name
+    try:
+        print(f"[Bench] {scenario.name}: 生成片段 / generating segments...")
+        gen_start = time.perf_counter()
+        video = write_segments(scenario_dir / VIDEO, VIDEO, scenario.count, scenario.video_bytes,
+                               scenario.fragment_seconds)
+        audio = write_segments(scenario_dir / AUDIO, AUDIO, scenario.count, scenario.audio_bytes,
+                               scenario.fragment_seconds, seed=2)
+        video_bytes = sum(os.path.getsize(f) for f in video)
+        audio_bytes = sum(os.path.getsize(f) for f in audio)
+        print(f"[Bench] {scenario.name}: {time.perf_counter() - gen_start:.1f}s")
+
+        prepared = None
+        results = []
+        for path in paths:
+            for engine in (engines if path in ENGINE_PATHS else ["native"]):
+                record = dict(base, path=path, engine=engine if path in ENGINE_PATHS else None)
+                if engine == "ffmpeg" and ffmpeg is None:
+                    results.append(dict(record, status="skipped", error="FFmpeg not found"))
+                    _print_record(results[-1])
+                    continue
+                spec = {"path": path, "engine": engine, "ffmpeg": ffmpeg or "ffmpeg",
+                        "video": video, "audio": audio, "output_dir": str(scenario_dir / "out")}
+                in_bytes = {"video": video_bytes, "audio": audio_bytes}.get(path, video_bytes + audio_bytes)
+                if path == "merge_av":
+                    if prepared is None:
+                        prep = M4SProcessor(ffmpeg_path=ffmpeg, check_ffmpeg=False, use_result_cache=False)
+                        prepared = [_prepare_merged(prep, video, scenario_dir / "prep", "video.mp4"),
+                                    _prepare_merged(prep, audio, scenario_dir / "prep", "audio.m4a")]
+                    spec["video"], spec["audio"] = prepared[:1], prepared[1:]
+                record.update(_measure(spec, timeout))
+                record["input_bytes"] = in_bytes
+                if record["status"] == "ok":
+                    record["mb_per_s"] = in_bytes / MB / record["seconds"] if record["seconds"] > 0 else None
+                results.append(record)
+                _print_record(record)
+                shutil.rmtree(scenario_dir / "out", ignore_errors=True)
+        return results
+    finally:
+        shutil.rmtree(scenario_dir, ignore_errors=True)
+
+
+def _print_record(r: dict):
+    label = f"{r['scenario']:>12} {r['path']:<19} {r.get('engine') or '-':<7}"
+    if r["status"] != "ok":
+        print(f"{label} {r['status']}: {r.get('error', '')}")
+        return
+    rss = f"{r['peak_rss_bytes'] / MB:.0f} MB" if r.get("peak_rss_bytes") else "?"
+    print(f"{label} {r['seconds']:8.3f}s {r['mb_per_s']:9.1f} MB/s  rss {rss:>7}  "
+          f"written {r['bytes_written'] / MB:.1f} MB")
+
+
+def build_scenarios(counts: List[int], sizes: List[str], audio_ratio: float,
+                    fragment_seconds: float) -> List[Scenario]:
+    scenarios = []
+    for size in sizes:
+        total = parse_size(size)
+        audio = int(total * audio_ratio)
+        for count in counts:
+            scenarios.append(Scenario(count, total - audio, audio, fragment_seconds))
+    return scenarios
+
+
+def cmd_run(args) -> int:
+    from ffmpeg_resolver import resolve_ffmpeg
+
+    preset = PRESETS[args.preset]
+    counts = [int(c) for c in args.counts.split(",")] if args.counts else preset["counts"]
+    sizes = args.sizes.split(",") if args.sizes else preset["sizes"]
+    paths = args.paths.split(",") if args.paths else ALL_PATHS
+    engines = args.engines.split(",")
+    for name in paths:
+        if name not in ALL_PATHS:
+            print(f"[错误/Error] 未知路径 / Unknown path: {name} ({', '.join(ALL_PATHS)})", file=sys.stderr)
+            return 2
+    for name in engines:
+        if name not in ENGINES:
+            print(f"[错误/Error] 未知引擎 / Unknown engine: {name} ({', '.join(ENGINES)})", file=sys.stderr)
+            return 2
+
+    info = resolve_ffmpeg(args.ffmpeg)
+    if info is None:
+        print("[Bench] 未找到 FFmpeg，需要 FFmpeg 的路径将被跳过 / FFmpeg not found; paths that need it are skipped")
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="m4s_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": _git_info(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "ffmpeg": info.version if info else None,
+        "config": {"counts": counts, "sizes": sizes, "paths": paths, "engines": engines,
+                   "audio_ratio": args.audio_ratio, "fragment_seconds": args.fragment_seconds},
+        "results": [],
+    }
+    try:
+        for scenario in build_scenarios(counts, sizes, args.audio_ratio, args.fragment_seconds):
+            report["results"].extend(run_scenario(scenario, paths, engines, info.path if info else None,
+                                                  work_dir, args.timeout))
+    except KeyboardInterrupt:
+        print("[Bench] 已中断，保存已完成的结果 / Interrupted, saving completed results")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = Path(args.output) if args.output else (
+        BENCH_DIR / "results" / f"{(report['git']['commit'] or 'nogit')[:10]}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[Bench] 结果已保存 / Results saved: {output}")
+    if args.baseline:
+        return compare(args.baseline, str(output))
+    return 0
+
+
+def _index(report: dict) -> Dict[tuple, dict]:
+    return {(r["scenario"], r["path"], r.get("engine")): r for r in report["results"] if r.get("status") == "ok"}
+
+
+def compare(baseline_file: str, current_file: str, threshold: float = 0.10) -> int:
+    """
+    对比两份结果，吞吐下降超过 threshold 时返回 1
+    Compare two reports; returns 1 when throughput drops by more than threshold
+    """
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(current_file, "r", encoding="utf-8") as f:
+        current = json.load(f)
+    old, new = _index(baseline), _index(current)
+    regressions = 0
+    print(f"{'scenario':>12} {'path':<19} {'engine':<7} {'old MB/s':>10} {'new MB/s':>10} {'change':>8} {'rss':>8}")
+    for key in sorted(set(old) & set(new), key=lambda k: (k[0], k[1], k[2] or "")):
+        a, b = old[key], new[key]
+        if not a.get("mb_per_s") or not b.get("mb_per_s"):
+            continue
+        change = b["mb_per_s"] / a["mb_per_s"] - 1
+        rss = ""
+        if a.get("peak_rss_bytes") and b.get("peak_rss_bytes"):
+            rss = f"{b['peak_rss_bytes'] / a['peak_rss_bytes'] - 1:+.0%}"
+        flag = ""
+        if change < -threshold:
+            regressions += 1
+            flag = "  <-- 退化 / regression"
+        print(f"{key[0]:>12} {key[1]:<19} {key[2] or '-':<7} {a['mb_per_s']:10.1f} {b['mb_per_s']:10.1f} "
+              f"{change:+8.0%} {rss:>8}{flag}")
+    print(f"[Bench] {regressions} 项退化 / regression(s) beyond {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def cmd_check(args) -> int:
+    """
+    用真实 FFmpeg 跑一遍 concat 回退路径（禁用原生引擎），确认 pipe:0 上的 ffconcat 列表能被正确解析，
+    输出时长与输入之和一致
+    Run the concat fallback (native engines disabled) against a real FFmpeg to confirm the ffconcat list
+    on pipe:0 is resolved correctly and the output duration matches the sum of the inputs
+    """
+    from ffmpeg_resolver import resolve_ffmpeg
+    from m4s_processor import M4SProcessor
+    from segment_probe import ProbeCache, probe_segments
+
+    info = resolve_ffmpeg(args.ffmpeg)
+    if info is None:
+        print("[Check] 未找到 FFmpeg，无法检查 / FFmpeg not found, nothing checked", file=sys.stderr)
+        return 2
+    work_dir = Path(tempfile.mkdtemp(prefix="m4s_check_"))
+    failures = 0
+    try:
+        video = write_segments(work_dir / "v", VIDEO, args.count, 4 << 20, continuous=args.continuous)
+        audio = write_segments(work_dir / "a", AUDIO, args.count, 1 << 20, continuous=args.continuous)
+        processor = M4SProcessor(ffmpeg_path=info.path, check_ffmpeg=False, use_native=False, use_result_cache=False)
+        cache = ProbeCache(persistent=False)
+        expected_video = sum(i.media_duration for i in probe_segments(video, cache=cache))
+        expected_audio = sum(i.media_duration for i in probe_segments(audio, cache=cache))
+        out_dir = str(work_dir / "out")
+        checks = [
+            ("video", lambda: processor.merge_video_segments(video, out_dir, output_name="video.mp4"), expected_video),
+            ("audio", lambda: processor.merge_audio_segments(audio, out_dir, output_name="audio.m4a"), expected_audio),
+            ("mux", lambda: processor.mux_segments(video, audio, out_dir, output_name="mux.mp4"),
+             max(expected_video, expected_audio)),
+        ]
+        for name, run, expected in checks:
+            try:
+                output = run()
+            except RuntimeError as e:
+                failures += 1
+                print(f"[Check] {name}: 失败 / FAILED\n{e}")
+                continue
+            result = probe_segments([output], cache=cache)[0]
+            duration = result.duration if result is not None else None
+            ok = duration is not None and abs(duration - expected) <= 0.1
+            failures += 0 if ok else 1
+            print(f"[Check] {name}: {'OK' if ok else '失败 / FAILED'} "
+                  f"(duration {duration}, expected {expected:.3f}s)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 1 if failures else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="M4S 合并基准测试 / M4S merge benchmarks")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("run", help="运行基准测试 / Run benchmarks")
+    p.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    p.add_argument("--counts", help="逗号分隔的片段数 / Comma-separated segment counts (1..10000)")
+    p.add_argument("--sizes", help="逗号分隔的总大小 / Comma-separated total sizes, e.g. 1MB,1GB,20GB")
+    p.add_argument("--paths", help=f"要测的路径 / Paths to time ({','.join(ALL_PATHS)})")
+    p.add_argument("--engines", default=",".join(ENGINES), help="拼接引擎 / Concat engines (native,ffmpeg)")
+    p.add_argument("--audio-ratio", type=float, default=0.1, help="音频占总大小的比例 / Audio share of the total size")
+    p.add_argument("--fragment-seconds", type=float, default=2.0, help="每个分片的时长 / Fragment duration")
+    p.add_argument("--ffmpeg", default="ffmpeg", help="FFmpeg 可执行文件 / FFmpeg executable")
+    p.add_argument("--work-dir", help="生成片段的目录（保留不删） / Where segments are generated (kept)")
+    p.add_argument("--timeout", type=float, help="单次测量超时秒数 / Per-measurement timeout in seconds")
+    p.add_argument("-o", "--output", help="结果 JSON 路径 / Result JSON path")
+    p.add_argument("--baseline", help="与此前的结果对比 / Compare against an earlier result")
+
+    p = sub.add_parser("compare", help="对比两份结果 / Compare two results")
+    p.add_argument("baseline")
+    p.add_argument("current")
+    p.add_argument("--threshold", type=float, default=0.10, help="视为退化的吞吐下降比例 / Throughput drop treated as a regression")
+
+    p = sub.add_parser("check", help="用真实 FFmpeg 检查 concat 回退路径 / Check the concat fallback against a real FFmpeg")
+    p.add_argument("--ffmpeg", default="ffmpeg", help="FFmpeg 可执行文件 / FFmpeg executable")
+    p.add_argument("--count", type=int, default=5, help="每路片段数 / Segments per stream")
+    p.add_argument("--continuous", action="store_true", help="tfdt 在片段间连续 / tfdt continues across segments")
+
+    p = sub.add_parser("_one")
+    p.add_argument("spec")
+    p.add_argument("result_file")
+
+    args = parser.parse_args(argv)
+    if args.command == "_one":
+        record = run_one(json.loads(args.spec))
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        return 0
+    if args.command == "compare":
+        return compare(args.baseline, args.current, args.threshold)
+    if args.command == "check":
+        return cmd_check(args)
+    return cmd_run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
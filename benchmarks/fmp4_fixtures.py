@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+合成 fMP4 (.m4s) 测试片段生成器（无需网络和 FFmpeg）
+Synthetic fMP4 (.m4s) segment generator (no network or FFmpeg required)
+
+生成的文件结构与 B 站等 DASH 缓存一致：ftyp + moov(mvex) + 若干 moof/mdat。
+样本数据是伪随机字节，只用于测量拼接/混流的 I/O 路径，不可解码。
+
+Files follow the layout of DASH download caches: ftyp + moov(mvex) + moof/mdat fragments.
+Sample payloads are pseudo-random bytes - good for measuring join/mux I/O, not decodable.
+"""
+
+import argparse
+import struct
+import sys
+from pathlib import Path
+from typing import List
+
+
+def box(box_type: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def full_box(box_type: bytes, version: int, flags: int, *payload: bytes) -> bytes:
+    return box(box_type, struct.pack(">I", (version << 24) | flags), *payload)
+
+
+# 最小的 H.264 High@L3.1 avcC（SPS/PPS 只作占位） / Minimal avcC (placeholder SPS/PPS)
+_AVCC = bytes.fromhex("01640028ffe1001967640028acd940780227e5c044000003000400000301903c60c65801000568ebecb22c")
+# AAC-LC 48 kHz 双声道 esds / AAC-LC 48 kHz stereo esds
+_ESDS_CONFIG = bytes.fromhex("1190")
+
+VIDEO = "video"
+AUDIO = "audio"
+
+
+def _sample_entry(kind: str) -> bytes:
+    if kind == VIDEO:
+        return box(
+            b"avc1",
+            b"\x00" * 6, struct.pack(">H", 1),                # reserved + data_reference_index
+            b"\x00" * 16,                                     # pre_defined / reserved
+            struct.pack(">HH", 1920, 1080),
+            struct.pack(">II", 0x00480000, 0x00480000),       # 72 dpi
+            b"\x00" * 4, struct.pack(">H", 1),                # reserved, frame_count
+            b"\x00" * 32,                                     # compressorname
+            struct.pack(">Hh", 0x18, -1),
+            box(b"avcC", _AVCC),
+        )
+    decoder_specific = b"\x05" + bytes([len(_ESDS_CONFIG)]) + _ESDS_CONFIG
+    decoder_config = b"\x04" + bytes([13 + len(decoder_specific)]) + bytes.fromhex("4015000000000000000000") + b"\x00\x00" + decoder_specific
+    sl_config = b"\x06\x01\x02"
+    es = b"\x03" + bytes([3 + len(decoder_config) + len(sl_config)]) + b"\x00\x01\x00" + decoder_config + sl_config
+    return box(
+        b"mp4a",
+        b"\x00" * 6, struct.pack(">H", 1),
+        b"\x00" * 8,
+        struct.pack(">HH", 2, 16), b"\x00" * 4,
+        struct.pack(">I", 48000 << 16),
+        full_box(b"esds", 0, 0, es),
+    )
+
+
+def init_segment(kind: str, timescale: int, track_id: int = 1) -> bytes:
+    """生成 ftyp + moov / Build ftyp + moov"""
+    is_video = kind == VIDEO
+    ftyp = box(b"ftyp", b"iso5", struct.pack(">I", 1), b"iso5iso6mp41")
+    matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = full_box(
+        b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, 1000, 0), struct.pack(">IH", 0x10000, 0x100),
+        b"\x00" * 10, matrix, b"\x00" * 24, struct.pack(">I", track_id + 1),
+    )
+    width, height = (1920, 1080) if is_video else (0, 0)
+    tkhd = full_box(
+        b"tkhd", 0, 3, struct.pack(">IIII", 0, 0, track_id, 0), struct.pack(">I", 0), b"\x00" * 8,
+        struct.pack(">hhHH", 0, 0, 0 if is_video else 0x100, 0), matrix, struct.pack(">II", width << 16, height << 16),
+    )
+    mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIII", 0, 0, timescale, 0), struct.pack(">HH", 0x55C4, 0))
+    handler = b"vide" if is_video else b"soun"
+    hdlr = full_box(b"hdlr", 0, 0, b"\x00" * 4, handler, b"\x00" * 12, b"Synthetic\x00")
+    media_header = full_box(b"vmhd", 0, 1, b"\x00" * 8) if is_video else full_box(b"smhd", 0, 0, b"\x00" * 4)
+    dinf = box(b"dinf", full_box(b"dref", 0, 0, struct.pack(">I", 1), full_box(b"url ", 0, 1)))
+    stbl = box(
+        b"stbl",
+        full_box(b"stsd", 0, 0, struct.pack(">I", 1), _sample_entry(kind)),
+        full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+        full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+        full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+        full_box(b"stco", 0, 0, struct.pack(">I", 0)),
+    )
+    trak = box(b"trak", tkhd, box(b"mdia", mdhd, hdlr, box(b"minf", media_header, dinf, stbl)))
+    mvex = box(b"mvex", full_box(b"trex", 0, 0, struct.pack(">IIIII", track_id, 1, 0, 0, 0)))
+    return ftyp + box(b"moov", mvhd, trak, mvex)
+
+
+def moof_box(sequence: int, track_id: int, decode_time: int, sample_sizes: List[int], sample_duration: int) -> bytes:
+    """生成引用紧随其后 mdat 的 moof / Build a moof referencing the mdat that follows it"""
+    count = len(sample_sizes)
+    mfhd = full_box(b"mfhd", 0, 0, struct.pack(">I", sequence))
+    tfhd = full_box(b"tfhd", 0, 0x020000, struct.pack(">I", track_id))
+    tfdt = full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time))
+    samples = b"".join(struct.pack(">III", sample_duration, size, 0x02000000 if i == 0 else 0x01010000)
+                       for i, size in enumerate(sample_sizes))
+    trun_size = 8 + 4 + 4 + 4 + len(samples)
+    traf_size = 8 + len(tfhd) + len(tfdt) + trun_size
+    moof_size = 8 + len(mfhd) + traf_size
+    trun = full_box(b"trun", 0, 0x000701, struct.pack(">Ii", count, moof_size + 8), samples)
+    moof = box(b"moof", mfhd, box(b"traf", tfhd, tfdt, trun))
+    assert len(moof) == moof_size
+    return moof
+
+
+def write_segments(out_dir: Path, kind: str, count: int, total_bytes: int, fragment_seconds: float = 2.0,
+                   fragments_per_segment: int = 1, continuous: bool = False, seed: int = 1) -> List[str]:
+    """
+    生成 count 个独立的 .m4s 片段（每个都带 ftyp/moov），总大小约 total_bytes
+    Write count self-contained .m4s segments (each with ftyp/moov), roughly total_bytes in total
+
+    continuous=True 时 tfdt 在片段间连续（DASH 媒体段风格），否则每个片段都从 0 开始。
+    continuous=True keeps tfdt running across segments (DASH style); otherwise each starts at 0.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    timescale = 90000 if kind == VIDEO else 48000
+    sample_duration = 3000 if kind == VIDEO else 1024
+    samples_per_fragment = max(1, int(fragment_seconds * timescale / sample_duration))
+    per_fragment = max(samples_per_fragment, total_bytes // max(1, count * fragments_per_segment))
+    sample_size = max(1, per_fragment // samples_per_fragment)
+    block = _random_block(seed, 1 << 20)
+
+    init = init_segment(kind, timescale)
+    paths = []
+    decode_time = 0
+    for index in range(count):
+        path = out_dir / f"{kind}_{index:05d}.m4s"
+        with open(path, "wb") as f:
+            f.write(init)
+            if not continuous:
+                decode_time = 0
+            for n in range(fragments_per_segment):
+                sizes = [sample_size] * samples_per_fragment
+                payload_len = sum(sizes)
+                f.write(moof_box(n + 1, 1, decode_time, sizes, sample_duration))
+                f.write(struct.pack(">I4s", 8 + payload_len, b"mdat"))
+                _write_payload(f, block, payload_len)
+                decode_time += samples_per_fragment * sample_duration
+        paths.append(str(path))
+    return paths
+
+
+def _random_block(seed: int, size: int) -> bytes:
+    import random
+    rng = random.Random(seed)
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def _write_payload(f, block: bytes, length: int):
+    while length > 0:
+        chunk = block[:min(len(block), length)]
+        f.write(chunk)
+        length -= len(chunk)
+
+
+def parse_size(text: str) -> int:
+    """解析 "20GB"/"512MB" 之类的大小 / Parse sizes like "20GB" or "512MB" """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="生成合成 .m4s 片段 / Generate synthetic .m4s segments")
+    parser.add_argument("output_dir")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--size", default="10MB", help="视频总大小 / total video size")
+    parser.add_argument("--audio-ratio", type=float, default=0.1)
+    parser.add_argument("--fragment-seconds", type=float, default=2.0)
+    parser.add_argument("--continuous", action="store_true")
+    args = parser.parse_args(argv)
+
+    total = parse_size(args.size)
+    out = Path(args.output_dir)
+    video = write_segments(out / VIDEO, VIDEO, args.count, total, args.fragment_seconds, continuous=args.continuous)
+    audio = write_segments(out / AUDIO, AUDIO, args.count, int(total * args.audio_ratio), args.fragment_seconds,
+                           continuous=args.continuous, seed=2)
+    print(f"{len(video)} video + {len(audio)} audio segments -> {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
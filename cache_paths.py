@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地缓存目录定位
+Local Cache Directory Lookup
+
+缓存位置优先级 / Cache location priority:
+    1. 环境变量 M4S_TOOLS_CACHE_DIR / the M4S_TOOLS_CACHE_DIR environment variable
+    2. Windows: %LOCALAPPDATA%\\M4S-Tools\\cache
+    3. 其他系统 / Other systems: $XDG_CACHE_HOME/m4s-tools 或 / or ~/.cache/m4s-tools
+"""
+
+import os
+import sys
+from pathlib import Path
+
+CACHE_DIR_ENV = "M4S_TOOLS_CACHE_DIR"
+
+
+def get_cache_dir(create: bool = True) -> Path:
+    """
+    返回缓存根目录，必要时创建
+    Return the cache root directory, creating it if needed
+    """
+    override = os.environ.get(CACHE_DIR_ENV)
+    if override:
+        path = Path(override)
+    elif sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or str(Path.home() / "AppData" / "Local")
+        path = Path(base) / "M4S-Tools" / "cache"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+        path = Path(base) / "m4s-tools"
+    if create:
+        path.mkdir(parents=True, exist_ok=True)
+    return path
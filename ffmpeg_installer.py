@@ -34,18 +34,12 @@ class FFmpegInstaller:
             (是否已安装, FFmpeg 路径)
         """
         try:
-            result = subprocess.run(
-                [ffmpeg_path, "-version"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=True,
-                timeout=10
-            )
-            # 获取 FFmpeg 的完整路径
-            which_result = shutil.which(ffmpeg_path)
-            return True, which_result if which_result else ffmpeg_path
-        except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-            return False, None
+            # 与 M4SProcessor 共用查找逻辑和能力缓存 / Shares discovery and the capability cache with M4SProcessor
+            from ffmpeg_resolver import resolve_ffmpeg
+            info = resolve_ffmpeg(ffmpeg_path)
+            if info is None:
+                return False, None
+            return True, info.path
         except Exception as e:
             print(f"检查 FFmpeg 时出错 / Error checking FFmpeg: {e}")
             return False, None
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FFmpeg 查找与能力缓存
+FFmpeg Discovery and Capability Cache
+
+按顺序在显式路径、环境变量 M4S_FFMPEG、程序自带目录、安装器默认目录和 PATH 中查找 FFmpeg，
+首次发现时运行一次 "-version / -muxers / -demuxers / -protocols"，把路径、版本和支持的
+封装器、解封装器、协议持久化到缓存。缓存按可执行文件的 (路径, 大小, 修改时间) 失效，
+热启动完全不启动子进程。
+
+FFmpeg is looked up in the explicit path, the M4S_FFMPEG environment variable, the bundled
+directory, the installer's default directory and PATH, in that order. The first time a binary
+is seen, "-version / -muxers / -demuxers / -protocols" run once and the path, version and
+supported muxers, demuxers and protocols are persisted. The cache is invalidated by the
+binary's (path, size, mtime), so warm starts spawn no subprocess at all.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
+
+from cache_paths import get_cache_dir
+
+FFMPEG_ENV = "M4S_FFMPEG"
+CACHE_VERSION = 1
+PROBE_TIMEOUT = 10
+EXE_NAME = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
+
+
+class FFmpegInfo(NamedTuple):
+    """一个可用 FFmpeg 的路径、版本与能力 / Path, version and capabilities of a usable FFmpeg"""
+    path: str
+    size: int
+    mtime_ns: int
+    version: str
+    muxers: List[str]
+    demuxers: List[str]
+    input_protocols: List[str]
+    output_protocols: List[str]
+
+    def has_muxer(self, name: str) -> bool:
+        return name in self.muxers
+
+    def has_demuxer(self, name: str) -> bool:
+        return name in self.demuxers
+
+    def has_protocol(self, name: str, output: bool = False) -> bool:
+        return name in (self.output_protocols if output else self.input_protocols)
+
+
+def _app_dirs() -> List[Path]:
+    """程序自带 FFmpeg 可能所在的目录 / Directories that may hold a bundled FFmpeg"""
+    dirs = []
+    if getattr(sys, "frozen", False):
+        dirs.append(Path(sys.executable).parent)
+        if hasattr(sys, "_MEIPASS"):
+            dirs.append(Path(sys._MEIPASS))
+    dirs.append(Path(__file__).resolve().parent)
+    return dirs
+
+
+def candidate_paths(preferred: str = "ffmpeg") -> Iterator[str]:
+    """
+    按优先级产出候选可执行文件；preferred 含目录时只检查它本身
+    Yield candidate executables by priority; a preferred path with a directory is the only candidate
+    """
+    if os.path.dirname(preferred):
+        yield preferred
+        return
+    env = os.environ.get(FFMPEG_ENV)
+    if env:
+        yield env
+    for base in _app_dirs():
+        yield str(base / EXE_NAME)
+        yield str(base / "ffmpeg" / "bin" / EXE_NAME)
+    # FFmpegInstaller 默认解压到 ~/ffmpeg/<版本目录>/bin / FFmpegInstaller extracts to ~/ffmpeg/<build>/bin by default
+    install_root = Path.home() / "ffmpeg"
+    if install_root.is_dir():
+        for bin_dir in sorted(install_root.glob("*/bin"), reverse=True):
+            yield str(bin_dir / EXE_NAME)
+    found = shutil.which(preferred)
+    if found:
+        yield found
+
+
+def _run(path: str, *args: str) -> Optional[str]:
+    # 在一次性的临时目录中运行：若 path 不是真正的 FFmpeg，把 "-muxers" 等参数当作输出文件名，
+    # 也不会在当前目录留下文件
+    # Run inside a throwaway directory so a binary that is not really FFmpeg and treats "-muxers"
+    # and friends as output names cannot leave files in the current directory
+    if os.path.dirname(path):
+        # 相对路径换成绝对路径，裸命令名仍按 PATH 查找 / Relative paths become absolute; bare names still use PATH
+        path = os.path.abspath(path)
+    try:
+        with tempfile.TemporaryDirectory(prefix="m4s_probe_") as scratch:
+            result = subprocess.run([path, "-hide_banner"] + list(args), stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    timeout=PROBE_TIMEOUT, cwd=scratch)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode("utf-8", errors="ignore")
+
+
+def _parse_formats(text: Optional[str]) -> List[str]:
+    """解析 -muxers / -demuxers 的输出（"--" 分隔行之后每行为 "标志 名称 描述"） / Parse -muxers / -demuxers output"""
+    names = []
+    started = False
+    for line in (text or "").splitlines():
+        if line.strip() and set(line.strip()) == {"-"}:
+            started = True
+            continue
+        parts = line.split()
+        if started and len(parts) >= 2:
+            names.extend(parts[1].split(","))
+    return sorted(set(names))
+
+
+def _parse_protocols(text: Optional[str]):
+    inputs, outputs, current = [], [], None
+    for line in (text or "").splitlines():
+        stripped = line.strip()
+        if stripped == "Input:":
+            current = inputs
+        elif stripped == "Output:":
+            current = outputs
+        elif stripped and current is not None and line.startswith(" "):
+            current.append(stripped)
+    return sorted(set(inputs)), sorted(set(outputs))
+
+
+def probe_ffmpeg(path: str) -> Optional[FFmpegInfo]:
+    """
+    运行 FFmpeg 读取版本与能力（会启动子进程）；不可用时返回 None
+    Run FFmpeg to read its version and capabilities (spawns subprocesses); None if unusable
+    """
+    version_text = _run(path, "-version")
+    if not version_text or not version_text.strip():
+        return None
+    st = os.stat(path)
+    inputs, outputs = _parse_protocols(_run(path, "-protocols"))
+    return FFmpegInfo(
+        path=os.path.abspath(path),
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        version=version_text.strip().splitlines()[0],
+        muxers=_parse_formats(_run(path, "-muxers")),
+        demuxers=_parse_formats(_run(path, "-demuxers")),
+        input_protocols=inputs,
+        output_protocols=outputs,
+    )
+
+
+class FFmpegResolver:
+    """带持久化缓存的 FFmpeg 查找器 / FFmpeg finder with a persistent cache"""
+
+    def __init__(self, cache_path: Optional[str] = None):
+        self.cache_path = Path(cache_path) if cache_path else get_cache_dir() / "ffmpeg_capabilities.json"
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data.get("binaries", {}) if data.get("version") == CACHE_VERSION else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, binaries: dict):
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".ffmpeg_", suffix=".tmp", dir=str(self.cache_path.parent))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "binaries": binaries}, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"[FFmpeg] 无法写入能力缓存 / Could not write capability cache: {e}")
+
+    def lookup(self, path: str, refresh: bool = False) -> Optional[FFmpegInfo]:
+        """
+        返回单个可执行文件的信息；缓存有效时不启动子进程
+        Info for one executable; no subprocess when the cache entry is still valid
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            binaries = self._load()
+            entry = binaries.get(key)
+            if (not refresh and entry and entry.get("size") == st.st_size
+                    and entry.get("mtime_ns") == st.st_mtime_ns):
+                return FFmpegInfo(**entry)
+        info = probe_ffmpeg(path)
+        if info is None:
+            return None
+        with self._lock:
+            binaries = self._load()
+            binaries[key] = info._asdict()
+            self._save(binaries)
+        return info
+
+    def resolve(self, preferred: str = "ffmpeg", refresh: bool = False) -> Optional[FFmpegInfo]:
+        """
+        查找第一个可用的 FFmpeg / Find the first usable FFmpeg
+
+        Args:
+            preferred: 可执行文件名或路径 / Executable name or path
+            refresh: 忽略缓存重新探测 / Ignore the cache and probe again
+        """
+        seen = set()
+        for path in candidate_paths(preferred):
+            key = os.path.normcase(os.path.abspath(path))
+            if key in seen or not os.path.isfile(path):
+                continue
+            seen.add(key)
+            info = self.lookup(path, refresh)
+            if info is not None:
+                return info
+        return None
+
+
+_default_resolver: Optional[FFmpegResolver] = None
+_default_lock = threading.Lock()
+
+
+def default_resolver() -> FFmpegResolver:
+    global _default_resolver
+    with _default_lock:
+        if _default_resolver is None:
+            _default_resolver = FFmpegResolver()
+        return _default_resolver
+
+
+def resolve_ffmpeg(preferred: str = "ffmpeg", refresh: bool = False) -> Optional[FFmpegInfo]:
+    """用默认缓存查找 FFmpeg / Resolve FFmpeg with the default cache"""
+    return default_resolver().resolve(preferred, refresh)
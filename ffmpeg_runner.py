@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FFmpeg 进程运行与进度解析
+FFmpeg Process Runner and Progress Parsing
+
+通过 "-progress pipe:1" 逐行读取 FFmpeg 的进度输出，并以
+(stage, current, total, message) 的形式回调，与 FFmpegInstaller 的进度回调约定一致。
+
+Reads FFmpeg's "-progress pipe:1" output line by line and reports it as
+(stage, current, total, message) callbacks, the same convention FFmpegInstaller uses.
+"""
+
+import asyncio
+import re
+import subprocess
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from m4s_job import JobCancelledError, M4SJob
+
+
+# 进度回调 / Progress callback: (stage, current, total, message)
+ProgressCallback = Callable[[str, int, int, str], None]
+
+# 各阶段的双语名称 / Bilingual stage labels
+STAGE_LABELS = {
+    "video": "合并视频 / Merging video",
+    "audio": "合并音频 / Merging audio",
+    "mux": "混流 / Muxing",
+}
+
+
+# stderr 环形缓冲区保留的行数与单行最大长度 / Lines kept in the stderr ring buffer, max length per line
+STDERR_TAIL_LINES = 200
+STDERR_MAX_LINE = 1000
+# 报错信息中附带的尾部行数 / Tail lines included in error messages
+ERROR_TAIL_LINES = 20
+
+# "[mp4 @ 0x55d5c8] message" 形式的组件日志 / Component log lines like "[mp4 @ 0x55d5c8] message"
+_COMPONENT_LINE = re.compile(r"^\[(?P<component>[^\]@]+?) @ (?:0x)?[0-9a-fA-F]+\]\s*(?P<message>.*)$")
+_NUMBERS = re.compile(r"\d+")
+
+
+class StderrTail:
+    """
+    FFmpeg stderr 的定长尾部缓冲区和按类别计数的警告统计，内存占用与运行时长无关
+    Fixed-size tail of FFmpeg stderr plus per-category warning counts; memory stays
+    constant however long FFmpeg runs
+    """
+
+    def __init__(self, max_lines: int = STDERR_TAIL_LINES, max_categories: int = 100):
+        self.lines = deque(maxlen=max_lines)
+        self.warnings: Counter = Counter()
+        self.max_categories = max_categories
+        self.total_lines = 0
+
+    def feed(self, line: str):
+        line = line.rstrip()
+        if not line:
+            return
+        self.total_lines += 1
+        if len(line) > STDERR_MAX_LINE:
+            line = line[:STDERR_MAX_LINE] + "..."
+        self.lines.append(line)
+        match = _COMPONENT_LINE.match(line)
+        if match:
+            # 去掉数字，把同类警告（如逐包时间戳警告）归为一类 / Strip numbers so per-packet warnings share a key
+            key = f"{match.group('component').strip()}: {_NUMBERS.sub('#', match.group('message'))[:80]}"
+            if key in self.warnings or len(self.warnings) < self.max_categories:
+                self.warnings[key] += 1
+            else:
+                self.warnings["(other)"] += 1
+
+    def tail(self, count: int = ERROR_TAIL_LINES) -> str:
+        """返回最后 count 行 / Return the last count lines"""
+        lines = list(self.lines)[-count:]
+        return "\n".join(lines)
+
+
+class FFmpegResult(NamedTuple):
+    """FFmpeg 运行结果 / FFmpeg run result"""
+    returncode: int
+    stderr: str
+    warnings: Dict[str, int]
+    stderr_lines: int
+    # 创建 FFmpeg 进程所用时间 / Time taken to spawn the FFmpeg process
+    spawn_seconds: float = 0.0
+    # 开始创建进程的时刻（time.time()） / When spawning began (time.time())
+    spawn_started: float = 0.0
+
+    def error_text(self) -> str:
+        """
+        报错用的精简信息：stderr 尾部加警告统计
+        Compact text for errors: the stderr tail plus warning counts
+        """
+        text = self.stderr
+        if self.stderr_lines > ERROR_TAIL_LINES:
+            text = f"... ({self.stderr_lines - ERROR_TAIL_LINES} 行已省略 / lines omitted)\n{text}"
+        if self.warnings:
+            top = sorted(self.warnings.items(), key=lambda item: -item[1])[:5]
+            text += "\n警告统计 / Warning counts:\n" + "\n".join(f"  {count} x {key}" for key, count in top)
+        return text or "未知错误 / Unknown error"
+
+
+class ProgressTracker:
+    """
+    根据已完成量计算百分比、吞吐量和剩余时间，并调用回调
+    Turn completed amounts into percent, throughput and ETA, then invoke the callback
+
+    current/total 的单位由调用方决定（FFmpeg 为微秒，原生拷贝为字节）；
+    total 未知时为 -1。
+    current/total units are up to the caller (microseconds for FFmpeg, bytes for native copies);
+    total is -1 when unknown.
+    """
+
+    def __init__(self, stage: str, total: int, callback: Optional[ProgressCallback], min_interval: float = 0.25):
+        self.stage = stage
+        self.total = total if total and total > 0 else -1
+        self.callback = callback
+        self.min_interval = min_interval
+        self.started = time.monotonic()
+        self._last_emit = 0.0
+
+    def update(self, current: int, bytes_written: int, force: bool = False):
+        if not self.callback:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_emit < self.min_interval:
+            return
+        self._last_emit = now
+        self.callback(self.stage, current, self.total, self.format(current, bytes_written, now))
+
+    def format(self, current: int, bytes_written: int, now: Optional[float] = None) -> str:
+        elapsed = max((now or time.monotonic()) - self.started, 1e-6)
+        rate = bytes_written / 1024 / 1024 / elapsed
+        label = STAGE_LABELS.get(self.stage, self.stage)
+        if self.total > 0:
+            fraction = min(max(current / self.total, 0.0), 1.0)
+            eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+            eta_text = _format_seconds(eta) if eta is not None else "--:--:--"
+            return f"{label}: {fraction * 100:.1f}% | {rate:.1f} MB/s | ETA {eta_text}"
+        return f"{label}: {bytes_written / 1024 / 1024:.1f} MB | {rate:.1f} MB/s"
+
+
+class ProgressParser:
+    """解析 "-progress" 输出的 key=value 行并更新 tracker / Parse "-progress" key=value lines into a tracker"""
+
+    def __init__(self, tracker: ProgressTracker):
+        self.tracker = tracker
+        self.current_us = 0
+        self.total_size = 0
+
+    def feed(self, raw: bytes):
+        key, _, value = raw.decode("utf-8", errors="ignore").strip().partition("=")
+        if key == "out_time_us" or key == "out_time_ms":
+            # 旧版 FFmpeg 的 out_time_ms 实际单位也是微秒 / out_time_ms is microseconds too on old FFmpeg
+            self.current_us = _to_int(value, self.current_us)
+        elif key == "total_size":
+            self.total_size = _to_int(value, self.total_size)
+        elif key == "progress":
+            self.tracker.update(self.current_us, self.total_size, force=(value == "end"))
+
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def with_progress_args(cmd: List[str]) -> List[str]:
+    """在可执行文件之后插入进度输出参数 / Insert progress output flags right after the executable"""
+    return [cmd[0], "-hide_banner", "-progress", "pipe:1", "-nostats"] + list(cmd[1:])
+
+
+def run_ffmpeg(cmd: List[str], stage: str = "", total_duration_us: Optional[int] = None,
+               progress_callback: Optional[ProgressCallback] = None, timeout: float = 3600,
+               job: Optional[M4SJob] = None, input_data: Optional[bytes] = None) -> FFmpegResult:
+    """
+    用 Popen 运行 FFmpeg 并实时解析进度
+    Run FFmpeg via Popen and parse its progress as it streams
+
+    Args:
+        cmd: FFmpeg 命令（不含进度参数） / FFmpeg command (without progress flags)
+        stage: 阶段名，传给回调 / Stage name passed to the callback
+        total_duration_us: 预计输出时长（微秒），用于计算百分比 / Expected output duration (µs) for percent
+        progress_callback: 进度回调 (stage, current, total, message) / Progress callback
+        timeout: 超时秒数 / Timeout in seconds
+        job: 可选任务句柄，取消时终止进程 / Optional job handle; the process is killed on cancel
+        input_data: 写入 stdin 的数据（如 pipe:0 上的 concat 列表） / Data written to stdin (e.g. a concat list on pipe:0)
+
+    Raises:
+        subprocess.TimeoutExpired: 超时后进程已被终止 / the process was killed after the timeout
+        JobCancelledError: 任务被取消 / the job was cancelled
+    """
+    spawn_started = time.time()
+    spawn_clock = time.perf_counter()
+    process = subprocess.Popen(
+        with_progress_args(cmd),
+        stdin=subprocess.DEVNULL if input_data is None else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    spawn_seconds = time.perf_counter() - spawn_clock
+    if job is not None:
+        job.attach_process(process)
+    stderr_tail = StderrTail()
+    stderr_thread = threading.Thread(target=_drain, args=(process.stderr, stderr_tail), daemon=True)
+    stderr_thread.start()
+    if input_data is not None:
+        # 另起线程写入，避免列表较大时与进度输出互相阻塞 / Write on a thread so a large list cannot deadlock against progress output
+        threading.Thread(target=_feed, args=(process.stdin, input_data), daemon=True).start()
+
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        process.kill()
+
+    watchdog = threading.Timer(timeout, on_timeout)
+    watchdog.daemon = True
+    watchdog.start()
+
+    parser = ProgressParser(ProgressTracker(stage, total_duration_us or -1, progress_callback))
+    try:
+        for raw in process.stdout:
+            parser.feed(raw)
+        process.wait()
+    finally:
+        watchdog.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        stderr_thread.join()
+        process.stdout.close()
+        if job is not None:
+            job.detach_process(process)
+
+    if job is not None and job.cancelled:
+        raise JobCancelledError()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return FFmpegResult(process.returncode, stderr_tail.tail(), dict(stderr_tail.warnings), stderr_tail.total_lines,
+                        spawn_seconds, spawn_started)
+
+
+async def run_ffmpeg_async(cmd: List[str], stage: str = "", total_duration_us: Optional[int] = None,
+                           progress_callback: Optional[ProgressCallback] = None,
+                           timeout: float = 3600, input_data: Optional[bytes] = None) -> FFmpegResult:
+    """
+    run_ffmpeg 的 asyncio 版本：不占用线程，进度回调在事件循环线程中调用
+    asyncio version of run_ffmpeg: no thread is held, and progress callbacks run on the event loop thread
+
+    取消所在任务会立即终止 FFmpeg 并抛出 asyncio.CancelledError。Windows 上需要
+    ProactorEventLoop（Python 3.8 起为默认）。
+    Cancelling the calling task kills FFmpeg at once and raises asyncio.CancelledError.
+    Windows needs the ProactorEventLoop (the default since Python 3.8).
+
+    Raises:
+        subprocess.TimeoutExpired: 超时后进程已被终止 / the process was killed after the timeout
+    """
+    spawn_started = time.time()
+    spawn_clock = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *with_progress_args(cmd),
+        stdin=subprocess.DEVNULL if input_data is None else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    spawn_seconds = time.perf_counter() - spawn_clock
+    stderr_tail = StderrTail()
+    stderr_task = asyncio.ensure_future(_drain_async(process.stderr, stderr_tail))
+    feed_task = asyncio.ensure_future(_feed_async(process.stdin, input_data)) if input_data is not None else None
+    parser = ProgressParser(ProgressTracker(stage, total_duration_us or -1, progress_callback))
+
+    async def read_progress():
+        async for raw in process.stdout:
+            parser.feed(raw)
+        await process.wait()
+
+    try:
+        await asyncio.wait_for(read_progress(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    finally:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        await stderr_task
+        if feed_task is not None:
+            await feed_task
+    return FFmpegResult(process.returncode, stderr_tail.tail(), dict(stderr_tail.warnings), stderr_tail.total_lines,
+                        spawn_seconds, spawn_started)
+
+
+async def _drain_async(stream: asyncio.StreamReader, tail: StderrTail):
+    """_drain 的 asyncio 版本 / asyncio version of _drain"""
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            # 单行超过缓冲上限时该行被丢弃 / A line longer than the buffer limit is dropped
+            continue
+        if not line:
+            break
+        tail.feed(line.decode("utf-8", errors="ignore"))
+
+
+def _feed(stream, data: bytes):
+    """把数据写入子进程 stdin 后关闭；进程提前退出时忽略 / Write data to a child's stdin and close it; ignore an early exit"""
+    try:
+        stream.write(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+async def _feed_async(stream: asyncio.StreamWriter, data: bytes):
+    """_feed 的 asyncio 版本 / asyncio version of _feed"""
+    try:
+        stream.write(data)
+        await stream.drain()
+    except OSError:
+        pass
+    finally:
+        stream.close()
+
+
+def _drain(stream, tail: StderrTail):
+    """逐行消费 stderr，单行长度有上限 / Consume stderr line by line with a bounded line length"""
+    try:
+        while True:
+            line = stream.readline(STDERR_MAX_LINE * 4)
+            if not line:
+                break
+            tail.feed(line.decode("utf-8", errors="ignore"))
+    finally:
+        stream.close()
+
+
+def _to_int(value: str, default: int) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        return default
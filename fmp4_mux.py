@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+原生 fMP4 音视频混流（一路视频 + 一路音频，不经过 FFmpeg）
+Native fragmented-MP4 muxer for one video plus one audio stream (bypasses FFmpeg)
+
+视频和音频输入本身都是带完整编码参数的 fMP4。混流只需：
+    1. 以视频的 moov 为基础，加入音频的 trak，并在 mvex 中为两条轨道各放一个 trex；
+    2. 把轨道 ID 重新编号为 1（视频）和 2（音频）；
+    3. 按解码时间交错两路的 moof/mdat 分片，改写序号和轨道 ID；
+    4. 用内核拷贝原语原样搬运 mdat。
+整个过程只处理元数据，不逐包解析，速度取决于磁盘 I/O。输入不满足条件时抛出 NativeMuxError，
+调用方应回退到 FFmpeg。
+
+Both inputs are already fMP4 with complete codec configuration. Muxing only needs to:
+    1. take the video moov, add the audio trak, and give mvex one trex per track;
+    2. renumber the tracks to 1 (video) and 2 (audio);
+    3. interleave both streams' moof/mdat fragments by decode time, rewriting sequence numbers and track IDs;
+    4. move every mdat unchanged with kernel copy primitives.
+Only metadata is touched - there is no per-packet work - so speed is bound by disk I/O. Unsuitable input
+raises NativeMuxError and callers should fall back to FFmpeg.
+"""
+
+import heapq
+import os
+import struct
+from typing import Callable, List, Optional, Tuple
+
+from mp4_boxes import BoxError, find_child, iter_child_boxes, parse_moof, parse_moov
+from native_concat import Fragment, NativeConcatenator, NativeConcatError, SegmentScan
+
+VIDEO_TRACK_ID = 1
+AUDIO_TRACK_ID = 2
+
+
+class NativeMuxError(NativeConcatError):
+    """输入不适合原生混流，应回退到 FFmpeg / Input unsuitable for native muxing; fall back to FFmpeg"""
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _children(data: bytes) -> List[Tuple[bytes, bytes]]:
+    """返回 data 中第一个盒的 (类型, 字节) 子盒列表 / (type, bytes) of the children of the first box in data"""
+    parent = next(iter_child_boxes(data))
+    return [(child.type, bytes(data[child.offset:child.end]))
+            for child in iter_child_boxes(data, parent.payload_offset, parent.end)]
+
+
+def _split_init(init: bytes) -> Tuple[bytes, bytes]:
+    """把扫描得到的初始化信息拆成 ftyp 和 moov / Split scanned init data into ftyp and moov"""
+    ftyp, moov = b"", b""
+    for child in iter_child_boxes(init):
+        if child.type == b"ftyp":
+            ftyp = bytes(init[child.offset:child.end])
+        elif child.type == b"moov":
+            moov = bytes(init[child.offset:child.end])
+    return ftyp, moov
+
+
+def _renumber_trak(trak: bytes, track_id: int) -> bytes:
+    """改写 trak 中 tkhd 的轨道 ID / Rewrite the track ID in a trak's tkhd"""
+    data = bytearray(trak)
+    parent = next(iter_child_boxes(data))
+    tkhd = find_child(data, b"tkhd", parent.payload_offset, parent.end)
+    if tkhd is None:
+        raise NativeMuxError("trak 缺少 tkhd / trak has no tkhd")
+    version = data[tkhd.payload_offset]
+    struct.pack_into(">I", data, tkhd.payload_offset + (20 if version == 1 else 12), track_id)
+    return bytes(data)
+
+
+def _renumber_trex(trex: bytes, track_id: int) -> bytes:
+    data = bytearray(trex)
+    parent = next(iter_child_boxes(data))
+    struct.pack_into(">I", data, parent.payload_offset + 4, track_id)
+    return bytes(data)
+
+
+class FragmentedMuxer:
+    """原生 fMP4 混流器 / Native fMP4 muxer"""
+
+    def __init__(self):
+        self.concatenator = NativeConcatenator()
+
+    def _scan(self, files: List[str], handler: str) -> SegmentScan:
+        """扫描一路输入（可以是多个片段），要求只有一条指定类型的轨道 / Scan one stream (possibly several segments); it must hold a single track of the given type"""
+        scan = self.concatenator.scan(files, rebase=False)
+        tracks = list(scan.movie.tracks.values())
+        if len(tracks) != 1:
+            raise NativeMuxError(f"输入应只包含一条轨道 / Input must hold exactly one track: {files[0]} has {len(tracks)}")
+        if tracks[0].handler != handler:
+            raise NativeMuxError(f"轨道类型应为 {handler} / Expected a '{handler}' track, got '{tracks[0].handler}': {files[0]}")
+        return scan
+
+    def plan(self, video_files: List[str], audio_files: List[str]) -> SegmentScan:
+        """
+        扫描两路输入并生成混流后的初始化信息和交错分片（只读取元数据）
+        Scan both streams and build the muxed init data and interleaved fragments (metadata only)
+
+        Raises:
+            NativeMuxError / NativeConcatError: 输入不适合原生混流 / input is unsuitable for native muxing
+        """
+        video = self._scan(video_files, "vide")
+        audio = self._scan(audio_files, "soun")
+        try:
+            ftyp, video_moov = _split_init(video.init)
+            _, audio_moov = _split_init(audio.init)
+            moov = self._build_moov(video_moov, audio_moov)
+            movie = parse_moov(moov)
+        except (BoxError, struct.error, StopIteration) as e:
+            raise NativeMuxError(f"moov 无法合并 / Cannot combine moov boxes: {e}")
+        init = bytearray(ftyp + moov)
+
+        (video_id, video_track), = video.movie.tracks.items()
+        (audio_id, audio_track), = audio.movie.tracks.items()
+        end_times = {VIDEO_TRACK_ID: video.end_times.get(video_id, 0), AUDIO_TRACK_ID: audio.end_times.get(audio_id, 0)}
+        if movie.mehd_offset is not None:
+            longest = max(end_times[VIDEO_TRACK_ID] / video_track.timescale, end_times[AUDIO_TRACK_ID] / audio_track.timescale)
+            duration = int(longest * movie.timescale)
+            if movie.mehd_version == 1:
+                struct.pack_into(">Q", init, len(ftyp) + movie.mehd_offset, duration)
+            elif duration <= 0xFFFFFFFF:
+                struct.pack_into(">I", init, len(ftyp) + movie.mehd_offset, duration)
+
+        def timeline(scan: SegmentScan, source_id: int, timescale: int, track_id: int):
+            # (解码时间（秒）, 新轨道 ID, 解码时间, 在单路拼接输出中的偏移, 分片)
+            # (decode time in s, new track ID, decode time, offset in the single-stream output, fragment)
+            offset = len(scan.init)
+            for fragment in scan.fragments:
+                decode_time = fragment.decode_times[source_id]
+                yield decode_time / timescale, track_id, decode_time, offset, fragment
+                offset += len(fragment.moof) + fragment.mdat_size
+
+        fragments: List[Fragment] = []
+        output_offset = len(init)
+        merged = heapq.merge(timeline(video, video_id, video_track.timescale, VIDEO_TRACK_ID),
+                             timeline(audio, audio_id, audio_track.timescale, AUDIO_TRACK_ID),
+                             key=lambda item: (item[0], item[1]))
+        for sequence, (_, track_id, decode_time, scanned_offset, fragment) in enumerate(merged, 1):
+            moof = self._rewrite_moof(fragment, sequence, track_id, scanned_offset, output_offset)
+            fragments.append(fragment._replace(moof=moof, decode_times={track_id: decode_time}))
+            output_offset += len(moof) + fragment.mdat_size
+        return SegmentScan(bytes(init), movie, None, fragments, end_times, output_offset)
+
+    def mux(self, video_files: List[str], audio_files: List[str], output_path: str,
+            progress_callback: Optional[Callable[[int, int], None]] = None) -> int:
+        """
+        把一路视频和一路音频混流为一个 fMP4 文件，返回写入的字节数
+        Mux one video and one audio stream into a single fMP4 file and return the number of bytes written
+
+        Raises:
+            NativeMuxError / NativeConcatError: 输入不适合原生混流 / input is unsuitable for native muxing
+        """
+        plan = self.plan(video_files, audio_files)
+        try:
+            with open(output_path, "wb", buffering=0) as out:
+                self.concatenator.write(plan, out, progress_callback)
+        except BaseException:
+            if os.path.exists(output_path):
+                try:
+                    os.unlink(output_path)
+                except OSError:
+                    pass
+            raise
+        return plan.total_bytes
+
+    @staticmethod
+    def _build_moov(video_moov: bytes, audio_moov: bytes) -> bytes:
+        """以视频 moov 为基础加入音频轨道 / Add the audio track to the video moov"""
+        # 音频 tkhd/elst 按其 mvhd 时间基计时，不一致时合并后的时长和编辑列表会出错
+        # The audio tkhd/elst count in its own mvhd timescale; combining mismatched ones corrupts durations and edits
+        video_scale, audio_scale = parse_moov(video_moov).timescale, parse_moov(audio_moov).timescale
+        if video_scale != audio_scale:
+            raise NativeMuxError(f"视频与音频的 mvhd 时间基不同 / Video and audio mvhd timescales differ: "
+                                 f"{video_scale} vs {audio_scale}")
+        audio_trak, audio_trex = None, None
+        for box_type, data in _children(audio_moov):
+            if box_type == b"trak":
+                audio_trak = _renumber_trak(data, AUDIO_TRACK_ID)
+            elif box_type == b"mvex":
+                for sub_type, sub in _children(data):
+                    if sub_type == b"trex":
+                        audio_trex = _renumber_trex(sub, AUDIO_TRACK_ID)
+        if audio_trak is None or audio_trex is None:
+            raise NativeMuxError("音频 moov 缺少 trak 或 trex / Audio moov lacks a trak or trex")
+
+        parts = []
+        for box_type, data in _children(video_moov):
+            if box_type == b"mvhd":
+                # next_track_ID 是 mvhd 的最后 4 字节 / next_track_ID is the last 4 bytes of mvhd
+                data = data[:-4] + struct.pack(">I", AUDIO_TRACK_ID + 1)
+            elif box_type == b"trak":
+                parts.append(_renumber_trak(data, VIDEO_TRACK_ID))
+                data = audio_trak
+            elif box_type == b"mvex":
+                mvex = []
+                for sub_type, sub in _children(data):
+                    if sub_type == b"trex":
+                        mvex += [_renumber_trex(sub, VIDEO_TRACK_ID), audio_trex]
+                    elif sub_type == b"mehd":
+                        mvex.append(sub)
+                data = _box(b"mvex", b"".join(mvex))
+            parts.append(data)
+        return _box(b"moov", b"".join(parts))
+
+    @staticmethod
+    def _rewrite_moof(fragment: Fragment, sequence: int, track_id: int,
+                      scanned_offset: int, output_offset: int) -> bytearray:
+        """改写序号、轨道 ID 和绝对数据偏移 / Rewrite sequence number, track ID and absolute data offsets"""
+        moof = bytearray(fragment.moof)
+        try:
+            info = parse_moof(bytes(moof))
+        except BoxError as e:
+            raise NativeMuxError(f"moof 无法解析 / Cannot parse moof in {fragment.source}: {e}")
+        struct.pack_into(">I", moof, info.sequence_number_pos, sequence)
+        for traf in info.trafs:
+            struct.pack_into(">I", moof, traf.track_id_pos, track_id)
+            if traf.base_data_offset_pos is not None:
+                struct.pack_into(">Q", moof, traf.base_data_offset_pos,
+                                 traf.base_data_offset - scanned_offset + output_offset)
+        return moof
+
+
+def mux_av(video_files: List[str], audio_files: List[str], output_path: str,
+           progress_callback: Optional[Callable[[int, int], None]] = None) -> int:
+    """FragmentedMuxer().mux 的简写 / Shorthand for FragmentedMuxer().mux"""
+    return FragmentedMuxer().mux(video_files, audio_files, output_path, progress_callback)
@@ -7,8 +7,11 @@ M4S 文件处理工具 - GUI 界面 (Final Perfect Version)
 """
 
 import tkinter as tk
+import tkinter.font as tkfont
 from tkinter import filedialog, messagebox
+import queue
 import threading
+import time
 import traceback
 import os
 import sys
@@ -28,8 +31,11 @@ except ImportError:
     sys.exit(1)
 
 try:
+    from m4s_job import M4SJob
     from m4s_processor import M4SProcessor
+    from segment_probe import probe_segments
     from ffmpeg_installer import FFmpegInstaller
+    from ffmpeg_resolver import resolve_ffmpeg
 except ImportError:
     sys.exit(1)
 
@@ -51,6 +57,7 @@ TRANS = {
         "btn_merge": "Mux (Merge all into one file)",
         "btn_video": "Merge Video",
         "btn_audio": "Merge Audio",
+        "btn_cancel": "Cancel All",
         
         # 提示语
         "multi_hint": "💡 Tip: Use Ctrl+Click to select multiple files in the specific order you want them merged.",
@@ -60,6 +67,7 @@ TRANS = {
         "log_step_v_end": "视频合并完成。| Video merge completed.",
         "log_step_a_end": "音频合并完成。| Audio merge completed. ",
         "log_step_m_start": "开始混流... | Starting muxing process...",
+        "log_bytes_written": "写入数据量 | Bytes written:",
         
         "theme_dark": "Dark",
         "theme_light": "Light",
@@ -73,7 +81,25 @@ TRANS = {
         "no_video": "Please select video files first.",
         "no_audio": "Please select audio files first.",
         "need_both": "Need both video and audio files.",
-        "ffmpeg_wait": "FFmpeg is initializing, please wait..."
+        "ffmpeg_wait": "FFmpeg is initializing, please wait...",
+        "cancelling": "Cancelling, stopping FFmpeg...",
+        "cancelled": "Task cancelled, partial output removed.",
+
+        # 任务队列
+        "queue_title": "Job Queue",
+        "parallel": "Parallel:",
+        "clear_done": "Clear Done",
+        "job_video": "Video",
+        "job_audio": "Audio",
+        "job_full": "Mux",
+        "job_files": "files",
+        "job_queued": "Queued",
+        "job_pending": "Queued",
+        "job_running": "Running",
+        "job_done": "Done",
+        "job_failed": "Failed",
+        "job_cancelled": "Cancelled",
+        "job_cancelling": "Cancelling..."
     },
     "zh": {
         "title": "M4S 合并工具",
@@ -91,6 +117,7 @@ TRANS = {
         "btn_merge": "混流(合并所有音视频成1个文件)",
         "btn_video": "仅合并视频",
         "btn_audio": "仅合并音频",
+        "btn_cancel": "全部取消",
         
         # 提示语
         "multi_hint": "💡 提示：在选择文件时按住 Ctrl 键依次点击，软件将按照您选择的先后顺序进行合并。",
@@ -100,6 +127,7 @@ TRANS = {
         "log_step_v_end": "视频合并完成。| Video merge completed.",
         "log_step_a_end": "音频合并完成。| Audio merge completed. ",
         "log_step_m_start": "开始混流... | Starting muxing process...",
+        "log_bytes_written": "写入数据量 | Bytes written:",
         
         "theme_dark": "深色模式",
         "theme_light": "浅色模式",
@@ -113,11 +141,39 @@ TRANS = {
         "no_video": "请先选择视频文件。",
         "no_audio": "请先选择音频文件。",
         "need_both": "需要同时选择视频和音频文件。",
-        "ffmpeg_wait": "FFmpeg 初始化中，请稍候..."
+        "ffmpeg_wait": "FFmpeg 初始化中，请稍候...",
+        "cancelling": "正在取消，停止 FFmpeg...",
+        "cancelled": "任务已取消，未完成的输出已删除。",
+
+        # 任务队列
+        "queue_title": "任务队列",
+        "parallel": "并行数:",
+        "clear_done": "清除已完成",
+        "job_video": "视频",
+        "job_audio": "音频",
+        "job_full": "混流",
+        "job_files": "个文件",
+        "job_queued": "已加入队列",
+        "job_pending": "排队中",
+        "job_running": "运行中",
+        "job_done": "完成",
+        "job_failed": "失败",
+        "job_cancelled": "已取消",
+        "job_cancelling": "取消中..."
     }
 }
 
 # 颜色配置
+LOG_FILE_ENV = "M4S_GUI_LOG_FILE"
+# 队列默认/最大并行数与刷新间隔 / Default and maximum queue parallelism, refresh interval
+DEFAULT_PARALLEL_JOBS = 2
+MAX_PARALLEL_JOBS = 4
+QUEUE_REFRESH_MS = 250
+# 关闭窗口时等待任务退出的轮询间隔与上限 / Poll interval and limit while waiting for jobs on close
+CLOSE_POLL_MS = 100
+CLOSE_TIMEOUT_SECONDS = 5
+OUTPUT_PREFIXES = {"video": "Merged_Video", "audio": "Merged_Audio", "full": "Muxed_Output"}
+
 COLORS = {
     "bg": ("#f1f5f9", "#020617"),          
     "card": ("#ffffff", "#0f172a"),        
@@ -133,6 +189,386 @@ COLORS = {
     "secondary_hover": ("#94a3b8", "#475569")
 }
 
+class VirtualFileList:
+    """
+    虚拟化文件列表：只绘制可见行，文件大小和时长由后台线程分批加载
+    Virtualized file list: only visible rows are drawn; sizes and durations load in batches on a background thread
+
+    选择上万个片段或网络共享上的文件时，逐行创建控件并在 Tk 线程上 stat 会让窗口卡住数秒。
+    这里用一个 Canvas 和一小组复用的画布条目显示当前视口内的行，后台线程通过 probe_segments
+    获取元数据（同时预热探测缓存），结果经队列批量交回 Tk 线程。
+    Creating widgets per row and stat-ing on the Tk thread freezes the window for seconds with tens of
+    thousands of segments or files on a network share. Here a single Canvas shows the rows inside the
+    viewport with a small pool of reused canvas items; a background thread fetches metadata through
+    probe_segments (which also warms the probe cache) and hands results back to the Tk thread in batches.
+    """
+
+    CHUNK = 256      # 每批探测的文件数 / Files probed per batch
+    POLL_MS = 50     # Tk 线程合并结果的间隔 / Interval at which the Tk thread applies results
+    HEIGHT = 100
+
+    def __init__(self, parent, font, detail_font, on_empty_click):
+        self.on_empty_click = on_empty_click
+        self.files = []
+        self.details = []          # 每个文件的 (大小, 时长)，未加载时为 None / (size, duration) per file, None until loaded
+        self.selected = None
+        self.placeholder = ""
+        self.generation = 0
+        self.results = queue.Queue()
+        self.poll_id = None
+        self.pool = []             # 复用的 (背景, 名称, 详情) 条目 / Reused (background, name, detail) items
+
+        self.frame = ctk.CTkFrame(parent, fg_color="transparent")
+        self.font = tkfont.Font(font=font)
+        self.detail_font = tkfont.Font(font=detail_font)
+        self.row_height = max(self.font.metrics("linespace"), self.detail_font.metrics("linespace")) + 6
+        self.char_width = max(1, self.font.measure("0"))
+
+        self.canvas = tk.Canvas(self.frame, height=self.HEIGHT, highlightthickness=0, bd=0,
+                                yscrollincrement=self.row_height, takefocus=1)
+        self.scrollbar = ctk.CTkScrollbar(self.frame, command=self.canvas.yview,
+                                          button_color=COLORS["card_border"])
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.canvas.pack(side="left", fill="both", expand=True, padx=(10, 0))
+        self.scrollbar.pack(side="right", fill="y")
+        self.placeholder_item = self.canvas.create_text(0, 0, text="", font=font, state="hidden")
+
+        self.canvas.bind("<Configure>", lambda e: self._layout())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-3, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(3, "units"))
+        self.canvas.bind("<Up>", lambda e: self._move_selection(-1))
+        self.canvas.bind("<Down>", lambda e: self._move_selection(1))
+        self.canvas.bind("<Prior>", lambda e: self._move_selection(-self._visible_rows()))
+        self.canvas.bind("<Next>", lambda e: self._move_selection(self._visible_rows()))
+        self.canvas.bind("<Home>", lambda e: self._move_selection(-len(self.files)))
+        self.canvas.bind("<End>", lambda e: self._move_selection(len(self.files)))
+        self.apply_theme()
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    # --- 数据 / Data ---
+    def set_files(self, files):
+        """替换列表内容并在后台加载元数据 / Replace the list and load metadata in the background"""
+        self.generation += 1
+        self.files = list(files)
+        self.details = [None] * len(self.files)
+        self.selected = None
+        self.canvas.yview_moveto(0)
+        self._layout()
+        if self.poll_id is not None:
+            self.canvas.after_cancel(self.poll_id)
+            self.poll_id = None
+        if self.files:
+            threading.Thread(target=self._load, args=(self.generation, self.files), daemon=True).start()
+            self.poll_id = self.canvas.after(self.POLL_MS, self._poll)
+
+    def _load(self, generation, files):
+        """后台线程：分批 stat + 探测 / Background thread: stat and probe in batches"""
+        for start in range(0, len(files), self.CHUNK):
+            if generation != self.generation:
+                return
+            chunk = files[start:start + self.CHUNK]
+            details = []
+            for path, info in zip(chunk, probe_segments(chunk)):
+                if info is not None:
+                    details.append((info.size, info.duration))
+                    continue
+                try:
+                    details.append((os.path.getsize(path), None))
+                except OSError:
+                    details.append((None, None))
+            self.results.put((generation, start, details))
+        self.results.put((generation, None, None))
+
+    def _poll(self):
+        """在 Tk 线程上合并已完成的批次，只重绘一次 / Apply finished batches on the Tk thread with a single redraw"""
+        self.poll_id = None
+        changed, finished = False, False
+        while True:
+            try:
+                generation, start, details = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.generation:
+                continue
+            if start is None:
+                finished = True
+            else:
+                self.details[start:start + len(details)] = details
+                changed = True
+        if changed:
+            self._redraw()
+        if not finished:
+            self.poll_id = self.canvas.after(self.POLL_MS, self._poll)
+
+    # --- 外观 / Appearance ---
+    def set_placeholder(self, text):
+        self.placeholder = text
+        self._redraw()
+
+    def apply_theme(self):
+        """按当前外观模式取色 / Pick colors for the current appearance mode"""
+        index = 1 if ctk.get_appearance_mode() == "Dark" else 0
+        self.colors = {key: COLORS[key][index] for key in ("input_bg", "text_main", "text_body", "card_border")}
+        self.canvas.configure(bg=self.colors["input_bg"])
+        for background, name, detail in self.pool:
+            self.canvas.itemconfigure(background, fill=self.colors["card_border"])
+            self.canvas.itemconfigure(name, fill=self.colors["text_main"])
+            self.canvas.itemconfigure(detail, fill=self.colors["text_body"])
+        self.canvas.itemconfigure(self.placeholder_item, fill=self.colors["text_body"])
+        self._redraw()
+
+    # --- 绘制 / Drawing ---
+    def _layout(self):
+        width = max(self.canvas.winfo_width(), 1)
+        self.canvas.configure(scrollregion=(0, 0, width, len(self.files) * self.row_height))
+        self._redraw()
+
+    def _visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._redraw()
+
+    def _redraw(self):
+        """把条目池摆到视口内的行上 / Place the item pool on the rows inside the viewport"""
+        width = max(self.canvas.winfo_width(), 1)
+        height = max(self.canvas.winfo_height(), self.HEIGHT)
+        if not self.files:
+            for items in self.pool:
+                for item in items:
+                    self.canvas.itemconfigure(item, state="hidden")
+            self.canvas.coords(self.placeholder_item, width / 2, height / 2)
+            self.canvas.itemconfigure(self.placeholder_item, text=self.placeholder, state="normal")
+            return
+        self.canvas.itemconfigure(self.placeholder_item, state="hidden")
+
+        first = max(0, int(self.canvas.canvasy(0)) // self.row_height)
+        count = min(len(self.files) - first, height // self.row_height + 2)
+        while len(self.pool) < count:
+            self.pool.append((
+                self.canvas.create_rectangle(0, 0, 0, 0, width=0, fill=self.colors["card_border"]),
+                self.canvas.create_text(0, 0, anchor="w", font=self.font, fill=self.colors["text_main"]),
+                self.canvas.create_text(0, 0, anchor="e", font=self.detail_font, fill=self.colors["text_body"]),
+            ))
+
+        max_chars = max(8, (width - self.detail_font.measure("0000.0 MB · 00:00:00") - 16) // self.char_width)
+        for slot, (background, name, detail) in enumerate(self.pool):
+            index = first + slot
+            if slot >= count:
+                for item in (background, name, detail):
+                    self.canvas.itemconfigure(item, state="hidden")
+                continue
+            top = index * self.row_height
+            middle = top + self.row_height / 2
+            label = os.path.basename(self.files[index])
+            if len(label) > max_chars:
+                label = label[:max_chars - 3] + "..."
+            self.canvas.coords(background, 0, top, width, top + self.row_height)
+            self.canvas.itemconfigure(background, state="normal" if index == self.selected else "hidden")
+            self.canvas.coords(name, 4, middle)
+            self.canvas.itemconfigure(name, text=label, state="normal")
+            self.canvas.coords(detail, width - 8, middle)
+            self.canvas.itemconfigure(detail, text=self._format_detail(self.details[index]), state="normal")
+
+    @staticmethod
+    def _format_detail(detail):
+        if detail is None:
+            return "..."
+        size, duration = detail
+        if size is None:
+            return "?"
+        text = f"{size / 1024 / 1024:.1f} MB"
+        if duration:
+            minutes, seconds = divmod(int(duration), 60)
+            hours, minutes = divmod(minutes, 60)
+            text = (f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}") + " · " + text
+        return text
+
+    # --- 交互 / Interaction ---
+    def _on_click(self, event):
+        self.canvas.focus_set()
+        if not self.files:
+            self.on_empty_click()
+            return
+        index = int(self.canvas.canvasy(event.y)) // self.row_height
+        if 0 <= index < len(self.files):
+            self.selected = index
+            self._redraw()
+
+    def _on_wheel(self, event):
+        # Windows 每格 120，macOS 为小整数 / 120 per notch on Windows, small integers on macOS
+        step = 3 * (event.delta // 120) if abs(event.delta) >= 120 else event.delta
+        self.canvas.yview_scroll(-step, "units")
+
+    def _move_selection(self, step):
+        if not self.files:
+            return
+        current = self.selected if self.selected is not None else (-1 if step > 0 else len(self.files))
+        self.selected = min(max(current + step, 0), len(self.files) - 1)
+        # 保证选中行可见 / Keep the selected row in view
+        top = int(self.canvas.canvasy(0)) // self.row_height
+        visible = self._visible_rows()
+        if self.selected < top:
+            self.canvas.yview_scroll(self.selected - top, "units")
+        elif self.selected >= top + visible:
+            self.canvas.yview_scroll(self.selected - top - visible + 1, "units")
+        self._redraw()
+        return "break"
+
+
+class LogSink:
+    """
+    批量写入的 GUI 日志：任意线程把消息放进队列，Tk 线程按固定节拍一次插入，并限制保留的行数
+    Batched GUI log: any thread queues messages, the Tk thread inserts them in one go on a fixed
+    cadence, and the visible history is capped
+
+    设置环境变量 M4S_GUI_LOG_FILE 后，完整日志同时写入按大小轮转的文件（由后台线程写盘）。
+    With M4S_GUI_LOG_FILE set, the full log is also written to a size-rotated file (on a background thread).
+    """
+
+    INTERVAL_MS = 100     # 合并写入的节拍 / Flush cadence
+    MAX_LINES = 2000      # 文本框保留的行数 / Lines kept in the textbox
+    FILE_MAX_BYTES = 5 * 1024 * 1024
+    FILE_BACKUPS = 3
+
+    def __init__(self, textbox, log_file=None):
+        self.textbox = textbox
+        self.pending = queue.Queue()
+        self.lines = 0
+        self.listener = None
+        self.file_logger = None
+        log_file = log_file or os.environ.get(LOG_FILE_ENV)
+        if log_file:
+            try:
+                self._open_file(log_file)
+            except OSError as e:
+                self.write(f"[Log] 无法打开日志文件 / Cannot open log file {log_file}: {e}")
+        self.after_id = self.textbox.after(self.INTERVAL_MS, self._drain)
+
+    def _open_file(self, path):
+        import logging
+        import logging.handlers
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=self.FILE_MAX_BYTES, backupCount=self.FILE_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        records = queue.Queue()
+        self.listener = logging.handlers.QueueListener(records, handler)
+        self.listener.start()
+        self.file_logger = logging.getLogger(f"m4s_gui_{id(self)}")
+        self.file_logger.propagate = False
+        self.file_logger.setLevel(logging.INFO)
+        self.file_logger.addHandler(logging.handlers.QueueHandler(records))
+
+    def write(self, message):
+        """可在任意线程调用 / Safe to call from any thread"""
+        line = f"[{time.strftime('%H:%M:%S')}] {message}"
+        self.pending.put(line)
+        if self.file_logger is not None:
+            self.file_logger.info(line)
+
+    def _drain(self):
+        self.after_id = None
+        batch = []
+        while True:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            # 超出上限的行插入后也会被裁掉，直接跳过 / Lines beyond the cap would be trimmed anyway; skip them
+            if len(batch) > self.MAX_LINES:
+                skipped = len(batch) - self.MAX_LINES + 1
+                batch = [f"... 省略 {skipped} 行 / {skipped} lines omitted"] + batch[-(self.MAX_LINES - 1):]
+            self._insert(batch)
+        self.after_id = self.textbox.after(self.INTERVAL_MS, self._drain)
+
+    def _insert(self, batch):
+        self.textbox.configure(state="normal")
+        self.textbox.insert("end", "\n".join(batch) + "\n")
+        self.lines += len(batch)
+        if self.lines > self.MAX_LINES:
+            excess = self.lines - self.MAX_LINES
+            self.textbox.delete("1.0", f"{excess + 1}.0")
+            self.lines = self.MAX_LINES
+        self.textbox.see("end")
+        self.textbox.configure(state="disabled")
+
+    def close(self):
+        """停止定时器并把剩余日志写盘 / Stop the timer and flush the remaining log to disk"""
+        if self.after_id is not None:
+            self.textbox.after_cancel(self.after_id)
+            self.after_id = None
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+class QueuedJob:
+    """GUI 队列中的一个合并任务 / One merge task in the GUI queue"""
+
+    # 每类任务依次报告进度的阶段；一键处理是单次混流，只报告 "mux"
+    # Stages each kind of task reports progress for, in order; full processing is a single-pass mux reporting only "mux"
+    STAGES = {"video": ("video",), "audio": ("audio",), "full": ("mux",)}
+
+    def __init__(self, number, kind, video_files, audio_files, output_dir):
+        self.number = number
+        self.kind = kind
+        self.video_files = list(video_files)
+        self.audio_files = list(audio_files)
+        self.output_dir = output_dir
+        self.job = M4SJob(f"{kind}-{number}")
+        self.input_bytes = 0
+        self.progress = {}     # 阶段 -> 完成比例，由任务线程写入 / stage -> fraction done, written by the job thread
+        self.started = None
+        self.finished = None
+        self.row = None
+
+    @property
+    def state(self):
+        return self.job.status
+
+    def fraction(self):
+        """
+        整体完成比例；后续阶段出现时前面缺失的阶段按已完成计
+        Overall fraction done; stages missing before one that has reported count as complete
+        """
+        stages = self.STAGES[self.kind]
+        seen = [index for index, stage in enumerate(stages) if stage in self.progress]
+        if not seen:
+            return 0.0
+        done = sum(self.progress.get(stage, 1.0 if index < seen[-1] else 0.0) for index, stage in enumerate(stages))
+        return done / len(stages)
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def throughput(self):
+        """按输入字节估算的处理速度（字节/秒） / Processing rate estimated from input bytes (bytes/s)"""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        done = 1.0 if self.state == M4SJob.SUCCEEDED else self.fraction()
+        return self.input_bytes * done / elapsed
+
+
+def _total_size(paths):
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
 class M4SProcessorApp:
     def __init__(self):
         ctk.set_appearance_mode("Dark")
@@ -144,7 +580,7 @@ class M4SProcessorApp:
         self.t = TRANS[self.lang]
         
         self.root.title("M4S Merger GUI")
-        self.root.geometry("830x900") 
+        self.root.geometry("830x980") 
         self.root.minsize(830, 650)
         self.root.configure(fg_color=COLORS["bg"])
         
@@ -161,7 +597,11 @@ class M4SProcessorApp:
         self.video_files = []
         self.audio_files = []
         self.output_dir = self._get_default_output_dir()
-        self.is_processing = False
+        self.jobs = []
+        self.job_counter = 0
+        self.max_parallel = DEFAULT_PARALLEL_JOBS
+        self._closing = False
+        self._close_deadline = 0.0
         
         self.ui_refs = {} 
         self.processor = None
@@ -169,6 +609,7 @@ class M4SProcessorApp:
         self.ffmpeg_checking = False
 
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
         self.root.after(200, self._start_ffmpeg_check)
 
     def _start_ffmpeg_check(self):
@@ -179,17 +620,19 @@ class M4SProcessorApp:
             self.log("[FFmpeg] 检查中... | Checking FFmpeg availability...")
 
         def worker():
-            available = M4SProcessor.check_ffmpeg_available()
-            self.root.after(0, lambda: self._on_ffmpeg_check_finished(available))
+            # 热启动时直接命中能力缓存，不启动 FFmpeg / Warm starts hit the capability cache without spawning FFmpeg
+            info = resolve_ffmpeg()
+            self.root.after(0, lambda: self._on_ffmpeg_check_finished(info))
 
         threading.Thread(target=worker, daemon=True).start()
 
-    def _on_ffmpeg_check_finished(self, available: bool):
+    def _on_ffmpeg_check_finished(self, info):
         self.ffmpeg_checking = False
-        if available:
-            self.processor = M4SProcessor(check_ffmpeg=False)
+        if info is not None:
+            self.processor = M4SProcessor(ffmpeg_path=info.path, check_ffmpeg=False)
             self.processor_ready = True
-            self.log("[FFmpeg] 已就绪。| FFmpeg ready.")
+            self.log(f"[FFmpeg] 已就绪。| FFmpeg ready: {info.version}")
+            self._pump_queue()
         else:
             self.install_ffmpeg_dialog()
 
@@ -231,16 +674,24 @@ class M4SProcessorApp:
         self.ui_refs["btn_merge"].configure(text=t["btn_merge"])
         self.ui_refs["btn_v"].configure(text=t["btn_video"])
         self.ui_refs["btn_a"].configure(text=t["btn_audio"])
+        self.ui_refs["btn_cancel"].configure(text=t["btn_cancel"])
         
         # 标签和提示
         self._update_path_label()
         self.ui_refs["format_hint"].configure(text=t["format_hint"])
         self.ui_refs["multi_hint"].configure(text=t["multi_hint"])
         self.ui_refs["log_title"].configure(text=f">_ {t['log_title']}")
+        self.ui_refs["queue_title"].configure(text=t["queue_title"])
+        self.ui_refs["parallel_label"].configure(text=t["parallel"])
+        self.ui_refs["clear_done_btn"].configure(text=t["clear_done"])
+        for entry in self.jobs:
+            self._update_job_row(entry)
+        self._update_queue_summary()
         
-        # 刷新占位符
-        if not self.video_files: self._show_placeholder(self.video_list_ui, self.select_video_files)
-        if not self.audio_files: self._show_placeholder(self.audio_list_ui, self.select_audio_files)
+        # 刷新列表占位符和配色
+        for list_ui in (self.video_list_ui, self.audio_list_ui):
+            list_ui.set_placeholder(t["placeholder"])
+            list_ui.apply_theme()
 
     def setup_ui(self):
         self.main_frame = ctk.CTkFrame(self.root, fg_color="transparent")
@@ -359,6 +810,18 @@ class M4SProcessorApp:
         )
         self.ui_refs["btn_v"].pack(side="right", padx=5)
 
+        # 取消按钮：仅在任务运行时可用 / Cancel button: only enabled while a task runs
+        self.ui_refs["btn_cancel"] = ctk.CTkButton(
+            btn_box, text="", font=self.font_body, height=45, width=90,
+            fg_color=COLORS["secondary_btn"], hover_color=COLORS["secondary_hover"],
+            text_color=COLORS["text_main"], state="disabled",
+            command=self.cancel_task
+        )
+        self.ui_refs["btn_cancel"].pack(side="right", padx=5)
+
+        # --- 任务队列 ---
+        self._create_queue_panel(main_card)
+
         # --- 日志 ---
         self._create_log_viewer(main_card)
         self.refresh_text()
@@ -382,10 +845,10 @@ class M4SProcessorApp:
         ).pack(side="right")
         
         # 列表
-        list_frame = ctk.CTkScrollableFrame(container, height=70, fg_color="transparent", scrollbar_button_color=COLORS["card_border"])
+        cmd_add = self.select_video_files if type_key == "video" else self.select_audio_files
+        list_frame = VirtualFileList(container, self.font_body, ("Consolas", 12), cmd_add)
         list_frame.pack(fill="both", expand=True, padx=5)
         
-        cmd_add = self.select_video_files if type_key == "video" else self.select_audio_files
         if type_key == "video": self.video_list_ui = list_frame
         else: self.audio_list_ui = list_frame
             
@@ -400,30 +863,6 @@ class M4SProcessorApp:
         btn.pack(fill="x")
         self.ui_refs[f"{type_key}_sel_btn"] = btn
 
-    def _show_placeholder(self, frame, cmd):
-        for w in frame.winfo_children(): w.destroy()
-        wrap = ctk.CTkFrame(frame, fg_color="transparent")
-        wrap.pack(expand=True, fill="both", pady=(65,0))
-        ctk.CTkButton(
-            wrap, text=self.t["placeholder"], fg_color="transparent", 
-            text_color=COLORS["text_body"], hover=False, font=self.font_body, command=cmd
-        ).pack(expand=True)
-
-    def _update_file_list(self, list_ui, files, add_cmd):
-        for w in list_ui.winfo_children(): w.destroy()
-        if not files:
-            self._show_placeholder(list_ui, add_cmd)
-            return
-        for f in files:
-            path = Path(f)
-            size_mb = os.path.getsize(f) / 1024 / 1024
-            row = ctk.CTkFrame(list_ui, fg_color="transparent")
-            row.pack(fill="x", pady=2)
-            name = path.name
-            if len(name) > 45: name = name[:42] + "..."
-            ctk.CTkLabel(row, text=name, text_color=COLORS["text_main"], anchor="w", font=self.font_body).pack(side="left")
-            ctk.CTkLabel(row, text=f"{size_mb:.1f} MB", text_color=COLORS["text_body"], font=("Consolas", 12)).pack(side="right")
-
     def _create_log_viewer(self, parent):
         # 修改：日志框背景纯黑，统一圆角
         cont = ctk.CTkFrame(parent, fg_color=COLORS["terminal_bg"], corner_radius=8)
@@ -445,6 +884,7 @@ class M4SProcessorApp:
         )
         self.log_text.pack(fill="both", expand=True, padx=5, pady=(0, 5))
         self.log_text.configure(state="disabled")
+        self.log_sink = LogSink(self.log_text)
 
     def _get_default_output_dir(self) -> str:
         """Return the user's Desktop path when available, otherwise fallback to CWD."""
@@ -458,42 +898,30 @@ class M4SProcessorApp:
         val = self.output_dir if self.output_dir else self.t["output_auto"]
         self.ui_refs["output_label"].configure(text=f"{prefix} {val}")
     
-    def _ensure_processor_ready(self) -> bool:
-        if self.processor_ready and self.processor:
-            return True
-        messagebox.showinfo(self.t["error"], self.t["ffmpeg_wait"])
-        if not self.ffmpeg_checking:
-            self._start_ffmpeg_check()
-        return False
-
     # --- 逻辑层 ---
     def log(self, message):
-        self.log_text.configure(state="normal")
-        import datetime
-        t_str = datetime.datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert("end", f"[{t_str}] {message}\n")
-        self.log_text.see("end")
-        self.log_text.configure(state="disabled")
+        """写入日志，可在任意线程调用 / Append to the log; safe from any thread"""
+        self.log_sink.write(message)
 
     def select_video_files(self):
         files = filedialog.askopenfilenames(filetypes=[("M4S", "*.m4s"), ("All", "*.*")])
         if files:
             self.video_files = list(files)
-            self._update_file_list(self.video_list_ui, self.video_files, self.select_video_files)
+            self.video_list_ui.set_files(self.video_files)
 
     def select_audio_files(self):
         files = filedialog.askopenfilenames(filetypes=[("M4S", "*.m4s"), ("All", "*.*")])
         if files:
             self.audio_files = list(files)
-            self._update_file_list(self.audio_list_ui, self.audio_files, self.select_audio_files)
+            self.audio_list_ui.set_files(self.audio_files)
 
     def clear_video_files(self):
         self.video_files = []
-        self._update_file_list(self.video_list_ui, [], self.select_video_files)
+        self.video_list_ui.set_files([])
 
     def clear_audio_files(self):
         self.audio_files = []
-        self._update_file_list(self.audio_list_ui, [], self.select_audio_files)
+        self.audio_list_ui.set_files([])
 
     def select_output_dir(self):
         path = filedialog.askdirectory()
@@ -501,79 +929,294 @@ class M4SProcessorApp:
             self.output_dir = path
             self._update_path_label()
 
-    def _run_task(self, name_key, task_func):
-        if self.is_processing: return
-        
-        if "video" in name_key.lower() and not self.video_files:
-            messagebox.showwarning(self.t["error"], self.t["no_video"])
+    # --- 任务队列 / Job queue ---
+    def _enqueue(self, kind):
+        """把当前选择的文件加入队列；可以连续加入多组 / Queue the current selection; many sets can be queued in a row"""
+        if kind in ("video", "full") and not self.video_files:
+            messagebox.showwarning(self.t["error"], self.t["no_video" if kind == "video" else "need_both"])
             return
-        if "audio" in name_key.lower() and not self.audio_files:
-            messagebox.showwarning(self.t["error"], self.t["no_audio"])
+        if kind in ("audio", "full") and not self.audio_files:
+            messagebox.showwarning(self.t["error"], self.t["no_audio" if kind == "audio" else "need_both"])
             return
-            
+
         if not self.output_dir:
             self.output_dir = self._get_default_output_dir()
             self._update_path_label()
 
-        if not self._ensure_processor_ready():
-            return
+        self.job_counter += 1
+        entry = QueuedJob(self.job_counter, kind,
+                          self.video_files if kind != "audio" else [],
+                          self.audio_files if kind != "video" else [],
+                          self.output_dir)
+        self.jobs.append(entry)
+        self._create_job_row(entry)
+        self.log(f"#{entry.number} {self.t['job_queued']} ({self.t['job_' + kind]})")
+        if not self.processor_ready:
+            # 任务保持排队，FFmpeg 就绪后自动开始 / Jobs stay queued and start once FFmpeg is ready
+            self.log(self.t["ffmpeg_wait"])
+            self._start_ffmpeg_check()
+        self._pump_queue()
 
-        self.is_processing = True
-        self.log(f"{self.t['processing']} ({name_key})")
-        
-        def run():
-            try:
-                res = task_func()
-                self.root.after(0, lambda: self._on_finish(True, res))
-            except Exception as e:
-                self.root.after(0, lambda: self._on_finish(False, str(e)))
-        threading.Thread(target=run, daemon=True).start()
-
-    def _on_finish(self, success, msg):
-        self.is_processing = False
-        if success:
-            self.log(f"{self.t['success']}! {msg}")
-            messagebox.showinfo(self.t["success"], f"{self.t['saved']}\n{msg}")
-            try: os.startfile(os.path.dirname(msg))
+    def _pump_queue(self):
+        """按并行数启动排队中的任务 / Start queued jobs up to the parallelism limit"""
+        if self.processor_ready and self.processor:
+            # 已启动但线程尚未把状态改为 running 的任务也要计入 / Count jobs started but not yet marked running too
+            running = sum(1 for entry in self.jobs if entry.started is not None and entry.finished is None)
+            for entry in self.jobs:
+                if running >= self.max_parallel:
+                    break
+                if entry.state == M4SJob.PENDING and entry.started is None and not entry.job.cancelled:
+                    self._start_job(entry)
+                    running += 1
+        self._update_queue_summary()
+
+    def _start_job(self, entry):
+        # 任务函数接收任务句柄，取消时由句柄终止 FFmpeg 并删除未完成的输出
+        # The task receives the job handle, which kills FFmpeg and removes partial output on cancel
+        entry.started = time.monotonic()
+        entry.job.add_done_callback(lambda j: self._schedule_job_done(entry))
+        entry.job.start(lambda: self._run_job(entry))
+        self.log(f"#{entry.number} {self.t['processing']}")
+
+    def _run_job(self, entry):
+        """在任务线程中执行 / Runs on the job thread"""
+        entry.input_bytes = _total_size(entry.video_files + entry.audio_files)
+        callback = self._progress_logger(entry)
+        name = f"{OUTPUT_PREFIXES[entry.kind]}_{time.strftime('%Y-%m-%d_%H-%M-%S')}_{entry.number}.mp4"
+        if entry.kind == "video":
+            return self.processor.merge_video_segments(entry.video_files, entry.output_dir, output_name=name,
+                                                       progress_callback=callback, job=entry.job)
+        if entry.kind == "audio":
+            return self.processor.merge_audio_segments(entry.audio_files, entry.output_dir, output_name=name,
+                                                       progress_callback=callback, job=entry.job)
+        # 单次混流：视频和音频片段由同一次调用直接写入最终文件
+        # Single-pass mux: both segment lists go straight into the final file
+        self.log(f"#{entry.number} {self.t['log_step_m_start']}")
+        stage_bytes = {}
+        final_path = self.processor.process_all(
+            entry.video_files, entry.audio_files, entry.output_dir, stage_bytes=stage_bytes,
+            output_name=name, progress_callback=callback, job=entry.job
+        )
+        written = sum(stage_bytes.values()) / 1024 / 1024
+        self.log(f"#{entry.number} {self.t['log_bytes_written']} {written:.1f} MB")
+        return final_path
+
+    def _schedule_job_done(self, entry):
+        """
+        任务完成回调（在任务线程中）；窗口关闭后 Tk 已不可用，不再排队
+        Job done callback (on the job thread); once the window is closing Tk is off limits, so nothing is queued
+        """
+        if self._closing:
+            return
+        try:
+            self.root.after(0, lambda: self._on_job_done(entry))
+        except (RuntimeError, tk.TclError):
+            # 与窗口销毁竞争时忽略 / Ignore a race with window destruction
+            pass
+
+    def _on_job_done(self, entry):
+        """在 Tk 线程中汇总结果，不弹窗 / Summarize the outcome on the Tk thread without a dialog"""
+        entry.finished = time.monotonic()
+        job = entry.job
+        if job.status == M4SJob.CANCELLED:
+            self.log(f"#{entry.number} {self.t['cancelled']}")
+        elif job.status == M4SJob.SUCCEEDED:
+            self.log(f"#{entry.number} {self.t['success']}! {job.result}")
+        else:
+            self.log(f"#{entry.number} {self.t['error']}: {job.error}")
+        self._update_job_row(entry)
+        self._pump_queue()
+
+    def cancel_task(self):
+        """取消所有排队和运行中的任务 / Cancel every queued and running job"""
+        active = [entry for entry in self.jobs if not entry.job.done]
+        if active:
+            self.log(self.t["cancelling"])
+        for entry in active:
+            self._cancel_job(entry)
+
+    def _cancel_job(self, entry):
+        entry.job.cancel()
+        if entry.started is None:
+            # 未启动的任务直接在当前线程结束，触发完成回调 / A job that never started ends right here and fires its callbacks
+            entry.started = time.monotonic()
+            entry.job.add_done_callback(lambda j: self._schedule_job_done(entry))
+            entry.job.run(lambda: None)
+        self._update_job_row(entry)
+
+    def clear_finished(self):
+        for entry in [entry for entry in self.jobs if entry.job.done]:
+            self._remove_job(entry)
+
+    def _remove_job(self, entry):
+        if entry.row is not None:
+            entry.row["frame"].destroy()
+            entry.row = None
+        self.jobs.remove(entry)
+        self._update_queue_summary()
+
+    def _set_parallelism(self, value):
+        self.max_parallel = int(value)
+        self._pump_queue()
+
+    def _on_close(self):
+        """
+        关闭窗口：取消所有任务并隐藏窗口，在 Tk 线程上轮询等待 FFmpeg 退出后再销毁（不阻塞事件循环）
+        Close the window: cancel every job and hide the window, then poll on the Tk thread until FFmpeg
+        has exited before destroying it (without blocking the event loop)
+        """
+        if self._closing:
+            return
+        self._closing = True
+        for entry in self.jobs:
+            if not entry.job.done:
+                entry.job.cancel()
+        self.root.withdraw()
+        self._close_deadline = time.monotonic() + CLOSE_TIMEOUT_SECONDS
+        self._finish_close()
+
+    def _finish_close(self):
+        running = [entry for entry in self.jobs if entry.started is not None and not entry.job.done]
+        if running and time.monotonic() < self._close_deadline:
+            self.root.after(CLOSE_POLL_MS, self._finish_close)
+            return
+        self.log_sink.close()
+        self.root.destroy()
+
+    def _progress_logger(self, entry):
+        """
+        记录任务进度供队列面板显示，并把进度节流后写入日志（每个阶段每 10% 或每 2 秒一条）；
+        视频和音频可能同时合并，所以按阶段分别节流
+        Record job progress for the queue panel and throttle it into the log (every 10% or 2 s per
+        stage); video and audio may merge at the same time, so each stage is throttled on its own
+        """
+        states = {}
+
+        def callback(stage, current, total, message):
+            if total > 0:
+                entry.progress[stage] = min(1.0, current / total)
+            now = time.monotonic()
+            state = states.setdefault(stage, {"step": None, "time": 0.0})
+            step = int(current * 10 / total) if total > 0 else None
+            if step is not None and step == state["step"]:
+                return
+            if step is None and now - state["time"] < 2:
+                return
+            state["step"], state["time"] = step, now
+            self.log(f"#{entry.number} {message}")
+        return callback
+
+    def merge_video(self): self._enqueue("video")
+    def merge_audio(self): self._enqueue("audio")
+    def merge_av_direct(self): self._enqueue("full")
+
+    # --- 队列面板 / Queue panel ---
+    def _create_queue_panel(self, parent):
+        cont = ctk.CTkFrame(parent, fg_color=COLORS["input_bg"], corner_radius=10)
+        cont.pack(fill="both", expand=True, padx=20, pady=(0, 15))
+
+        head = ctk.CTkFrame(cont, fg_color="transparent")
+        head.pack(fill="x", padx=15, pady=(10, 0))
+        self.ui_refs["queue_title"] = ctk.CTkLabel(head, text="", font=self.font_header, text_color=COLORS["text_main"])
+        self.ui_refs["queue_title"].pack(side="left")
+        self.ui_refs["queue_summary"] = ctk.CTkLabel(head, text="", font=self.font_small, text_color=COLORS["text_body"])
+        self.ui_refs["queue_summary"].pack(side="left", padx=10)
+
+        self.ui_refs["clear_done_btn"] = ctk.CTkButton(
+            head, text="", width=90, height=28,
+            fg_color=COLORS["secondary_btn"], hover_color=COLORS["secondary_hover"],
+            text_color=COLORS["text_main"], font=self.font_small, command=self.clear_finished
+        )
+        self.ui_refs["clear_done_btn"].pack(side="right")
+        ctk.CTkOptionMenu(
+            head, values=[str(n) for n in range(1, MAX_PARALLEL_JOBS + 1)], width=60, height=28,
+            fg_color=COLORS["secondary_btn"], button_color=COLORS["secondary_hover"],
+            text_color=COLORS["text_main"], font=self.font_small, command=self._set_parallelism,
+            variable=tk.StringVar(value=str(self.max_parallel))
+        ).pack(side="right", padx=5)
+        self.ui_refs["parallel_label"] = ctk.CTkLabel(head, text="", font=self.font_small, text_color=COLORS["text_body"])
+        self.ui_refs["parallel_label"].pack(side="right")
+
+        self.queue_list = ctk.CTkScrollableFrame(cont, height=110, fg_color="transparent",
+                                                 scrollbar_button_color=COLORS["card_border"])
+        self.queue_list.pack(fill="both", expand=True, padx=5, pady=(0, 5))
+        self.root.after(QUEUE_REFRESH_MS, self._refresh_queue)
+
+    def _create_job_row(self, entry):
+        frame = ctk.CTkFrame(self.queue_list, fg_color="transparent")
+        frame.pack(fill="x", pady=2)
+        top = ctk.CTkFrame(frame, fg_color="transparent")
+        top.pack(fill="x")
+        title = ctk.CTkLabel(top, text="", text_color=COLORS["text_main"], anchor="w", font=self.font_small)
+        title.pack(side="left")
+        button = ctk.CTkButton(
+            top, text="×", width=28, height=24, fg_color="transparent",
+            hover_color=COLORS["card_border"], text_color=COLORS["text_body"], font=("Arial", 16),
+            command=lambda: self._on_job_button(entry)
+        )
+        button.pack(side="right")
+        status = ctk.CTkLabel(top, text="", text_color=COLORS["text_body"], anchor="e", font=("Consolas", 12))
+        status.pack(side="right", padx=5)
+        bar = ctk.CTkProgressBar(frame, height=6, progress_color=COLORS["brand"])
+        bar.pack(fill="x", padx=(0, 5))
+        bar.set(0)
+        entry.row = {"frame": frame, "title": title, "status": status, "bar": bar, "button": button}
+        self._update_job_row(entry)
+
+    def _on_job_button(self, entry):
+        if not entry.job.done:
+            self._cancel_job(entry)
+        elif entry.job.status == M4SJob.SUCCEEDED:
+            try: os.startfile(os.path.dirname(entry.job.result))
             except: pass
         else:
-            self.log(f"{self.t['error']}: {msg}")
-            messagebox.showerror(self.t["error"], msg)
+            self._remove_job(entry)
 
-    def merge_video(self): self._run_task("video", lambda: self.processor.merge_video_segments(self.video_files, self.output_dir))
-    def merge_audio(self): self._run_task("audio", lambda: self.processor.merge_audio_segments(self.audio_files, self.output_dir))
-    
-    def merge_av_direct(self): 
-        if not self.video_files or not self.audio_files:
-             messagebox.showwarning(self.t["error"], self.t["need_both"])
-             return
-             
-        # 修改：分步处理并记录日志
-        def full_task():
-            import tempfile
-
-            with tempfile.TemporaryDirectory() as temp_dir:
-                if len(self.video_files) > 1:
-                    v_path = self.processor.merge_video_segments(
-                        self.video_files, temp_dir, output_name="temp_video.mp4"
-                    )
-                    self.root.after(0, lambda: self.log(self.t["log_step_v_end"]))
-                else:
-                    v_path = self.video_files[0]
-                
-                if len(self.audio_files) > 1:
-                    a_path = self.processor.merge_audio_segments(
-                        self.audio_files, temp_dir, output_name="temp_audio.mp4"
-                    )
-                    self.root.after(0, lambda: self.log(self.t["log_step_a_end"]))
-                else:
-                    a_path = self.audio_files[0]
-                
-                self.root.after(0, lambda: self.log(self.t["log_step_m_start"]))
-                final_path = self.processor.merge_av(v_path, a_path, self.output_dir)
-                return final_path
-
-        self._run_task("full", full_task)
+    def _update_job_row(self, entry):
+        row = entry.row
+        if row is None:
+            return
+        t = self.t
+        files = len(entry.video_files) + len(entry.audio_files)
+        row["title"].configure(text=f"#{entry.number}  {t['job_' + entry.kind]} · {files} {t['job_files']}")
+        state = entry.state
+        if state == M4SJob.PENDING:
+            text = t["job_pending"]
+        elif entry.job.cancelled and not entry.job.done:
+            text = t["job_cancelling"]
+        elif state == M4SJob.RUNNING:
+            text = f"{entry.fraction() * 100:.0f}% · {entry.throughput() / 1024 / 1024:.1f} MB/s · {entry.elapsed():.0f}s"
+        elif state == M4SJob.SUCCEEDED:
+            text = (f"✓ {entry.elapsed():.1f}s · {entry.throughput() / 1024 / 1024:.1f} MB/s · "
+                    f"{os.path.basename(entry.job.result)}")
+        elif state == M4SJob.CANCELLED:
+            text = t["job_cancelled"]
+        else:
+            error = str(entry.job.error).strip().splitlines()
+            text = f"✗ {error[0][:60] if error else t['error']}"
+        row["status"].configure(text=text, text_color=COLORS["brand"] if state == M4SJob.SUCCEEDED else COLORS["text_body"])
+        row["bar"].set(1.0 if state == M4SJob.SUCCEEDED else entry.fraction())
+        row["button"].configure(text="📂" if state == M4SJob.SUCCEEDED else "×")
+
+    def _refresh_queue(self):
+        """定时刷新运行中任务的进度和吞吐 / Periodically refresh progress and throughput of running jobs"""
+        for entry in self.jobs:
+            if entry.state == M4SJob.RUNNING:
+                self._update_job_row(entry)
+        self.root.after(QUEUE_REFRESH_MS, self._refresh_queue)
+
+    def _update_queue_summary(self):
+        counts = {}
+        for entry in self.jobs:
+            counts[entry.state] = counts.get(entry.state, 0) + 1
+        t = self.t
+        parts = [f"{t[key]} {counts[state]}" for state, key in (
+            (M4SJob.RUNNING, "job_running"), (M4SJob.PENDING, "job_pending"),
+            (M4SJob.SUCCEEDED, "job_done"), (M4SJob.FAILED, "job_failed"), (M4SJob.CANCELLED, "job_cancelled"),
+        ) if counts.get(state)]
+        self.ui_refs["queue_summary"].configure(text=" · ".join(parts))
+        active = counts.get(M4SJob.RUNNING, 0) + counts.get(M4SJob.PENDING, 0)
+        self.ui_refs["btn_cancel"].configure(state="normal" if active else "disabled")
 
     # --- 安装弹窗 (强制双语，因为此时用户无法切换语言) ---
     def install_ffmpeg_dialog(self):
@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地 HTTP 任务服务（asyncio，无第三方依赖）
+Local HTTP Job Service (asyncio, no third-party dependencies)
+
+接口 / Endpoints:
+    POST   /jobs                 提交任务 / Submit a job
+           {"video": [...], "audio": [...], "output_dir": "...", "output_name": "x.mp4", "single_pass": true}
+    GET    /jobs                 列出任务 / List jobs
+    GET    /jobs/{id}            查询状态 / Job status
+    GET    /jobs/{id}/events     进度流：默认 SSE，Accept: application/x-ndjson 时为分块 NDJSON
+                                 Progress stream: SSE by default, chunked NDJSON with Accept: application/x-ndjson
+    DELETE /jobs/{id}            取消任务（也可 POST /jobs/{id}/cancel） / Cancel (or POST /jobs/{id}/cancel)
+    GET    /health               服务状态 / Service health
+
+文件路径均为服务器上的路径。任务由 AsyncM4SProcessor 在同一个事件循环中执行，同时运行的
+任务数由 workers 限制。默认只监听 127.0.0.1；可用 --token 要求 "Authorization: Bearer <token>"，
+用 --allow-root 把输入输出限制在指定目录下。
+
+All file paths are paths on the server. Jobs run through AsyncM4SProcessor on a single event
+loop, and the number of jobs running at once is bounded by `workers`. Binds to 127.0.0.1 by default;
+--token requires "Authorization: Bearer <token>" and --allow-root confines inputs and outputs
+to the given directories.
+"""
+
+import asyncio
+import hmac
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Set
+from urllib.parse import parse_qs, urlsplit
+
+from async_processor import AsyncM4SProcessor
+
+if TYPE_CHECKING:
+    from m4s_processor import M4SProcessor
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_LINES = 100
+# 已结束任务最多保留的数量 / How many finished jobs are kept
+MAX_FINISHED_JOBS = 1000
+SSE_KEEPALIVE_SECONDS = 15.0
+TOKEN_ENV = "M4S_SERVICE_TOKEN"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL = (SUCCEEDED, FAILED, CANCELLED)
+
+_REASONS = {200: "OK", 201: "Created", 202: "Accepted", 204: "No Content", 400: "Bad Request",
+            401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(RuntimeError):
+    """带状态码的请求错误 / Request error carrying an HTTP status"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: Dict[str, List[str]]
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, ValueError) as e:
+            raise HTTPError(400, f"请求体不是有效的 JSON / Body is not valid JSON: {e}")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "请求体必须是 JSON 对象 / Body must be a JSON object")
+        return data
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """读取一个 HTTP/1.1 请求；连接关闭时返回 None / Read one HTTP/1.1 request; None when the connection closed"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "请求行无效 / Malformed request line")
+    headers: Dict[str, str] = {}
+    for _ in range(MAX_HEADER_LINES):
+        raw = await reader.readline()
+        if raw in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = raw.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(400, "请求头过多 / Too many headers")
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "请求体过大 / Body too large")
+    body = await reader.readexactly(length) if length else b""
+    parts = urlsplit(target)
+    return Request(method.upper(), parts.path.rstrip("/") or "/", parse_qs(parts.query), headers, body)
+
+
+def _head(status: int, content_type: str, extra: Optional[Dict[str, str]] = None,
+          length: Optional[int] = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Unknown')}", f"Content-Type: {content_type}",
+             "Connection: close", "Cache-Control: no-store"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    for name, value in (extra or {}).items():
+        lines.append(f"{name}: {value}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def json_response(status: int, payload) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return _head(status, "application/json; charset=utf-8", length=len(body)) + body
+
+
+class ServiceJob:
+    """服务中的一个任务及其订阅者 / One job in the service and its subscribers"""
+
+    def __init__(self, request: dict):
+        self.id = uuid.uuid4().hex[:12]
+        self.request = request
+        self.state = QUEUED
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.output: Optional[str] = None
+        self.error: Optional[str] = None
+        self.stages: Optional[Dict[str, float]] = None
+        self.progress: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id, "state": self.state, "created": self.created, "started": self.started,
+            "finished": self.finished, "output": self.output, "error": self.error,
+            "progress": self.progress, "stages": self.stages, "request": self.request,
+        }
+
+    def publish(self, event: str):
+        """把事件推给所有订阅者（在事件循环线程中调用） / Push an event to every subscriber (call on the loop thread)"""
+        payload = {"event": event, "job": self.to_json()}
+        for queue in list(self.subscribers):
+            queue.put_nowait(payload)
+
+
+class M4SService:
+    """
+    M4SProcessor 的 HTTP 外壳 / HTTP front end for M4SProcessor
+    """
+
+    def __init__(self, processor: "M4SProcessor", workers: int = 2, token: Optional[str] = None,
+                 allowed_roots: Optional[List[str]] = None):
+        """
+        Args:
+            processor: 处理器 / Processor
+            workers: 同时运行的任务数 / Concurrent jobs
+            token: 非空时要求 Bearer 令牌 / Require this bearer token when set
+            allowed_roots: 输入输出必须位于这些目录下 / Inputs and outputs must live under these directories
+        """
+        self.processor = processor
+        self.runner = AsyncM4SProcessor(processor)
+        self.workers = max(1, workers)
+        self.token = token
+        self.allowed_roots = [os.path.realpath(root) for root in (allowed_roots or [])]
+        self.jobs: "OrderedDict[str, ServiceJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._closing = False
+        self._worker_tasks: List[asyncio.Task] = []
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    # --- 生命周期 / Lifecycle ---
+    async def start(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> asyncio.AbstractServer:
+        """开始监听（port=0 时自动分配） / Start listening (port=0 picks a free port)"""
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """停止监听，取消所有任务 / Stop listening and cancel every job"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self._closing = True
+        running = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in running + self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*running, *self._worker_tasks, return_exceptions=True)
+
+    # --- 任务执行 / Job execution ---
+    async def _worker(self):
+        while not self._closing:
+            job = await self._queue.get()
+            if job.state != QUEUED:
+                continue
+            await self._run(job)
+
+    @staticmethod
+    def _progress_callback(job: ServiceJob):
+        # AsyncM4SProcessor 在事件循环线程中调用回调 / AsyncM4SProcessor calls back on the loop thread
+        def callback(stage, current, total, message):
+            job.progress = {"stage": stage, "current": current, "total": total, "message": message,
+                            "percent": round(current * 100.0 / total, 1) if total > 0 else None}
+            job.publish("progress")
+        return callback
+
+    async def _run(self, job: ServiceJob):
+        request = job.request
+        job.state = RUNNING
+        job.started = time.time()
+        job.publish("state")
+        job.task = asyncio.ensure_future(self.runner.process_all(
+            request["video"], request["audio"], request["output_dir"],
+            single_pass=request.get("single_pass", True), output_name=request.get("output_name"),
+            progress_callback=self._progress_callback(job),
+        ))
+        try:
+            output = await job.task
+        except asyncio.CancelledError:
+            # 任务本身被取消时记录下来；若是工作协程在关闭时被取消，close() 会负责退出
+            # Record a cancelled job; if the worker itself is being shut down, close() makes it exit
+            job.state = CANCELLED
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e)
+        else:
+            job.state = SUCCEEDED
+            job.output = str(output)
+            stats = getattr(output, "stats", None)
+            job.stages = stats.by_stage() if stats is not None else None
+        finally:
+            job.finished = time.time()
+        job.publish("done")
+        self._prune()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in TERMINAL]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    # --- 校验 / Validation ---
+    def _check_path(self, path: str, what: str) -> str:
+        if not isinstance(path, str) or not path:
+            raise HTTPError(400, f"{what} 必须是非空字符串 / {what} must be a non-empty string")
+        if not os.path.isabs(path):
+            raise HTTPError(400, f"{what} 必须是绝对路径 / {what} must be an absolute path: {path}")
+        if self.allowed_roots:
+            real = os.path.realpath(path)
+            if not any(real == root or real.startswith(root + os.sep) for root in self.allowed_roots):
+                raise HTTPError(403, f"路径不在允许的目录中 / Path outside the allowed roots: {path}")
+        return path
+
+    def _parse_job(self, data: dict) -> dict:
+        video, audio = data.get("video") or [], data.get("audio") or []
+        if not isinstance(video, list) or not isinstance(audio, list):
+            raise HTTPError(400, "video / audio 必须是数组 / video / audio must be arrays")
+        if not video and not audio:
+            raise HTTPError(400, "至少需要提供视频文件或音频文件 / At least one video or audio file is required")
+        video = [self._check_path(p, "video") for p in video]
+        audio = [self._check_path(p, "audio") for p in audio]
+        for path in video + audio:
+            if not os.path.isfile(path):
+                raise HTTPError(400, f"文件不存在 / File not found: {path}")
+        output_name = data.get("output_name")
+        if output_name is not None and (not isinstance(output_name, str) or os.path.basename(output_name) != output_name):
+            raise HTTPError(400, "output_name 不能包含目录 / output_name must not contain directories")
+        return {
+            "video": video, "audio": audio,
+            "output_dir": self._check_path(data.get("output_dir") or "", "output_dir"),
+            "output_name": output_name, "single_pass": bool(data.get("single_pass", True)),
+        }
+
+    def _authorized(self, request: Request) -> bool:
+        if not self.token:
+            return True
+        supplied = request.headers.get("authorization", "")
+        return hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {self.token}".encode("utf-8"))
+
+    def _get_job(self, job_id: str) -> ServiceJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPError(404, f"任务不存在 / No such job: {job_id}")
+        return job
+
+    # --- HTTP ---
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    return
+                if not self._authorized(request):
+                    raise HTTPError(401, "需要有效的令牌 / A valid token is required")
+                await self._dispatch(request, writer)
+            except HTTPError as e:
+                writer.write(json_response(e.status, {"error": str(e)}))
+            except (asyncio.IncompleteReadError, ValueError) as e:
+                writer.write(json_response(400, {"error": str(e)}))
+            except Exception as e:
+                print(f"[HTTP] 处理请求出错 / Request failed: {e}")
+                writer.write(json_response(500, {"error": str(e)}))
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request: Request, writer: asyncio.StreamWriter):
+        parts = [p for p in request.path.split("/") if p]
+        method = request.method
+        if parts == ["health"] and method == "GET":
+            writer.write(json_response(200, self._health()))
+        elif parts == ["jobs"] and method == "POST":
+            job = ServiceJob(self._parse_job(request.json()))
+            self.jobs[job.id] = job
+            self._queue.put_nowait(job)
+            writer.write(json_response(201, job.to_json()))
+        elif parts == ["jobs"] and method == "GET":
+            state = (request.query.get("state") or [None])[0]
+            writer.write(json_response(200, [job.to_json() for job in self.jobs.values()
+                                             if state is None or job.state == state]))
+        elif len(parts) == 2 and parts[0] == "jobs" and method == "GET":
+            writer.write(json_response(200, self._get_job(parts[1]).to_json()))
+        elif len(parts) == 2 and parts[0] == "jobs" and method == "DELETE" or \
+                len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel" and method == "POST":
+            writer.write(json_response(202, self._cancel(self._get_job(parts[1])).to_json()))
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events" and method == "GET":
+            job = self._get_job(parts[1])
+            if "application/x-ndjson" in request.headers.get("accept", ""):
+                await self._stream_ndjson(job, writer)
+            else:
+                await self._stream_sse(job, writer)
+        elif parts and parts[0] in ("jobs", "health"):
+            raise HTTPError(405, f"不支持的方法 / Method not allowed: {method}")
+        else:
+            raise HTTPError(404, f"未知路径 / Unknown path: {request.path}")
+
+    def _health(self) -> dict:
+        states: Dict[str, int] = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        info = self.processor.ffmpeg_info
+        return {"ok": True, "workers": self.workers, "jobs": states, "ffmpeg": info.version if info else None}
+
+    def _cancel(self, job: ServiceJob) -> ServiceJob:
+        if job.state == QUEUED:
+            job.state = CANCELLED
+            job.finished = time.time()
+            job.publish("done")
+        elif job.state == RUNNING and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def _events(self, job: ServiceJob):
+        """先产出当前状态，再产出后续事件，直到任务结束 / Yield the current state, then live events until the job ends"""
+        queue: asyncio.Queue = asyncio.Queue()
+        job.subscribers.add(queue)
+        try:
+            yield {"event": "state", "job": job.to_json()}
+            if job.state in TERMINAL:
+                yield {"event": "done", "job": job.to_json()}
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event["event"] == "done":
+                    return
+        finally:
+            job.subscribers.discard(queue)
+
+    async def _stream_sse(self, job: ServiceJob, writer: asyncio.StreamWriter):
+        writer.write(_head(200, "text/event-stream; charset=utf-8", {"X-Accel-Buffering": "no"}))
+        async for event in self._events(job):
+            if event is None:
+                writer.write(b": keep-alive\n\n")
+            else:
+                data = json.dumps(event["job"], ensure_ascii=False)
+                writer.write(f"event: {event['event']}\ndata: {data}\n\n".encode("utf-8"))
+            await writer.drain()
+
+    async def _stream_ndjson(self, job: ServiceJob, writer: asyncio.StreamWriter):
+        writer.write(_head(200, "application/x-ndjson; charset=utf-8", {"Transfer-Encoding": "chunked"}))
+        async for event in self._events(job):
+            if event is None:
+                continue
+            chunk = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+
+
+async def serve(processor: "M4SProcessor", host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                workers: int = 2, token: Optional[str] = None, allowed_roots: Optional[List[str]] = None):
+    """运行服务直到被取消 / Run the service until cancelled"""
+    service = M4SService(processor, workers=workers, token=token, allowed_roots=allowed_roots)
+    await service.start(host, port)
+    print(f"[HTTP] 监听 / Listening on http://{host}:{service.port} ({service.workers} worker(s))")
+    stopped = asyncio.Event()
+    try:
+        import signal
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    except (ImportError, NotImplementedError, AttributeError):
+        pass
+    try:
+        await stopped.wait()
+    finally:
+        await service.close()
+    print("[HTTP] 已停止 / Stopped")
+
+
+def add_serve_arguments(parser):
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址 / Bind address")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口 / Port")
+    parser.add_argument("--workers", type=int, default=2, help="同时运行的任务数 / Concurrent jobs")
+    parser.add_argument("--token", default=os.environ.get(TOKEN_ENV),
+                        help=f"要求的 Bearer 令牌（也可用环境变量 {TOKEN_ENV}） / Required bearer token (or ${TOKEN_ENV})")
+    parser.add_argument("--allow-root", action="append", default=[],
+                        help="允许访问的目录，可重复 / Directory jobs may read and write; repeatable")
+
+
+def run_serve_cli(args, processor: "M4SProcessor") -> int:
+    if args.host not in ("127.0.0.1", "localhost", "::1") and not args.token:
+        print("[HTTP] 警告：对外监听但未设置令牌 / Warning: listening beyond localhost without a token")
+    try:
+        asyncio.run(serve(processor, args.host, args.port, args.workers, args.token, args.allow_root))
+    except KeyboardInterrupt:
+        print("[HTTP] 已停止 / Stopped")
+    return 0
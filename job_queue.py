@@ -0,0 +1,637 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+基于 SQLite 的持久化任务队列
+Crash-Safe Persistent Job Queue Backed by SQLite
+
+任务的输入、状态、尝试次数、时间、进度和输出都保存在 SQLite 数据库中（WAL 模式）。
+工作线程在 "BEGIN IMMEDIATE" 事务中认领任务并持有租约，运行期间定期续租；进程崩溃后
+租约过期（同一台机器上进程已不存在时立即）的任务会自动重新排队，重启即可继续。
+失败的任务按指数退避重试，达到上限后标记为失败。认领顺序可选先进先出或最短任务优先（按输入总大小）。
+
+Inputs, state, attempts, timings, progress and outputs of every job live in an SQLite database
+(WAL mode). Workers claim jobs inside a "BEGIN IMMEDIATE" transaction and hold a lease that is
+renewed while the job runs. After a crash, jobs whose lease expired (or whose owning process on
+this machine is gone) are requeued automatically, so a restart simply continues. Failed jobs are
+retried with exponential backoff and marked failed once attempts run out. Jobs are claimed in
+FIFO or shortest-job-first order (by total input size).
+"""
+
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+from cache_paths import get_cache_dir
+from m4s_job import M4SJob
+from segment_validator import SegmentValidationError
+from staging import pid_alive, remove_stale_partials
+
+if TYPE_CHECKING:
+    from m4s_processor import M4SProcessor
+
+SCHEMA_VERSION = 1
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ORDER_FIFO = "fifo"
+ORDER_SJF = "sjf"
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE_SECONDS = 60.0
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 600.0
+# 重试也无法成功的错误：片段未通过预检、输入不存在、参数无效
+# Errors a retry cannot fix: segments failing pre-validation, missing inputs, invalid arguments
+PERMANENT_ERRORS = (SegmentValidationError, FileNotFoundError, ValueError)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    name          TEXT    NOT NULL DEFAULT '',
+    params        TEXT    NOT NULL,
+    state         TEXT    NOT NULL,
+    priority      INTEGER NOT NULL DEFAULT 0,
+    size_bytes    INTEGER NOT NULL DEFAULT 0,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL DEFAULT 3,
+    next_run_at   REAL    NOT NULL DEFAULT 0,
+    created_at    REAL    NOT NULL,
+    started_at    REAL,
+    finished_at   REAL,
+    worker        TEXT,
+    lease_until   REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    progress      REAL,
+    message       TEXT,
+    output        TEXT,
+    error         TEXT,
+    stats         TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, next_run_at, priority, size_bytes);
+"""
+
+
+class QueuedJob(NamedTuple):
+    """队列中的一个任务 / One job in the queue"""
+    id: int
+    name: str
+    video_files: List[str]
+    audio_files: List[str]
+    output_dir: str
+    output_name: Optional[str]
+    single_pass: bool
+    state: str
+    priority: int
+    size_bytes: int
+    attempts: int
+    max_attempts: int
+    next_run_at: float
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    worker: Optional[str]
+    cancel_requested: bool
+    progress: Optional[float]
+    message: Optional[str]
+    output: Optional[str]
+    error: Optional[str]
+    stats: Optional[dict]
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "QueuedJob":
+        params = json.loads(row["params"])
+        return cls(
+            id=row["id"], name=row["name"],
+            video_files=params.get("video", []), audio_files=params.get("audio", []),
+            output_dir=params.get("output_dir", ""), output_name=params.get("output_name"),
+            single_pass=params.get("single_pass", True),
+            state=row["state"], priority=row["priority"], size_bytes=row["size_bytes"],
+            attempts=row["attempts"], max_attempts=row["max_attempts"], next_run_at=row["next_run_at"],
+            created_at=row["created_at"], started_at=row["started_at"], finished_at=row["finished_at"],
+            worker=row["worker"], cancel_requested=bool(row["cancel_requested"]),
+            progress=row["progress"], message=row["message"], output=row["output"], error=row["error"],
+            stats=json.loads(row["stats"]) if row["stats"] else None,
+        )
+
+    def to_json(self) -> dict:
+        return self._asdict()
+
+
+def backoff_seconds(attempts: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """第 attempts 次失败后的等待时间（指数退避加抖动） / Delay after the n-th failure (exponential backoff with jitter)"""
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobQueue:
+    """
+    持久化任务队列；可被多个线程和进程同时使用
+    Persistent job queue; safe to share between threads and processes
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else get_cache_dir() / "jobs.sqlite3"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        # executescript 会先提交，不能放在事务里 / executescript commits first, so it cannot run inside a transaction
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # --- 连接 / Connections ---
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接 / One connection per thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- 提交与查询 / Submit and query ---
+    def enqueue(self, video_files: List[str], audio_files: List[str], output_dir: str,
+                output_name: Optional[str] = None, single_pass: bool = True, priority: int = 0,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS, name: str = "") -> int:
+        """
+        加入一个任务，返回任务 ID / Add a job and return its ID
+
+        Args:
+            priority: 数值越大越先执行 / Higher runs first
+            max_attempts: 最多尝试次数（含首次） / Maximum attempts including the first
+        """
+        if not video_files and not audio_files:
+            raise ValueError("至少需要提供视频文件或音频文件 / At least one video or audio file is required")
+        size = 0
+        for path in list(video_files) + list(audio_files):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        params = {"video": list(video_files), "audio": list(audio_files), "output_dir": str(output_dir),
+                  "output_name": output_name, "single_pass": single_pass}
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (name, params, state, priority, size_bytes, max_attempts, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, json.dumps(params, ensure_ascii=False), QUEUED, priority, size, max(1, max_attempts),
+                 time.time()),
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id: int) -> Optional[QueuedJob]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return QueuedJob.from_row(row) if row else None
+
+    def list(self, state: Optional[str] = None, limit: int = 1000) -> List[QueuedJob]:
+        if state:
+            rows = self._conn().execute("SELECT * FROM jobs WHERE state = ? ORDER BY id LIMIT ?", (state, limit))
+        else:
+            rows = self._conn().execute("SELECT * FROM jobs ORDER BY id LIMIT ?", (limit,))
+        return [QueuedJob.from_row(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        return {state: count for state, count in rows}
+
+    # --- 认领与状态变更 / Claiming and state changes ---
+    def recover(self) -> int:
+        """
+        把本机已退出进程持有的运行中任务重新排队，返回数量（租约过期的任务在认领时自动回收）
+        Requeue running jobs held by dead processes on this machine; returns the count
+        (jobs with an expired lease are reclaimed automatically when claiming)
+        """
+        host = socket.gethostname()
+        recovered = 0
+        with self._transaction() as conn:
+            for row in conn.execute("SELECT id, worker, cancel_requested FROM jobs WHERE state = ?",
+                                    (RUNNING,)).fetchall():
+                worker_host, _, rest = (row["worker"] or "").partition(":")
+                pid = rest.partition(":")[0]
+                # Windows 上 pid_alive 总为真，交给租约过期处理 / pid_alive is always true on Windows; lease expiry handles it
+                if worker_host != host or not pid.isdigit() or pid_alive(int(pid)):
+                    continue
+                if row["cancel_requested"]:
+                    # 已请求取消的任务不再排队 / Cancel-requested jobs are not requeued
+                    conn.execute("UPDATE jobs SET state = ?, finished_at = ? WHERE id = ?",
+                                 (CANCELLED, time.time(), row["id"]))
+                else:
+                    conn.execute("UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, "
+                                 "message = ? WHERE id = ?", (QUEUED, "recovered after crash", row["id"]))
+                    recovered += 1
+        return recovered
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+              order: str = ORDER_FIFO) -> Optional[QueuedJob]:
+        """
+        事务性地认领下一个可运行的任务（含租约已过期的运行中任务）；没有时返回 None
+        Transactionally claim the next runnable job (including running jobs whose lease expired);
+        None when nothing is runnable
+        """
+        now = time.time()
+        tie_break = "size_bytes ASC, id ASC" if order == ORDER_SJF else "id ASC"
+        with self._transaction() as conn:
+            # 请求取消后工作进程丢失的任务不会再有人续租，直接判为已取消
+            # Cancel-requested jobs whose worker was lost will never heartbeat again; mark them cancelled
+            conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ? "
+                "WHERE state = ? AND lease_until < ? AND cancel_requested = 1",
+                (CANCELLED, now, RUNNING, now),
+            )
+            # 租约过期且已用完尝试次数的任务直接判为失败 / Expired jobs with no attempts left are failed outright
+            conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, error = ? "
+                "WHERE state = ? AND lease_until < ? AND attempts >= max_attempts",
+                (FAILED, now, "worker lost / 工作进程丢失", RUNNING, now),
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE cancel_requested = 0 AND "
+                "((state = ? AND next_run_at <= ?) OR (state = ? AND lease_until < ?)) "
+                f"ORDER BY priority DESC, {tie_break} LIMIT 1",
+                (QUEUED, now, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, worker = ?, lease_until = ?, "
+                "started_at = ?, finished_at = NULL, progress = NULL, message = NULL WHERE id = ?",
+                (RUNNING, worker, now + lease_seconds, now, row["id"]),
+            )
+        return self.get(row["id"])
+
+    def heartbeat(self, job_id: int, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                  progress: Optional[float] = None, message: Optional[str] = None) -> bool:
+        """
+        续租并更新进度；返回 False 表示任务被请求取消或已不归本工作线程所有
+        Renew the lease and update progress; False means cancellation was requested or the job was lost
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ?, progress = COALESCE(?, progress), "
+                "message = COALESCE(?, message) WHERE id = ? AND worker = ? AND state = ?",
+                (time.time() + lease_seconds, progress, message, job_id, worker, RUNNING),
+            )
+            row = conn.execute("SELECT worker, state, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["worker"] == worker and row["state"] == RUNNING and not row["cancel_requested"])
+
+    def complete(self, job_id: int, worker: str, output: str, stats: Optional[dict] = None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, output = ?, stats = ?, error = NULL, "
+                "progress = 1.0, lease_until = NULL WHERE id = ? AND worker = ?",
+                (SUCCEEDED, time.time(), output, json.dumps(stats) if stats else None, job_id, worker),
+            )
+
+    def fail(self, job_id: int, worker: str, error: str, retry: bool = True):
+        """
+        记录失败；还有尝试次数时按退避时间重新排队
+        Record a failure; requeue after a backoff delay while attempts remain
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ?",
+                               (job_id, worker)).fetchone()
+            if row is None:
+                return
+            if retry and row["attempts"] < row["max_attempts"]:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, next_run_at = ?, error = ?, worker = NULL, lease_until = NULL "
+                    "WHERE id = ?",
+                    (QUEUED, now + backoff_seconds(row["attempts"]), error, job_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, finished_at = ?, error = ?, lease_until = NULL WHERE id = ?",
+                    (FAILED, now, error, job_id),
+                )
+
+    def release(self, job_id: int, worker: str):
+        """
+        工作线程停止时归还任务，不计入尝试次数 / Hand a job back when the worker stops, without using up an attempt
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = MAX(0, attempts - 1), worker = NULL, lease_until = NULL, "
+                "message = ? WHERE id = ? AND worker = ? AND state = ?",
+                (QUEUED, "released", job_id, worker, RUNNING),
+            )
+
+    def mark_cancelled(self, job_id: int):
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET state = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+                         (CANCELLED, time.time(), job_id))
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        取消任务：排队中的立即取消，运行中的由其工作线程在下次续租时终止
+        Cancel a job: queued jobs stop immediately, running ones are stopped by their worker at the next heartbeat
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["state"] in (SUCCEEDED, FAILED, CANCELLED):
+                return False
+            if row["state"] == QUEUED:
+                conn.execute("UPDATE jobs SET state = ?, finished_at = ?, cancel_requested = 1 WHERE id = ?",
+                             (CANCELLED, time.time(), job_id))
+            else:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        return True
+
+    def retry(self, job_id: int) -> bool:
+        """把失败或已取消的任务重新排队 / Requeue a failed or cancelled job"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, attempts = 0, next_run_at = 0, cancel_requested = 0, error = NULL, "
+                "finished_at = NULL WHERE id = ? AND state IN (?, ?)",
+                (QUEUED, job_id, FAILED, CANCELLED),
+            )
+            return cursor.rowcount > 0
+
+    def purge(self, older_than_days: float = 30.0) -> int:
+        """删除早已结束的任务记录 / Delete records of jobs that finished long ago"""
+        cutoff = time.time() - older_than_days * 86400
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE state IN (?, ?, ?) AND finished_at < ?",
+                                  (SUCCEEDED, FAILED, CANCELLED, cutoff))
+            return cursor.rowcount
+
+    def next_wakeup(self) -> Optional[float]:
+        """下一个等待退避的任务何时可运行 / When the next backed-off job becomes runnable"""
+        row = self._conn().execute("SELECT MIN(next_run_at) FROM jobs WHERE state = ?", (QUEUED,)).fetchone()
+        return row[0] if row and row[0] is not None else None
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT / ROLLBACK；立即获取写锁，避免认领时的竞争 / Takes the write lock up front so claims never race"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+def is_permanent_error(error: Optional[BaseException]) -> bool:
+    """
+    错误（含被 RuntimeError 包装的原因）是否属于重试也无法解决的类型
+    Whether the error, or a cause wrapped in RuntimeError, is one a retry cannot fix
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, PERMANENT_ERRORS):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class QueueWorker:
+    """
+    从队列中认领任务并用 M4SProcessor 处理 / Claims jobs from the queue and runs them on M4SProcessor
+    """
+
+    def __init__(self, queue: JobQueue, processor: "M4SProcessor", workers: int = 1, order: str = ORDER_FIFO,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS, poll_interval: float = 1.0):
+        self.queue = queue
+        self.processor = processor
+        self.workers = max(1, workers)
+        self.order = order
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._active: Dict[int, M4SJob] = {}
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def stop(self):
+        """停止认领新任务，正在运行的任务被取消并归还队列 / Stop claiming; running jobs are cancelled and handed back"""
+        self._stop.set()
+        with self._lock:
+            handles = list(self._active.values())
+        for handle in handles:
+            handle.cancel()
+
+    def run(self, exit_when_empty: bool = False):
+        """
+        启动工作线程并阻塞到 stop()；exit_when_empty 时队列清空后返回
+        Run worker threads until stop(); with exit_when_empty, return once the queue drains
+        """
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"[Queue] 恢复了 {recovered} 个中断的任务 / Recovered {recovered} interrupted job(s)")
+        threads = [threading.Thread(target=self._loop, args=(f"{self._prefix}:{i}", exit_when_empty),
+                                    name=f"m4s-queue-{i}", daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("[Queue] 已中断，正在归还运行中的任务 / Interrupted, handing running jobs back")
+            self.stop()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.queue.close()
+
+    def _idle(self, exit_when_empty: bool) -> bool:
+        """没有可运行的任务时等待；返回 True 表示应退出 / Wait when nothing is runnable; True means exit"""
+        counts = self.queue.counts()
+        if exit_when_empty and not counts.get(QUEUED) and not counts.get(RUNNING):
+            return True
+        wakeup = self.queue.next_wakeup()
+        delay = self.poll_interval if wakeup is None else min(self.poll_interval * 5, max(0.05, wakeup - time.time()))
+        self._stop.wait(delay)
+        return False
+
+    def _loop(self, worker: str, exit_when_empty: bool):
+        try:
+            while not self._stop.is_set():
+                job = self.queue.claim(worker, self.lease_seconds, self.order)
+                if job is None:
+                    if self._idle(exit_when_empty):
+                        return
+                    continue
+                self._execute(job, worker)
+        finally:
+            self.queue.close()
+
+    def _execute(self, job: QueuedJob, worker: str):
+        handle = M4SJob(f"queue-{job.id}")
+        with self._lock:
+            self._active[job.id] = handle
+        print(f"[Queue] 开始 / Start #{job.id} (尝试 / attempt {job.attempts}/{job.max_attempts})")
+        if job.attempts > 1:
+            # 重试前清掉上次崩溃留下的临时输出 / Clear temp outputs a crashed attempt left behind
+            remove_stale_partials(job.output_dir)
+        progress = {"value": None, "message": None}
+
+        def on_progress(stage, current, total, message):
+            if total > 0:
+                progress["value"] = min(1.0, current / total)
+            progress["message"] = message
+
+        lost = threading.Event()
+        stopped = threading.Event()
+
+        def heartbeat():
+            # 续租线程：被取消或租约丢失时终止任务 / Lease renewer: stop the job on cancel or lost lease
+            heartbeat_queue = JobQueue(str(self.queue.path))
+            try:
+                while not stopped.wait(min(2.0, self.lease_seconds / 3)):
+                    if not heartbeat_queue.heartbeat(job.id, worker, self.lease_seconds,
+                                                     progress["value"], progress["message"]):
+                        lost.set()
+                        handle.cancel()
+                        return
+            finally:
+                heartbeat_queue.close()
+
+        beat = threading.Thread(target=heartbeat, name=f"m4s-lease-{job.id}", daemon=True)
+        beat.start()
+        try:
+            handle.run(lambda: self.processor.process_all(
+                job.video_files, job.audio_files, job.output_dir, single_pass=job.single_pass,
+                output_name=job.output_name, progress_callback=on_progress, job=handle,
+            ))
+        finally:
+            stopped.set()
+            beat.join()
+            with self._lock:
+                self._active.pop(job.id, None)
+
+        if handle.status == M4SJob.SUCCEEDED:
+            stats = getattr(handle.result, "stats", None)
+            self.queue.complete(job.id, worker, str(handle.result),
+                                {"stages": stats.by_stage(), "wall_seconds": stats.wall_seconds} if stats else None)
+            print(f"[Queue] 完成 / Done #{job.id}: {handle.result}")
+        elif handle.status == M4SJob.CANCELLED:
+            current = self.queue.get(job.id)
+            if current is not None and current.cancel_requested:
+                self.queue.mark_cancelled(job.id)
+                print(f"[Queue] 已取消 / Cancelled #{job.id}")
+            elif not lost.is_set():
+                # 工作线程正在停止：归还任务，重启后继续 / Worker is stopping: hand the job back to continue after restart
+                self.queue.release(job.id, worker)
+                print(f"[Queue] 已归还 / Released #{job.id}")
+        else:
+            error = str(handle.error)
+            self.queue.fail(job.id, worker, error, retry=not is_permanent_error(handle.error))
+            first_line = error.splitlines()[0] if error else ""
+            print(f"[Queue] 失败 / Failed #{job.id}: {first_line}")
+
+
+# --- 命令行 / Command line ---
+def add_queue_arguments(parser):
+    parser.add_argument("--db", help="队列数据库路径 / Queue database path")
+    sub = parser.add_subparsers(dest="queue_command")
+    sub.required = True
+
+    p = sub.add_parser("add", help="加入任务 / Add a job")
+    p.add_argument("--video", nargs="+", default=[], help="视频片段 / Video segments")
+    p.add_argument("--audio", nargs="+", default=[], help="音频片段 / Audio segments")
+    p.add_argument("-o", "--output", default=".", help="输出目录 / Output directory")
+    p.add_argument("-n", "--name", help="输出文件名 / Output filename")
+    p.add_argument("--two-stage", action="store_true", help="先分别合并再混流 / Merge each stream first, then mux")
+    p.add_argument("--priority", type=int, default=0, help="优先级，越大越先 / Priority, higher first")
+    p.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="最多尝试次数 / Maximum attempts")
+
+    p = sub.add_parser("import", help="从批处理任务文件导入 / Import a batch job file")
+    p.add_argument("jobs", help="任务文件（JSON / JSON Lines） / Job file (JSON / JSON Lines)")
+    p.add_argument("--priority", type=int, default=0)
+    p.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    p = sub.add_parser("run", help="处理队列 / Process the queue")
+    p.add_argument("--workers", type=int, default=1, help="同时运行的任务数 / Concurrent jobs")
+    p.add_argument("--order", choices=[ORDER_FIFO, ORDER_SJF], default=ORDER_SJF,
+                   help="认领顺序：先进先出或最短任务优先 / Claim order: FIFO or shortest job first")
+    p.add_argument("--exit-when-empty", action="store_true", help="队列清空后退出 / Exit once the queue is empty")
+
+    p = sub.add_parser("list", help="列出任务 / List jobs")
+    p.add_argument("--state", choices=[QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED])
+    p.add_argument("--json", action="store_true", help="输出 JSON / Print JSON")
+
+    for name, help_text in (("cancel", "取消任务 / Cancel a job"), ("retry", "重试失败的任务 / Retry a failed job")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("ids", nargs="+", type=int)
+
+    p = sub.add_parser("purge", help="删除已结束的旧记录 / Delete old finished records")
+    p.add_argument("--days", type=float, default=30.0)
+
+
+def needs_processor(args) -> bool:
+    return args.queue_command == "run"
+
+
+def run_queue_cli(args, processor: Optional["M4SProcessor"] = None) -> int:
+    queue = JobQueue(args.db)
+    command = args.queue_command
+    if command == "add":
+        job_id = queue.enqueue(args.video, args.audio, args.output, output_name=args.name,
+                               single_pass=not args.two_stage, priority=args.priority, max_attempts=args.max_attempts)
+        print(job_id)
+    elif command == "import":
+        from batch_processor import load_jobs
+        for batch_job in load_jobs(args.jobs):
+            queue.enqueue(batch_job.video_files, batch_job.audio_files, batch_job.output_dir,
+                          output_name=batch_job.output_name, priority=args.priority,
+                          max_attempts=args.max_attempts, name=batch_job.job_id)
+        print(f"[Queue] {queue.counts()}")
+    elif command == "run":
+        worker = QueueWorker(queue, processor, workers=args.workers, order=args.order)
+        try:
+            import signal
+            signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        except (ImportError, ValueError, AttributeError):
+            pass
+        worker.run(exit_when_empty=args.exit_when_empty)
+        counts = JobQueue(args.db).counts()
+        print(f"[Queue] {counts}")
+        return 1 if counts.get(FAILED) else 0
+    elif command == "list":
+        jobs = queue.list(args.state)
+        if args.json:
+            print(json.dumps([job.to_json() for job in jobs], ensure_ascii=False, indent=2))
+        else:
+            for job in jobs:
+                progress = f"{job.progress:.0%}" if job.progress is not None else "-"
+                detail = job.output or ""
+                if not detail and job.error:
+                    detail = job.error.splitlines()[0]
+                print(f"#{job.id}\t{job.state}\t{job.attempts}/{job.max_attempts}\t{progress}\t"
+                      f"{job.size_bytes / 1024 / 1024:.1f} MB\t{detail}")
+    elif command in ("cancel", "retry"):
+        action = queue.cancel if command == "cancel" else queue.retry
+        failed = [job_id for job_id in args.ids if not action(job_id)]
+        if failed:
+            print(f"[Queue] 无法{'取消' if command == 'cancel' else '重试'} / Cannot {command}: {failed}")
+            return 1
+    elif command == "purge":
+        print(f"[Queue] 删除 / Deleted {queue.purge(args.days)}")
+    return 0
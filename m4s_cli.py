@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+M4S 命令行工具（无界面，不导入 tkinter / customtkinter）
+M4S Command-Line Tool (headless; never imports tkinter / customtkinter)
+
+用法 / Usage:
+    python m4s_cli.py merge-video v1.m4s v2.m4s -o out_dir
+    python m4s_cli.py merge-audio a1.m4s a2.m4s -o out_dir
+    python m4s_cli.py mux --video v1.m4s v2.m4s --audio a1.m4s a2.m4s -o out_dir
+    python m4s_cli.py batch jobs.jsonl --report report.json
+    python m4s_cli.py watch ~/Downloads/bilibili --settle 5 --workers 2
+    python m4s_cli.py queue add --video v1.m4s --audio a1.m4s -o out_dir && python m4s_cli.py queue run
+    python m4s_cli.py serve --port 8765 --workers 2
+    python m4s_cli.py probe *.m4s --json
+    python m4s_cli.py validate *.m4s
+    python -m m4s_cli ...
+
+处理模块在子命令内部按需导入，保证冷启动开销最小；--timings 会把启动耗时
+与预算 COLD_START_BUDGET_MS 对比后输出到 stderr。
+Processing modules are imported inside each subcommand to keep cold start minimal;
+--timings prints the startup cost against COLD_START_BUDGET_MS to stderr.
+"""
+
+import time
+
+_STARTED = time.perf_counter()
+
+import argparse  # noqa: E402
+import sys  # noqa: E402
+
+# 从加载本模块到开始处理的时间预算（毫秒） / Budget from loading this module to starting work (ms)
+COLD_START_BUDGET_MS = 150.0
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_INTERRUPTED = 130
+
+
+def _print_progress(stage, current, total, message):
+    print(f"[进度/Progress] {message}", file=sys.stderr, flush=True)
+
+
+def _report_timings(args, label: str):
+    if getattr(args, "timings", False):
+        elapsed_ms = (time.perf_counter() - _STARTED) * 1000
+        verdict = "OK" if elapsed_ms <= COLD_START_BUDGET_MS else "超出预算 / OVER BUDGET"
+        print(f"[CLI] {label}: {elapsed_ms:.1f} ms (预算 / budget {COLD_START_BUDGET_MS:.0f} ms) {verdict}",
+              file=sys.stderr)
+
+
+def _make_sink(args):
+    """根据 --metrics-* 选项创建指标输出端 / Build the metrics sink from the --metrics-* options"""
+    from metrics import JsonLinesSink, MultiSink, PrometheusSink
+    sinks = []
+    if args.metrics_jsonl:
+        sinks.append(JsonLinesSink(args.metrics_jsonl))
+    if args.metrics_prom:
+        sinks.append(PrometheusSink(args.metrics_prom))
+    if not sinks:
+        return None
+    return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
+
+
+def _make_processor(args):
+    from m4s_processor import M4SProcessor
+    processor = M4SProcessor(
+        ffmpeg_path=args.ffmpeg,
+        use_native=not args.no_native,
+        use_result_cache=not args.no_cache,
+        metrics_sink=_make_sink(args) if args.metrics_jsonl or args.metrics_prom else None,
+    )
+    processor.show_timings = args.timings
+    _report_timings(args, "启动 / startup")
+    return processor
+
+
+def _run_job(processor, method: str, *call_args, **kwargs) -> int:
+    """在后台任务中运行并等待；Ctrl+C 会终止 FFmpeg 并清理输出 / Run as a job; Ctrl+C kills FFmpeg and cleans up"""
+    from m4s_job import JobCancelledError
+    job = processor.start_job(method, *call_args, **kwargs)
+    try:
+        # 短间隔轮询，保证主线程能及时收到 Ctrl+C / Poll in short steps so the main thread still sees Ctrl+C
+        while not job.done:
+            time.sleep(0.1)
+        output = job.wait()
+    except KeyboardInterrupt:
+        job.cancel()
+        try:
+            job.wait(timeout=10)
+        except Exception:
+            pass
+        print("[CLI] 已中断 / Interrupted", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except JobCancelledError:
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        print(f"[错误/Error] {e}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        if processor.metrics.sink is not None:
+            processor.metrics.sink.close()
+    print(output)
+    stats = getattr(output, "stats", None)
+    if stats is not None and getattr(processor, "show_timings", False):
+        print(stats.format(), file=sys.stderr)
+    return EXIT_OK
+
+
+def cmd_merge_video(args) -> int:
+    processor = _make_processor(args)
+    return _run_job(processor, "merge_video_segments", args.files, args.output, output_name=args.name,
+                    progress_callback=_print_progress if args.progress else None)
+
+
+def cmd_merge_audio(args) -> int:
+    processor = _make_processor(args)
+    return _run_job(processor, "merge_audio_segments", args.files, args.output, output_name=args.name,
+                    progress_callback=_print_progress if args.progress else None)
+
+
+def cmd_mux(args) -> int:
+    if not args.video and not args.audio:
+        print("[错误/Error] 需要 --video 或 --audio / --video or --audio is required", file=sys.stderr)
+        return EXIT_FAILED
+    processor = _make_processor(args)
+    return _run_job(processor, "process_all", args.video or [], args.audio or [], args.output,
+                    single_pass=not args.two_stage, output_name=args.name,
+                    progress_callback=_print_progress if args.progress else None)
+
+
+def cmd_batch(args) -> int:
+    # 批处理参数在这里才解析，避免其他子命令导入 batch_processor
+    # Batch options are parsed only here so other subcommands never import batch_processor
+    from batch_processor import add_batch_arguments, run_batch_cli
+    parser = argparse.ArgumentParser(prog="m4s_cli batch", description="批量处理任务文件 / Process a job file")
+    add_batch_arguments(parser)
+    batch_args = parser.parse_args(args.passthrough_args, namespace=args)
+    processor = _make_processor(batch_args)
+    try:
+        return run_batch_cli(batch_args, processor)
+    finally:
+        if processor.metrics.sink is not None:
+            processor.metrics.sink.close()
+
+
+def cmd_watch(args) -> int:
+    # 与 batch 相同，监视参数在这里才解析 / As with batch, watch options are parsed only here
+    from watch_daemon import add_watch_arguments, run_watch_cli
+    parser = argparse.ArgumentParser(prog="m4s_cli watch",
+                                     description="监视目录并自动合并下载完成的片段 / Watch folders and auto-merge completed downloads")
+    add_watch_arguments(parser)
+    watch_args = parser.parse_args(args.passthrough_args, namespace=args)
+    processor = _make_processor(watch_args)
+    try:
+        return run_watch_cli(watch_args, processor)
+    finally:
+        if processor.metrics.sink is not None:
+            processor.metrics.sink.close()
+
+
+def cmd_queue(args) -> int:
+    from job_queue import add_queue_arguments, needs_processor, run_queue_cli
+    parser = argparse.ArgumentParser(prog="m4s_cli queue", description="持久化任务队列 / Persistent job queue")
+    add_queue_arguments(parser)
+    queue_args = parser.parse_args(args.passthrough_args, namespace=args)
+    if not needs_processor(queue_args):
+        return run_queue_cli(queue_args)
+    processor = _make_processor(queue_args)
+    try:
+        return run_queue_cli(queue_args, processor)
+    finally:
+        if processor.metrics.sink is not None:
+            processor.metrics.sink.close()
+
+
+def cmd_serve(args) -> int:
+    from http_service import add_serve_arguments, run_serve_cli
+    parser = argparse.ArgumentParser(prog="m4s_cli serve", description="本地 HTTP 任务服务 / Local HTTP job service")
+    add_serve_arguments(parser)
+    serve_args = parser.parse_args(args.passthrough_args, namespace=args)
+    processor = _make_processor(serve_args)
+    try:
+        return run_serve_cli(serve_args, processor)
+    finally:
+        if processor.metrics.sink is not None:
+            processor.metrics.sink.close()
+
+
+def cmd_probe(args) -> int:
+    import json
+    from segment_probe import ProbeCache, probe_segments
+    _report_timings(args, "启动 / startup")
+    # --no-cache 时只用内存缓存，不读写磁盘 / With --no-cache use an in-memory cache only
+    cache = ProbeCache(persistent=False) if args.no_cache else None
+    infos = probe_segments(args.files, cache=cache)
+    failed = 0
+    if args.json:
+        print(json.dumps([info.to_json() if info else {"path": path, "error": "unreadable"}
+                          for path, info in zip(args.files, infos)], ensure_ascii=False, indent=2))
+        failed = sum(1 for info in infos if info is None)
+    else:
+        for path, info in zip(args.files, infos):
+            if info is None:
+                failed += 1
+                print(f"{path}\t无法解析 / unreadable")
+                continue
+            duration = f"{info.duration:.3f}s" if info.duration is not None else "?"
+            codecs = ",".join(f"{t.handler}:{t.codec}" for t in info.tracks)
+            print(f"{path}\t{info.size / 1024 / 1024:.1f} MB\t{duration}\t{info.fragment_count} frag\t{codecs}")
+    _report_timings(args, "完成 / done")
+    return EXIT_OK if failed == 0 else EXIT_FAILED
+
+
+def cmd_validate(args) -> int:
+    import json
+    from segment_validator import validate_segments
+    _report_timings(args, "启动 / startup")
+    report = validate_segments(args.files)
+    if args.json:
+        print(json.dumps({"segments": report.segments, "seconds": round(report.seconds, 4),
+                          "issues": [issue._asdict() for issue in report.issues]}, ensure_ascii=False, indent=2))
+    elif report.ok:
+        print(f"[Validate] {report.segments} 个片段通过预检 / {report.segments} segment(s) passed "
+              f"({report.seconds * 1000:.1f} ms)")
+    else:
+        print(report.format(limit=len(report.issues)))
+    _report_timings(args, "完成 / done")
+    return EXIT_OK if report.ok else EXIT_FAILED
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="m4s_cli",
+        description="M4S 音视频合并命令行工具 / Headless M4S audio/video merge tool",
+    )
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="FFmpeg 可执行文件路径 / FFmpeg executable path")
+    parser.add_argument("--no-native", action="store_true",
+                        help="禁用原生 fMP4 拼接与混流，始终使用 FFmpeg / Disable native fMP4 concat and mux, always use FFmpeg")
+    parser.add_argument("--no-cache", action="store_true", help="不使用结果/探测缓存 / Do not use the result/probe caches")
+    parser.add_argument("--timings", action="store_true",
+                        help="输出冷启动与各阶段耗时 / Print cold-start and per-stage timings")
+    parser.add_argument("--metrics-jsonl", metavar="PATH",
+                        help="把阶段计时追加到 JSON Lines 文件 / Append stage timings to a JSON Lines file")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+                        help="写出 Prometheus 文本格式指标 / Write Prometheus text-format metrics")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    for name, func, help_text in (
+        ("merge-video", cmd_merge_video, "合并视频片段 / Merge video segments"),
+        ("merge-audio", cmd_merge_audio, "合并音频片段 / Merge audio segments"),
+    ):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("files", nargs="+", help="按顺序排列的 .m4s 片段 / .m4s segments in order")
+        p.add_argument("-o", "--output", default=".", help="输出目录 / Output directory")
+        p.add_argument("-n", "--name", help="输出文件名 / Output filename")
+        p.add_argument("--progress", action="store_true", help="在 stderr 输出进度 / Print progress to stderr")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("mux", help="合并并混流音视频 / Merge and mux video with audio")
+    p.add_argument("--video", nargs="+", help="视频片段 / Video segments")
+    p.add_argument("--audio", nargs="+", help="音频片段 / Audio segments")
+    p.add_argument("-o", "--output", default=".", help="输出目录 / Output directory")
+    p.add_argument("-n", "--name", help="输出文件名 / Output filename")
+    p.add_argument("--two-stage", action="store_true",
+                   help="先分别合并再混流（写中间文件） / Merge each stream first, then mux (writes intermediates)")
+    p.add_argument("--progress", action="store_true", help="在 stderr 输出进度 / Print progress to stderr")
+    p.set_defaults(func=cmd_mux)
+
+    # 批处理参数原样转交给 cmd_batch / Batch options are handed to cmd_batch untouched
+    p = sub.add_parser("batch", help="批量处理任务文件（详见 batch --help） / Process a job file (see batch --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("watch", help="监视目录并自动合并（详见 watch --help） / Watch folders and auto-merge (see watch --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser("queue", help="持久化任务队列（详见 queue --help） / Persistent job queue (see queue --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_queue)
+
+    p = sub.add_parser("serve", help="本地 HTTP 任务服务（详见 serve --help） / Local HTTP job service (see serve --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("probe", help="读取片段元数据（不调用 FFmpeg） / Read segment metadata (no FFmpeg)")
+    p.add_argument("files", nargs="+", help=".m4s 片段 / .m4s segments")
+    p.add_argument("--json", action="store_true", help="输出 JSON / Print JSON")
+    p.set_defaults(func=cmd_probe)
+
+    p = sub.add_parser("validate", help="预检片段结构（截断、缺少盒、编码不一致） / Pre-validate segment structure "
+                                        "(truncation, missing boxes, codec mismatches)")
+    p.add_argument("files", nargs="+", help="按顺序排列的 .m4s 片段 / .m4s segments in order")
+    p.add_argument("--json", action="store_true", help="输出 JSON / Print JSON")
+    p.set_defaults(func=cmd_validate)
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.func in (cmd_batch, cmd_watch, cmd_queue, cmd_serve):
+        args.passthrough_args = extra
+    elif extra:
+        parser.error(f"无法识别的参数 / unrecognized arguments: {' '.join(extra)}")
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        print("[CLI] 已中断 / Interrupted", file=sys.stderr)
+        return EXIT_INTERRUPTED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
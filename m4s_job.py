@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+可取消的处理任务句柄
+Cancellable Processing Job Handle
+
+M4SJob 持有任务运行期间的 FFmpeg 子进程、未完成的输出文件和临时目录。
+cancel() 会立即终止子进程，任务结束时（取消或失败）清理所有未完成的输出。
+
+M4SJob owns the FFmpeg child processes, unfinished output files and temp directories
+of a running task. cancel() kills the children at once; when the task ends cancelled
+or failed, every unfinished output is removed.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+from typing import Callable, List, Optional
+
+
+class JobCancelledError(RuntimeError):
+    """任务已被取消 / The job was cancelled"""
+
+    def __init__(self, message: str = "任务已取消 / Job cancelled"):
+        super().__init__(message)
+
+
+class M4SJob:
+    """处理任务句柄 / Processing job handle"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.status = self.PENDING
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+        self._processes: List[subprocess.Popen] = []
+        self._partial_paths: List[str] = []
+        self._done_callbacks: List[Callable[["M4SJob"], None]] = []
+        self._children: List["M4SJob"] = []
+        self._thread: Optional[threading.Thread] = None
+
+    # --- 生命周期 / Lifecycle ---
+    def start(self, func: Callable[[], object]) -> "M4SJob":
+        """在后台线程中运行 func / Run func on a background thread"""
+        self._thread = threading.Thread(target=self.run, args=(func,), name=f"m4s-job-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self, func: Callable[[], object]):
+        """
+        在当前线程中运行 func 并记录结果（不抛出异常）
+        Run func on the current thread and record the outcome (never raises)
+        """
+        with self._lock:
+            if self._cancel_event.is_set():
+                self.status = self.CANCELLED
+                self.error = JobCancelledError()
+        if self.status != self.CANCELLED:
+            self.status = self.RUNNING
+            try:
+                self.result = func()
+                self.status = self.SUCCEEDED
+            except BaseException as e:
+                self.error = e
+                self.status = self.CANCELLED if self.cancelled else self.FAILED
+                self._cleanup_partial()
+        self._done_event.set()
+        for callback in list(self._done_callbacks):
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"[Job] 完成回调出错 / Done callback failed: {e}")
+
+    def cancel(self):
+        """请求取消并立即终止子进程 / Request cancellation and kill child processes at once"""
+        with self._lock:
+            self._cancel_event.set()
+            processes = list(self._processes)
+            children = list(self._children)
+        for process in processes:
+            _kill(process)
+        for child in children:
+            child.cancel()
+
+    def child(self, name: str = "") -> "M4SJob":
+        """
+        创建子任务：取消本任务时一并取消，单独取消子任务不影响本任务
+        Create a sub-job cancelled together with this one; cancelling the sub-job alone leaves this job running
+        """
+        sub = M4SJob(f"{self.name}/{name}" if self.name else name)
+        with self._lock:
+            self._children.append(sub)
+            cancelled = self._cancel_event.is_set()
+        if cancelled:
+            sub.cancel()
+        return sub
+
+    def wait(self, timeout: Optional[float] = None):
+        """
+        等待任务结束并返回结果；失败时重新抛出原始异常
+        Wait for the job to finish and return its result; re-raise the original error on failure
+
+        Raises:
+            TimeoutError: 超时仍未结束 / still running after timeout
+            JobCancelledError: 任务被取消 / the job was cancelled
+        """
+        if not self._done_event.wait(timeout):
+            raise TimeoutError(f"任务仍在运行 / Job still running: {self.name}")
+        if self.status == self.CANCELLED:
+            raise JobCancelledError()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def add_done_callback(self, callback: Callable[["M4SJob"], None]):
+        """任务结束时（在工作线程中）调用 / Called on the worker thread when the job ends"""
+        with self._lock:
+            if not self._done_event.is_set():
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self._done_event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelledError()
+
+    # --- 资源登记 / Resource tracking ---
+    def attach_process(self, process: subprocess.Popen):
+        """登记子进程；若已取消则立即终止 / Track a child process; kill it at once if already cancelled"""
+        with self._lock:
+            self._processes.append(process)
+            cancelled = self._cancel_event.is_set()
+        if cancelled:
+            _kill(process)
+
+    def detach_process(self, process: subprocess.Popen):
+        with self._lock:
+            if process in self._processes:
+                self._processes.remove(process)
+
+    def track_partial(self, path: str):
+        """
+        登记一个尚未完成的输出文件或临时目录，任务失败或取消时删除
+        Track an unfinished output file or temp directory; removed if the job fails or is cancelled
+        """
+        with self._lock:
+            self._partial_paths.append(str(path))
+
+    def untrack_partial(self, path: str):
+        """输出已完成，不再需要清理 / The output is complete and must be kept"""
+        with self._lock:
+            if str(path) in self._partial_paths:
+                self._partial_paths.remove(str(path))
+
+    def _cleanup_partial(self):
+        with self._lock:
+            paths, self._partial_paths = self._partial_paths, []
+        for path in reversed(paths):
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.unlink(path)
+            except OSError as e:
+                print(f"[Job] 无法删除未完成的输出 / Could not remove partial output {path}: {e}")
+
+
+def _kill(process: subprocess.Popen):
+    if process.poll() is None:
+        try:
+            process.kill()
+        except OSError:
+            pass
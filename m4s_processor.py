@@ -6,16 +6,55 @@ M4S File Processing Core Logic
 """
 
 import subprocess
+import contextvars
 import os
+import shutil
 import tempfile
+import functools
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+
+from m4s_job import JobCancelledError, M4SJob
+from ffmpeg_resolver import FFmpegInfo, default_resolver, resolve_ffmpeg
+from ffmpeg_runner import FFmpegResult, ProgressCallback, ProgressTracker, run_ffmpeg
+from metrics import MergeResult, MetricsRecorder, MetricsSink, total_size
+from fmp4_mux import FragmentedMuxer
+from native_concat import NativeConcatenator, NativeConcatError
+from result_cache import ResultCache, make_key
+from segment_probe import probe_segments
+from segment_validator import SegmentValidationError, check_segments
+from staging import discard, make_staging_dir, partial_path, plan_staging, publish, remove_stale_partials
+
+
+# 从 stdin 读取 ffconcat 列表的 concat 输入参数 / concat input arguments reading the ffconcat list from stdin
+CONCAT_PIPE_ARGS = ["-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe", "-i", "pipe:0"]
+
+
+def _instrumented(operation: str):
+    """
+    把公共方法包装为一次计时任务，返回带 .stats 的 MergeResult；嵌套调用并入外层任务
+    Wrap a public method as one timed job returning a MergeResult with .stats; nested calls join the outer job
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.job(operation) as stats:
+                output = func(self, *args, **kwargs)
+            return MergeResult(output, stats)
+        return wrapper
+    return decorator
 
 
 class M4SProcessor:
-    def __init__(self, ffmpeg_path: str = "ffmpeg", check_ffmpeg: bool = True):
+    def __init__(self, ffmpeg_path: str = "ffmpeg", check_ffmpeg: bool = True, use_native: bool = True,
+                 result_cache: Optional[ResultCache] = None, use_result_cache: bool = True,
+                 full_hash: bool = False, metrics_sink: Optional[MetricsSink] = None,
+                 validate_segments: bool = True):
         """
         初始化处理器 / Initialize Processor
         
@@ -24,8 +63,29 @@ class M4SProcessor:
                          FFmpeg executable path, default is "ffmpeg" (must be in PATH)
             check_ffmpeg: 是否在初始化时检查 FFmpeg，默认为 True
                           Whether to check FFmpeg on initialization, default is True
+            use_native: 是否优先使用原生 fMP4 拼接引擎，失败时回退到 FFmpeg
+                        Prefer the native fMP4 concat engine, falling back to FFmpeg
+            result_cache: 结果缓存实例，默认使用用户缓存目录 / Result cache, defaults to the user cache dir
+            use_result_cache: 是否复用相同输入的历史结果 / Reuse earlier results for identical inputs
+            full_hash: 输入指纹对全部字节做哈希（默认采样） / Fingerprint inputs over every byte (sampled by default)
+            metrics_sink: 阶段计时的输出端（见 metrics.py），默认只随结果返回
+                          Sink for stage timings (see metrics.py); by default they are only returned with results
+            validate_segments: 交给 FFmpeg 前先并行预检片段结构（见 segment_validator.py）
+                               Pre-validate segment structure in parallel before handing it to FFmpeg (see segment_validator.py)
         """
         self.ffmpeg_path = ffmpeg_path
+        self.use_native = use_native
+        # 可选的并发闸门：限制同时运行的 FFmpeg 进程（CPU 阶段）和原生拷贝（I/O 阶段）
+        # Optional concurrency gates: cap concurrent FFmpeg processes (CPU stage) and native copies (I/O stage)
+        self.ffmpeg_slots: Optional[threading.Semaphore] = None
+        self.io_slots: Optional[threading.Semaphore] = None
+        # 调用方临时提供的闸门（如批处理），只在其上下文中生效 / Gates a caller supplies for its own context only (e.g. a batch)
+        self._scoped_slots: contextvars.ContextVar = contextvars.ContextVar(f"m4s_slots_{id(self)}", default=None)
+        self.result_cache = (result_cache or ResultCache()) if use_result_cache else None
+        self.full_hash = full_hash
+        self.validate_segments = validate_segments
+        self._ffmpeg_info: Optional[FFmpegInfo] = None
+        self.metrics = MetricsRecorder(metrics_sink)
         if check_ffmpeg:
             self._check_ffmpeg()
     
@@ -41,60 +101,204 @@ class M4SProcessor:
         Returns:
             是否可用 / Available status
         """
-        try:
-            print(f"[FFmpeg] 检查 FFmpeg (路径: {ffmpeg_path})... / Checking FFmpeg...")
-            result = subprocess.run(
-                [ffmpeg_path, "-version"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=True,
-                timeout=5  # 缩短超时时间到5秒 / Shorten timeout to 5s
-            )
-            print("[FFmpeg] FFmpeg 检查成功，已安装 / FFmpeg check successful, installed")
-            return True
-        except FileNotFoundError:
-            print("[FFmpeg] FFmpeg 未找到（不在 PATH 中） / FFmpeg not found (not in PATH)")
-            return False
-        except subprocess.TimeoutExpired:
-            print("[FFmpeg] FFmpeg 检查超时（可能卡住） / FFmpeg check timed out (might be stuck)")
-            return False
-        except subprocess.CalledProcessError as e:
-            print(f"[FFmpeg] FFmpeg 检查失败（返回码: {e.returncode}） / FFmpeg check failed (Return Code: {e.returncode})")
-            return False
-        except Exception as e:
-            # 记录其他异常 / Log other exceptions
-            print(f"[FFmpeg] 检查 FFmpeg 时出错: {e} / Error checking FFmpeg: {e}")
+        print(f"[FFmpeg] 检查 FFmpeg (路径: {ffmpeg_path})... / Checking FFmpeg...")
+        # 能力缓存有效时不启动子进程 / No subprocess while the capability cache is valid
+        info = resolve_ffmpeg(ffmpeg_path)
+        if info is None:
+            print("[FFmpeg] FFmpeg 未找到或无法运行 / FFmpeg not found or not runnable")
             return False
+        print(f"[FFmpeg] FFmpeg 检查成功，已安装 / FFmpeg check successful, installed: {info.path}")
+        return True
         
     def _check_ffmpeg(self):
-        """检查 FFmpeg 是否可用（实例方法） / Check FFmpeg availability (Instance method)"""
-        if not self.check_ffmpeg_available(self.ffmpeg_path):
+        """检查 FFmpeg 是否可用（实例方法），并改用解析出的完整路径 / Check FFmpeg availability and adopt the resolved path"""
+        info = resolve_ffmpeg(self.ffmpeg_path)
+        if info is None:
             raise RuntimeError(
                 "未找到 FFmpeg！请确保 FFmpeg 已安装并添加到系统 PATH 环境变量中。\n"
                 "FFmpeg not found! Please ensure FFmpeg is installed and added to system PATH.\n\n"
                 "下载地址 / Download: https://ffmpeg.org/download.html"
             )
+        print(f"[FFmpeg] FFmpeg 已就绪 / FFmpeg ready: {info.path}")
+        self.ffmpeg_path = info.path
+        self._ffmpeg_info = info
     
-    def _create_file_list(self, files: List[str], list_file_path: str):
+    def _validate_segments(self, files: List[str]):
+        """
+        FFmpeg 启动前的结构预检，坏片段在毫秒级被拒绝 / Structural check before FFmpeg starts; bad segments are rejected in milliseconds
+
+        只检查多于一个片段的列表（即 concat 输入）；单个文件直接交给 FFmpeg，同步和异步处理器规则相同
+        Only lists of more than one segment (the concat inputs) are checked; a single file goes straight
+        to FFmpeg. The sync and async processors share this rule
+
+        Raises:
+            SegmentValidationError: 片段被截断、缺少 ftyp/moov 或彼此不一致 / truncated, missing ftyp/moov or inconsistent segments
         """
-        创建文件列表文件（用于 FFmpeg concat）
-        Create file list for FFmpeg concat
+        if not self.validate_segments or len(files) <= 1:
+            return
+        with self.metrics.span("validate", segments=len(files)):
+            report = check_segments(files)
+        print(f"[Validate] {len(files)} 个片段通过预检 / {len(files)} segment(s) passed pre-validation "
+              f"({report.seconds * 1000:.1f} ms)")
+
+    def _concat_list(self, files: List[str]) -> bytes:
+        """
+        生成 ffconcat 1.0 列表（用于 FFmpeg concat），每段附带从盒头精确累加的时长，
+        FFmpeg 无需打开下一个文件就能确定时间线；时长未知的片段不写 duration
+        Build an ffconcat 1.0 list (for FFmpeg concat) with each segment's exact duration summed
+        from its box headers, so FFmpeg knows the timeline without opening the next file;
+        segments of unknown duration get no duration line
         """
         try:
-            with open(list_file_path, 'w', encoding='utf-8') as f:
+            with self.metrics.span("file_list", segments=len(files)):
                 for file in files:
                     if not os.path.exists(file):
                         raise FileNotFoundError(f"文件不存在 / File not found: {file}")
-                    # 使用绝对路径并转义单引号和特殊字符
-                    # Use absolute path and escape single quotes and special characters
-                    abs_path = os.path.abspath(file).replace('\\', '/')
-                    # 转义单引号（如果路径中包含单引号）
-                    # Escape single quotes (if path contains single quotes)
-                    abs_path = abs_path.replace("'", "'\\''")
-                    f.write(f"file '{abs_path}'\n")
+                # 时长来自探测缓存 / Durations come from the probe cache
+                infos = probe_segments(files)
+                lines = ["ffconcat version 1.0"]
+                for file, info in zip(files, infos):
+                    # 使用绝对路径并转义单引号；条目相对列表 URL 解析，列表来自 pipe:0 时裸路径会变成
+                    # pipe:/abs/path，所以显式加 file: 协议
+                    # Use absolute paths and escape single quotes; entries resolve against the list's URL and
+                    # a bare path would become pipe:/abs/path for a list read from pipe:0, so spell out file:
+                    abs_path = os.path.abspath(file).replace('\\', '/').replace("'", "'\\''")
+                    lines.append(f"file 'file:{abs_path}'")
+                    if info is not None and info.media_duration:
+                        lines.append(f"duration {info.media_duration:.6f}")
+                return ("\n".join(lines) + "\n").encode("utf-8")
         except Exception as e:
             raise RuntimeError(f"创建文件列表失败 / Failed to create file list: {str(e)}")
-    
+
+    def _concat_inputs(self, groups: List[List[str]], list_files: List[str]) -> Tuple[List[str], Optional[bytes]]:
+        """
+        为每组输入生成 FFmpeg 输入参数：单个文件直接 -i；多个片段用 concat 列表，第一个列表经 stdin
+        (pipe:0) 传入，其余列表（stdin 只有一个）写入临时文件并记入 list_files 以便清理。
+        返回 (参数, 写入 stdin 的数据)
+        Build FFmpeg input arguments per group: a single file is passed with -i, several segments
+        become a concat list. The first list goes over stdin (pipe:0); any further list (there is only
+        one stdin) is written to a temp file recorded in list_files for cleanup.
+        Returns (arguments, data for stdin)
+        """
+        args: List[str] = []
+        stdin_data = None
+        for files in groups:
+            if len(files) == 1:
+                if not os.path.exists(files[0]):
+                    raise FileNotFoundError(f"文件不存在 / File not found: {files[0]}")
+                args += ["-i", files[0]]
+                continue
+            data = self._concat_list(files)
+            if stdin_data is None:
+                stdin_data = data
+                args += CONCAT_PIPE_ARGS
+                continue
+            with tempfile.NamedTemporaryFile(mode='wb', suffix='.ffconcat', delete=False) as f:
+                list_files.append(f.name)
+                f.write(data)
+            args += ["-f", "concat", "-safe", "0", "-i", f.name]
+        return args, stdin_data
+
+    @contextmanager
+    def concurrency_gates(self, ffmpeg_slots: Optional[threading.Semaphore],
+                          io_slots: Optional[threading.Semaphore]):
+        """
+        在当前上下文（线程及其复制出的上下文）中改用给定的闸门，不修改处理器本身，其他调用方不受影响
+        Use the given gates within the current context (this thread and contexts copied from it) without
+        touching the processor itself, so other callers are unaffected
+        """
+        token = self._scoped_slots.set((ffmpeg_slots, io_slots))
+        try:
+            yield
+        finally:
+            self._scoped_slots.reset(token)
+
+    @contextmanager
+    def _stage_slot(self, stage: str):
+        """
+        占用一个阶段（"ffmpeg" 或 "io"）的并发名额（未设置时不限制）
+        Hold one concurrency slot of a stage ("ffmpeg" or "io"); unlimited when unset
+        """
+        scoped = self._scoped_slots.get()
+        ffmpeg_slots, io_slots = scoped if scoped is not None else (self.ffmpeg_slots, self.io_slots)
+        slots = ffmpeg_slots if stage == "ffmpeg" else io_slots
+        if slots is None:
+            yield
+            return
+        with slots:
+            yield
+
+    def _run_ffmpeg(self, cmd: List[str], stage: str = "", total_duration_us: Optional[int] = None,
+                    progress_callback: Optional[ProgressCallback] = None,
+                    job: Optional[M4SJob] = None, inputs: Optional[List[str]] = None,
+                    output: Optional[Path] = None, input_data: Optional[bytes] = None) -> FFmpegResult:
+        """
+        运行一条 FFmpeg 命令（受 ffmpeg_slots 限制），并实时回报进度；inputs / output 用于统计读写字节数，
+        input_data 写入 FFmpeg 的 stdin
+        Run one FFmpeg command (bounded by ffmpeg_slots) and report progress as it runs;
+        inputs / output are used for the bytes read / written figures, input_data is written to FFmpeg's stdin
+        """
+        inputs = inputs or []
+        with self._stage_slot("ffmpeg"), \
+                self.metrics.span(f"ffmpeg_{stage}", total_size(inputs), len(inputs)) as span:
+            result = run_ffmpeg(
+                cmd,
+                stage=stage,
+                total_duration_us=total_duration_us,
+                progress_callback=progress_callback,
+                timeout=3600,  # 1小时超时 / 1 hour timeout
+                job=job,
+                input_data=input_data
+            )
+            span.exit_code = result.returncode
+            if output is not None and os.path.exists(output):
+                span.bytes_written = os.path.getsize(output)
+        self.metrics.record("ffmpeg_spawn", result.spawn_started, result.spawn_seconds)
+        return result
+
+    def _estimate_duration_us(self, files: List[str]) -> Optional[int]:
+        """
+        根据盒头估算片段总时长（微秒），用于计算进度百分比；元数据来自探测缓存
+        Estimate the total duration of segments (µs) from box headers, for progress percentages;
+        metadata comes from the probe cache
+        """
+        with self.metrics.span("probe", segments=len(files)):
+            infos = probe_segments(files)
+        total = 0.0
+        for info in infos:
+            if info is None or info.duration is None:
+                return None
+            total += info.duration
+        return int(total * 1_000_000)
+
+    @property
+    def ffmpeg_info(self) -> Optional[FFmpegInfo]:
+        """
+        当前 FFmpeg 的版本与能力（来自持久化缓存），不可用时为 None
+        Version and capabilities of the current FFmpeg (from the persistent cache), None if unusable
+        """
+        if self._ffmpeg_info is None:
+            executable = shutil.which(self.ffmpeg_path) or self.ffmpeg_path
+            self._ffmpeg_info = default_resolver().lookup(executable)
+        return self._ffmpeg_info
+
+    def ffmpeg_version(self) -> Optional[str]:
+        """FFmpeg 版本行，无法获取时为 None / FFmpeg version line, None if unknown"""
+        info = self.ffmpeg_info
+        return info.version if info is not None else None
+
+    def _result_cache_key(self, inputs: List[List[str]], mode: str) -> Optional[str]:
+        """计算结果缓存键；缓存关闭或输入不可读时为 None / Result cache key; None if disabled or inputs unreadable"""
+        if self.result_cache is None:
+            return None
+        version = self.ffmpeg_version()
+        if version is None:
+            return None
+        try:
+            return make_key(inputs, f"{mode}:native={int(self.use_native)}", version, self.full_hash)
+        except OSError:
+            return None
+
     def _timestamp_str(self) -> str:
         """Generate a filesystem-friendly timestamp accurate to seconds."""
         return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -104,7 +308,106 @@ class M4SProcessor:
         ext = extension if extension.startswith(".") else f".{extension}"
         return f"{prefix}_{self._timestamp_str()}{ext}"
 
-    def _prepare_stream_for_mux(self, files: List[str], temp_dir: str, is_video: bool) -> str:
+    @staticmethod
+    def _begin_output(final_file: Path, job: Optional[M4SJob]) -> Path:
+        """
+        返回同目录下的临时输出路径；完成前最终文件名不会出现
+        Return a temp output path in the same directory; the final name only appears once complete
+        """
+        output_file = partial_path(final_file)
+        if job is not None:
+            job.track_partial(str(output_file))
+        return output_file
+
+    def _finish_output(self, output_file: Path, final_file: Path, job: Optional[M4SJob]) -> str:
+        """原子地发布已完整写入的输出 / Atomically publish a fully written output"""
+        with self.metrics.span("publish"):
+            publish(output_file, final_file)
+        if job is not None:
+            job.untrack_partial(str(output_file))
+        return str(final_file)
+
+    def start_job(self, method: str, *args, **kwargs) -> M4SJob:
+        """
+        在后台线程中启动一个处理方法，返回可取消的任务句柄
+        Start a processing method on a background thread and return a cancellable job handle
+
+        Args:
+            method: 方法名，如 "process_all" / Method name, e.g. "process_all"
+            *args, **kwargs: 传给该方法的参数 / Arguments for the method
+
+        Returns:
+            任务句柄，支持 cancel() / wait() / status / Job handle with cancel() / wait() / status
+        """
+        func = getattr(self, method)
+        job = M4SJob(method)
+        return job.start(lambda: func(*args, job=job, **kwargs))
+
+    def _try_native_concat(self, files: List[str], output_file: Path, stage: str = "",
+                           progress_callback: Optional[ProgressCallback] = None,
+                           job: Optional[M4SJob] = None) -> bool:
+        """
+        尝试用原生引擎拼接分片；输入不是可拼接的 fMP4 时返回 False 以回退到 FFmpeg
+        Try joining with the native engine; return False to fall back to FFmpeg when
+        the inputs are not joinable fMP4
+        """
+        if not self.use_native:
+            return False
+        for file in files:
+            if not os.path.exists(file):
+                raise FileNotFoundError(f"文件不存在 / File not found: {file}")
+        try:
+            tracker = ProgressTracker(stage, -1, progress_callback)
+
+            def on_bytes(done: int, total: int):
+                if job is not None:
+                    job.raise_if_cancelled()
+                tracker.total = total
+                tracker.update(done, done, force=(done == total))
+
+            with self._stage_slot("io"), \
+                    self.metrics.span("native_concat", total_size(files), len(files)) as span:
+                NativeConcatenator().concat(files, str(output_file), on_bytes)
+                span.bytes_written = os.path.getsize(output_file)
+        except NativeConcatError as e:
+            print(f"[Native] 原生拼接不可用，回退到 FFmpeg / Native concat unavailable, falling back to FFmpeg: {e}")
+            return False
+        return True
+
+    def _try_native_mux(self, video_files: List[str], audio_files: List[str], output_file: Path,
+                        progress_callback: Optional[ProgressCallback] = None,
+                        job: Optional[M4SJob] = None) -> bool:
+        """
+        尝试用原生混流器合并音视频；输入不适合时返回 False 以回退到 FFmpeg
+        Try muxing with the native muxer; return False to fall back to FFmpeg when the inputs are unsuitable
+        """
+        if not self.use_native:
+            return False
+        for file in video_files + audio_files:
+            if not os.path.exists(file):
+                raise FileNotFoundError(f"文件不存在 / File not found: {file}")
+        inputs = video_files + audio_files
+        try:
+            tracker = ProgressTracker("mux", -1, progress_callback)
+
+            def on_bytes(done: int, total: int):
+                if job is not None:
+                    job.raise_if_cancelled()
+                tracker.total = total
+                tracker.update(done, done, force=(done == total))
+
+            with self._stage_slot("io"), \
+                    self.metrics.span("native_mux", total_size(inputs), len(inputs)) as span:
+                FragmentedMuxer().mux(video_files, audio_files, str(output_file), on_bytes)
+                span.bytes_written = os.path.getsize(output_file)
+        except NativeConcatError as e:
+            print(f"[Native] 原生混流不可用，回退到 FFmpeg / Native mux unavailable, falling back to FFmpeg: {e}")
+            return False
+        return True
+
+    def _prepare_stream_for_mux(self, files: List[str], temp_dir: str, is_video: bool,
+                                progress_callback: Optional[ProgressCallback] = None,
+                                job: Optional[M4SJob] = None) -> str:
         """
         Prepare a stream for muxing: reuse the single original file or merge segments
         inside a temporary directory so that no intermediate artifacts remain in the
@@ -116,147 +419,184 @@ class M4SProcessor:
             return files[0]
         output_name = "temp_video.mp4" if is_video else "temp_audio.mp4"
         merge_func = self.merge_video_segments if is_video else self.merge_audio_segments
-        return merge_func(files, temp_dir, output_name=output_name)
+        return merge_func(files, temp_dir, output_name=output_name, progress_callback=progress_callback, job=job)
+
+    def _prepare_streams(self, video_files: List[str], audio_files: List[str], temp_dir: str,
+                         progress_callback: Optional[ProgressCallback] = None,
+                         job: Optional[M4SJob] = None) -> Tuple[str, str]:
+        """
+        同时准备视频流和音频流：音频在辅助线程中合并，视频在当前线程中合并，两者互不依赖
+        Prepare the video and audio streams at the same time: audio merges on a helper thread and
+        video on this one, as the two share nothing
+
+        进度回调会从两个线程交替收到 'video' 和 'audio' 阶段。两路各用一个子任务，一方失败时立即
+        取消另一方（终止其 FFmpeg），待其退出后抛出失败一方的错误。
+        The progress callback receives 'video' and 'audio' stages from both threads. Each side runs under
+        its own sub-job; when one side fails the other is cancelled at once (its FFmpeg is killed) and
+        the failing side's error is raised after it exits.
+        """
+        if len(video_files) <= 1 or len(audio_files) <= 1:
+            # 至多一路需要合并时无需额外线程 / No helper thread when at most one side needs merging
+            return (self._prepare_stream_for_mux(video_files, temp_dir, True, progress_callback, job),
+                    self._prepare_stream_for_mux(audio_files, temp_dir, False, progress_callback, job))
+        # 复制上下文，使辅助线程的 span 记入同一个 JobStats / Copy the context so the helper's spans join this JobStats
+        context = contextvars.copy_context()
+        parent = job if job is not None else M4SJob("prepare")
+        video_job, audio_job = parent.child("video"), parent.child("audio")
+
+        def on_audio_done(future):
+            if future.exception() is not None:
+                video_job.cancel()
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="m4s-audio") as pool:
+            audio_future = pool.submit(context.run, self._prepare_stream_for_mux,
+                                       audio_files, temp_dir, False, progress_callback, audio_job)
+            audio_future.add_done_callback(on_audio_done)
+            try:
+                video_input = self._prepare_stream_for_mux(video_files, temp_dir, True, progress_callback, video_job)
+            except BaseException:
+                audio_job.cancel()
+                if video_job.cancelled and not parent.cancelled:
+                    # 视频是因音频失败而被取消的，抛出音频的原始错误 / Video was cancelled because audio failed; raise audio's error
+                    audio_future.result()
+                raise
+            audio_input = audio_future.result()
+        return video_input, audio_input
     
-    def merge_video_segments(self, video_files: List[str], output_dir: str, output_name: Optional[str] = None) -> str:
+    @_instrumented("merge_video")
+    def merge_video_segments(self, video_files: List[str], output_dir: str, output_name: Optional[str] = None,
+                             progress_callback: Optional[ProgressCallback] = None,
+                             job: Optional[M4SJob] = None) -> str:
         """
         合并视频片段 / Merge video segments
         
         Args:
             video_files: 视频文件路径列表 / List of video file paths
             output_dir: 输出目录 / Output directory
+            progress_callback: 进度回调 (stage, current, total, message)
+                               Progress callback (stage, current, total, message)
+            job: 可选任务句柄，用于取消和清理未完成输出 / Optional job handle for cancel and partial-output cleanup
             
         Returns:
-            输出文件路径 / Output file path
+            输出文件路径（MergeResult，.stats 为各阶段计时） / Output file path (a MergeResult; .stats holds stage timings)
         """
         if not video_files:
             raise ValueError("视频文件列表为空 / Video file list is empty")
         
+        output_file = None
         try:
             output_dir = Path(output_dir)
             output_dir.mkdir(parents=True, exist_ok=True)
             if not output_name:
                 output_name = self._generate_output_name("Merged_Video")
-            output_file = output_dir / output_name
-            
-            # 创建临时文件列表
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as f:
-                list_file = f.name
-                self._create_file_list(video_files, list_file)
+            final_file = output_dir / output_name
+            output_file = self._begin_output(final_file, job)
+
+            if self._try_native_concat(video_files, output_file, "video", progress_callback, job):
+                return self._finish_output(output_file, final_file, job)
             
-            try:
-                # 使用 FFmpeg 合并视频 / Merge video using FFmpeg
-                cmd = [
-                    self.ffmpeg_path,
-                    "-f", "concat",
-                    "-safe", "0",
-                    "-i", list_file,
-                    "-c", "copy",
-                    "-y",  # 覆盖输出文件 / Overwrite output
-                    str(output_file)
-                ]
-                
-                result = subprocess.run(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='ignore',
-                    timeout=3600  # 1小时超时 / 1 hour timeout
-                )
-                
-                if result.returncode != 0:
-                    error_msg = result.stderr if result.stderr else "未知错误 / Unknown error"
-                    raise RuntimeError(f"FFmpeg 合并视频失败 / FFmpeg merge video failed: {error_msg}")
-                
-                if not output_file.exists():
-                    raise RuntimeError(f"输出文件未生成 / Output file not generated: {output_file}")
-                
-                return str(output_file)
-                
-            finally:
-                # 清理临时文件 / Clean up temp file
-                if os.path.exists(list_file):
-                    try:
-                        os.unlink(list_file)
-                    except:
-                        pass
+            self._validate_segments(video_files)
+            # concat 列表经 stdin 传给 FFmpeg，不写临时文件 / The concat list reaches FFmpeg over stdin, no temp file
+            concat_list = self._concat_list(video_files)
+
+            # 使用 FFmpeg 合并视频 / Merge video using FFmpeg
+            cmd = [self.ffmpeg_path] + CONCAT_PIPE_ARGS + [
+                "-c", "copy",
+                "-y",  # 覆盖输出文件 / Overwrite output
+                str(output_file)
+            ]
+
+            result = self._run_ffmpeg(
+                cmd, "video", self._estimate_duration_us(video_files), progress_callback, job,
+                inputs=video_files, output=output_file, input_data=concat_list
+            )
+
+            if result.returncode != 0:
+                error_msg = result.error_text()
+                raise RuntimeError(f"FFmpeg 合并视频失败 / FFmpeg merge video failed: {error_msg}")
+
+            if not output_file.exists():
+                raise RuntimeError(f"输出文件未生成 / Output file not generated: {output_file}")
+
+            return self._finish_output(output_file, final_file, job)
+        except (JobCancelledError, SegmentValidationError):
+            raise
         except subprocess.TimeoutExpired:
             raise RuntimeError("视频合并超时（超过1小时），请检查文件大小 / Video merge timed out (over 1 hour), please check file size")
         except Exception as e:
             raise RuntimeError(f"合并视频时出错 / Error merging video: {str(e)}\n详细信息 / Details: {traceback.format_exc()}")
+        finally:
+            discard(output_file)
     
-    def merge_audio_segments(self, audio_files: List[str], output_dir: str, output_name: Optional[str] = None) -> str:
+    @_instrumented("merge_audio")
+    def merge_audio_segments(self, audio_files: List[str], output_dir: str, output_name: Optional[str] = None,
+                             progress_callback: Optional[ProgressCallback] = None,
+                             job: Optional[M4SJob] = None) -> str:
         """
         合并音频片段 / Merge audio segments
         
         Args:
             audio_files: 音频文件路径列表 / List of audio file paths
             output_dir: 输出目录 / Output directory
+            progress_callback: 进度回调 (stage, current, total, message)
+                               Progress callback (stage, current, total, message)
+            job: 可选任务句柄，用于取消和清理未完成输出 / Optional job handle for cancel and partial-output cleanup
             
         Returns:
-            输出文件路径 / Output file path
+            输出文件路径（MergeResult，.stats 为各阶段计时） / Output file path (a MergeResult; .stats holds stage timings)
         """
         if not audio_files:
             raise ValueError("音频文件列表为空 / Audio file list is empty")
         
+        output_file = None
         try:
             output_dir = Path(output_dir)
             output_dir.mkdir(parents=True, exist_ok=True)
             if not output_name:
                 output_name = self._generate_output_name("Merged_Audio")
-            output_file = output_dir / output_name
-            
-            # 创建临时文件列表
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as f:
-                list_file = f.name
-                self._create_file_list(audio_files, list_file)
+            final_file = output_dir / output_name
+            output_file = self._begin_output(final_file, job)
+
+            if self._try_native_concat(audio_files, output_file, "audio", progress_callback, job):
+                return self._finish_output(output_file, final_file, job)
             
-            try:
-                # 使用 FFmpeg 合并音频 / Merge audio using FFmpeg
-                cmd = [
-                    self.ffmpeg_path,
-                    "-f", "concat",
-                    "-safe", "0",
-                    "-i", list_file,
-                    "-c", "copy",
-                    "-y",  # 覆盖输出文件
-                    str(output_file)
-                ]
-                
-                result = subprocess.run(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='ignore',
-                    timeout=3600  # 1小时超时
-                )
-                
-                if result.returncode != 0:
-                    error_msg = result.stderr if result.stderr else "未知错误 / Unknown error"
-                    raise RuntimeError(f"FFmpeg 合并音频失败 / FFmpeg merge audio failed: {error_msg}")
-                
-                if not output_file.exists():
-                    raise RuntimeError(f"输出文件未生成 / Output file not generated: {output_file}")
-                
-                return str(output_file)
-                
-            finally:
-                # 清理临时文件
-                if os.path.exists(list_file):
-                    try:
-                        os.unlink(list_file)
-                    except:
-                        pass
+            self._validate_segments(audio_files)
+            # concat 列表经 stdin 传给 FFmpeg，不写临时文件 / The concat list reaches FFmpeg over stdin, no temp file
+            concat_list = self._concat_list(audio_files)
+
+            # 使用 FFmpeg 合并音频 / Merge audio using FFmpeg
+            cmd = [self.ffmpeg_path] + CONCAT_PIPE_ARGS + [
+                "-c", "copy",
+                "-y",  # 覆盖输出文件
+                str(output_file)
+            ]
+
+            result = self._run_ffmpeg(
+                cmd, "audio", self._estimate_duration_us(audio_files), progress_callback, job,
+                inputs=audio_files, output=output_file, input_data=concat_list
+            )
+
+            if result.returncode != 0:
+                error_msg = result.error_text()
+                raise RuntimeError(f"FFmpeg 合并音频失败 / FFmpeg merge audio failed: {error_msg}")
+
+            if not output_file.exists():
+                raise RuntimeError(f"输出文件未生成 / Output file not generated: {output_file}")
+
+            return self._finish_output(output_file, final_file, job)
+        except (JobCancelledError, SegmentValidationError):
+            raise
         except subprocess.TimeoutExpired:
             raise RuntimeError("音频合并超时（超过1小时），请检查文件大小 / Audio merge timed out (over 1 hour), please check file size")
         except Exception as e:
             raise RuntimeError(f"合并音频时出错 / Error merging audio: {str(e)}\n详细信息 / Details: {traceback.format_exc()}")
+        finally:
+            discard(output_file)
     
-    def merge_av(self, video_file: str, audio_file: str, output_dir: str, output_name: Optional[str] = None) -> str:
+    @_instrumented("merge_av")
+    def merge_av(self, video_file: str, audio_file: str, output_dir: str, output_name: Optional[str] = None,
+                 progress_callback: Optional[ProgressCallback] = None,
+                 job: Optional[M4SJob] = None) -> str:
         """
         合并音视频 / Merge Audio and Video (Muxing)
         
@@ -265,10 +605,14 @@ class M4SProcessor:
             audio_file: 音频文件路径 / Audio file path
             output_dir: 输出目录 / Output directory
             output_name: 输出文件名 / Output filename
+            progress_callback: 进度回调 (stage, current, total, message)
+                               Progress callback (stage, current, total, message)
+            job: 可选任务句柄，用于取消和清理未完成输出 / Optional job handle for cancel and partial-output cleanup
             
         Returns:
-            输出文件路径 / Output file path
+            输出文件路径（MergeResult，.stats 为各阶段计时） / Output file path (a MergeResult; .stats holds stage timings)
         """
+        output_file = None
         try:
             if not os.path.exists(video_file):
                 raise FileNotFoundError(f"视频文件不存在 / Video file not found: {video_file}")
@@ -279,7 +623,11 @@ class M4SProcessor:
             output_dir.mkdir(parents=True, exist_ok=True)
             if not output_name:
                 output_name = self._generate_output_name("Muxed_Output")
-            output_file = output_dir / output_name
+            final_file = output_dir / output_name
+            output_file = self._begin_output(final_file, job)
+
+            if self._try_native_mux([video_file], [audio_file], output_file, progress_callback, job):
+                return self._finish_output(output_file, final_file, job)
             
             # 使用 FFmpeg 合并音视频（全部直接复制以避免重复编码）
             cmd = [
@@ -292,30 +640,114 @@ class M4SProcessor:
                 str(output_file)
             ]
             
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                errors='ignore',
-                timeout=3600  # 1小时超时
-            )
+            total_us = self._estimate_duration_us([video_file])
+            result = self._run_ffmpeg(cmd, "mux", total_us, progress_callback, job,
+                                      inputs=[video_file, audio_file], output=output_file)
             
             if result.returncode != 0:
-                error_msg = result.stderr if result.stderr else "未知错误 / Unknown error"
+                error_msg = result.error_text()
                 raise RuntimeError(f"FFmpeg 混流失败 / FFmpeg muxing failed: {error_msg}")
             
             if not output_file.exists():
                 raise RuntimeError(f"输出文件未生成 / Output file not generated: {output_file}")
             
-            return str(output_file)
+            return self._finish_output(output_file, final_file, job)
+        except JobCancelledError:
+            raise
         except subprocess.TimeoutExpired:
             raise RuntimeError("音视频混流超时（超过1小时），请检查文件大小 / Muxing timed out (over 1 hour), please check file size")
         except Exception as e:
             raise RuntimeError(f"混流时出错 / Error during muxing: {str(e)}\n详细信息 / Details: {traceback.format_exc()}")
+        finally:
+            discard(output_file)
     
-    def process_all(self, video_files: List[str], audio_files: List[str], output_dir: str) -> str:
+    @_instrumented("mux")
+    def mux_segments(self, video_files: List[str], audio_files: List[str], output_dir: str,
+                     output_name: Optional[str] = None,
+                     progress_callback: Optional[ProgressCallback] = None,
+                     job: Optional[M4SJob] = None) -> str:
+        """
+        单次调用混流：一条 FFmpeg 命令直接读取两组片段并写出最终文件，不生成中间文件
+        Single-pass mux: one FFmpeg command reads both segment lists and writes the final
+        file directly, without intermediate files
+        
+        Args:
+            video_files: 视频片段路径列表 / List of video segment paths
+            audio_files: 音频片段路径列表 / List of audio segment paths
+            output_dir: 输出目录 / Output directory
+            output_name: 输出文件名 / Output filename
+            progress_callback: 进度回调 (stage, current, total, message)
+                               Progress callback (stage, current, total, message)
+            job: 可选任务句柄，用于取消和清理未完成输出 / Optional job handle for cancel and partial-output cleanup
+            
+        Returns:
+            输出文件路径（MergeResult，.stats 为各阶段计时） / Output file path (a MergeResult; .stats holds stage timings)
+        """
+        if not video_files:
+            raise ValueError("视频文件列表为空 / Video file list is empty")
+        if not audio_files:
+            raise ValueError("音频文件列表为空 / Audio file list is empty")
+
+        list_files = []
+        output_file = None
+        try:
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            if not output_name:
+                output_name = self._generate_output_name("Muxed_Output")
+            final_file = output_dir / output_name
+            output_file = self._begin_output(final_file, job)
+
+            if self._try_native_mux(video_files, audio_files, output_file, progress_callback, job):
+                return self._finish_output(output_file, final_file, job)
+
+            for files in (video_files, audio_files):
+                self._validate_segments(files)
+            # 多个片段时通过 concat 分离器作为单个输入 / Multiple segments become one concat input
+            inputs, concat_list = self._concat_inputs([video_files, audio_files], list_files)
+            cmd = [self.ffmpeg_path] + inputs + [
+                "-map", "0:v:0",
+                "-map", "1:a:0",
+                "-c", "copy",
+                "-y",
+                str(output_file)
+            ]
+
+            video_us = self._estimate_duration_us(video_files)
+            audio_us = self._estimate_duration_us(audio_files)
+            total_us = max(video_us, audio_us) if video_us and audio_us else None
+            result = self._run_ffmpeg(cmd, "mux", total_us, progress_callback, job,
+                                      inputs=video_files + audio_files, output=output_file, input_data=concat_list)
+
+            if result.returncode != 0:
+                error_msg = result.error_text()
+                raise RuntimeError(f"FFmpeg 混流失败 / FFmpeg muxing failed: {error_msg}")
+
+            if not output_file.exists():
+                raise RuntimeError(f"输出文件未生成 / Output file not generated: {output_file}")
+
+            return self._finish_output(output_file, final_file, job)
+        except (JobCancelledError, SegmentValidationError):
+            raise
+        except subprocess.TimeoutExpired:
+            raise RuntimeError("音视频混流超时（超过1小时），请检查文件大小 / Muxing timed out (over 1 hour), please check file size")
+        except Exception as e:
+            raise RuntimeError(f"混流时出错 / Error during muxing: {str(e)}\n详细信息 / Details: {traceback.format_exc()}")
+        finally:
+            discard(output_file)
+            with self.metrics.span("cleanup"):
+                for list_file in list_files:
+                    try:
+                        os.unlink(list_file)
+                    except OSError:
+                        pass
+
+    @_instrumented("process_all")
+    def process_all(self, video_files: List[str], audio_files: List[str], output_dir: str,
+                    single_pass: bool = True, stage_bytes: Optional[Dict[str, int]] = None,
+                    output_name: Optional[str] = None,
+                    progress_callback: Optional[ProgressCallback] = None,
+                    job: Optional[M4SJob] = None) -> str:
         """
         一键处理：合并视频、合并音频、混流
         One-click processing: Merge video, merge audio, then mux
@@ -324,25 +756,110 @@ class M4SProcessor:
             video_files: 视频文件路径列表
             audio_files: 音频文件路径列表
             output_dir: 输出目录
+            single_pass: 是否用单次 FFmpeg 调用直接混流（不写中间文件），默认为 True
+                         Mux in a single FFmpeg invocation without intermediate files, default is True
+            stage_bytes: 可选字典，返回时填入各阶段写入的字节数（video / audio / mux）
+                         Optional dict filled with bytes written per stage (video / audio / mux)
+            output_name: 输出文件名，默认自动生成 / Output filename, generated by default
+            progress_callback: 进度回调 (stage, current, total, message)，stage 为 'video'、'audio' 或 'mux'
+                               Progress callback (stage, current, total, message); stage is 'video', 'audio' or 'mux'
+            job: 可选任务句柄，用于取消和清理未完成输出 / Optional job handle for cancel and partial-output cleanup
             
         Returns:
-            最终输出文件路径 / Final output file path
+            最终输出文件路径（MergeResult，.stats 为各阶段计时）
+            Final output file path (a MergeResult; .stats holds stage timings)
         """
+        if stage_bytes is None:
+            stage_bytes = {}
         try:
             if not video_files and not audio_files:
                 raise ValueError("至少需要提供视频文件或音频文件 / At least one video or audio file is required")
 
             output_dir = Path(output_dir)
             output_dir.mkdir(parents=True, exist_ok=True)
+            # 清理崩溃进程留在输出目录中的临时文件和中间文件目录
+            # Clean up temp files and staging directories crashed processes left in the output directory
+            remove_stale_partials(str(output_dir))
 
-            if video_files and not audio_files:
-                return self.merge_video_segments(video_files, str(output_dir))
-            if audio_files and not video_files:
-                return self.merge_audio_segments(audio_files, str(output_dir))
+            # 相同输入（同顺序、同模式、同 FFmpeg 版本）直接复用上次的结果
+            # Identical inputs (same order, mode and FFmpeg version) reuse the previous result
+            if video_files and audio_files:
+                mode, prefix = ("mux" if single_pass else "mux-staged"), "Muxed_Output"
+            elif video_files:
+                mode, prefix = "video", "Merged_Video"
+            else:
+                mode, prefix = "audio", "Merged_Audio"
+            with self.metrics.span("cache_lookup", segments=len(video_files) + len(audio_files)) as span:
+                cache_key = self._result_cache_key([video_files, audio_files], mode)
+                cached = None
+                if cache_key is not None:
+                    cached = self.result_cache.materialize(cache_key, str(output_dir), output_name,
+                                                           self._generate_output_name(prefix))
+                if cached:
+                    span.bytes_written = os.path.getsize(cached)
+            if cached:
+                print(f"[Cache] 复用已有结果 / Reusing cached result: {cached}")
+                # 命中缓存时同样报告输出大小 / Report the output size on a cache hit as well
+                stage_bytes[mode.split("-")[0]] = span.bytes_written
+                return cached
 
-            with tempfile.TemporaryDirectory() as temp_dir:
-                video_input = self._prepare_stream_for_mux(video_files, temp_dir, is_video=True)
-                audio_input = self._prepare_stream_for_mux(audio_files, temp_dir, is_video=False)
-                return self.merge_av(video_input, audio_input, str(output_dir))
+            output = self._process_uncached(video_files, audio_files, output_dir, single_pass, stage_bytes,
+                                            output_name, progress_callback, job)
+            if cache_key is not None:
+                with self.metrics.span("cache_store"):
+                    self.result_cache.store(cache_key, output)
+            return output
+        except (JobCancelledError, SegmentValidationError):
+            raise
         except Exception as e:
             raise RuntimeError(f"一键处理失败 / Processing failed: {str(e)}\n详细信息 / Details: {traceback.format_exc()}")
+
+    def _process_uncached(self, video_files: List[str], audio_files: List[str], output_dir: Path,
+                          single_pass: bool, stage_bytes: Dict[str, int], output_name: Optional[str],
+                          progress_callback: Optional[ProgressCallback], job: Optional[M4SJob]) -> str:
+        """process_all 的实际处理部分（不查缓存） / The actual work of process_all (no cache lookup)"""
+        # 开始前确认空间：流复制的输出约等于输入总大小，分阶段模式还需要存放合并后的中间文件
+        # Check space up front: a stream copy is about the size of its inputs, and the staged
+        # mode also needs room for the merged intermediates
+        video_bytes = sum(os.path.getsize(f) for f in video_files if os.path.exists(f))
+        audio_bytes = sum(os.path.getsize(f) for f in audio_files if os.path.exists(f))
+        temp_bytes = 0
+        if video_files and audio_files and not single_pass:
+            temp_bytes = (video_bytes if len(video_files) > 1 else 0) + (audio_bytes if len(audio_files) > 1 else 0)
+        plan = plan_staging(str(output_dir), video_bytes + audio_bytes, temp_bytes)
+
+        if video_files and not audio_files:
+            output = self.merge_video_segments(video_files, str(output_dir), output_name=output_name,
+                                               progress_callback=progress_callback, job=job)
+            stage_bytes["video"] = os.path.getsize(output)
+            return output
+        if audio_files and not video_files:
+            output = self.merge_audio_segments(audio_files, str(output_dir), output_name=output_name,
+                                               progress_callback=progress_callback, job=job)
+            stage_bytes["audio"] = os.path.getsize(output)
+            return output
+
+        if single_pass:
+            output = self.mux_segments(video_files, audio_files, str(output_dir), output_name=output_name,
+                                       progress_callback=progress_callback, job=job)
+            stage_bytes["mux"] = os.path.getsize(output)
+            return output
+
+        # 中间文件优先放在输出所在的文件系统上 / Intermediates prefer the output's filesystem
+        if plan.temp_root != str(output_dir):
+            remove_stale_partials(plan.temp_root)
+        temp_dir = make_staging_dir(plan.temp_root)
+        try:
+            video_input, audio_input = self._prepare_streams(video_files, audio_files, temp_dir, progress_callback, job)
+            stage_bytes["video"] = os.path.getsize(video_input) if len(video_files) > 1 else 0
+            stage_bytes["audio"] = os.path.getsize(audio_input) if len(audio_files) > 1 else 0
+            if job is not None:
+                job.raise_if_cancelled()
+            output = self.merge_av(video_input, audio_input, str(output_dir), output_name=output_name,
+                                   progress_callback=progress_callback, job=job)
+            stage_bytes["mux"] = os.path.getsize(output)
+            return output
+        finally:
+            with self.metrics.span("cleanup"):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
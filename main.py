@@ -112,4 +112,8 @@ def main():
         show_error("启动错误 / Startup Error", error_msg)
 
 if __name__ == "__main__":
+    # 带参数时走无界面的命令行，不导入 GUI / With arguments, run the headless CLI without importing the GUI
+    if len(sys.argv) > 1:
+        from m4s_cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
     main()
\ No newline at end of file
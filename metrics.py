@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+处理阶段计时与指标导出
+Per-Stage Timing and Metrics Export
+
+M4SProcessor 的每个阶段（生成文件列表、原生拼接、FFmpeg 拼接/混流、发布、清理等）都会
+记录一个 StageSpan：墙钟时间、CPU 时间、读写字节数、片段数和 FFmpeg 退出码。Span 同时
+汇总到该次调用的 JobStats（随 MergeResult.stats 返回），并发送给可插拔的 MetricsSink。
+内置 JsonLinesSink（每个 span 一行 JSON）和 PrometheusSink（node_exporter textfile
+格式的累计计数器）。
+
+Every stage of M4SProcessor (file list, native concat, FFmpeg concat/mux, publish, cleanup...)
+records a StageSpan: wall time, CPU time, bytes read and written, segment count and FFmpeg exit
+code. Spans are collected into the call's JobStats (returned as MergeResult.stats) and sent to a
+pluggable MetricsSink. JsonLinesSink (one JSON line per span) and PrometheusSink (cumulative
+counters in node_exporter textfile format) are built in.
+"""
+
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from m4s_job import JobCancelledError
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_CANCELLED = "cancelled"
+
+
+class StageSpan(NamedTuple):
+    """
+    一个阶段的测量结果 / Measurements for one stage
+
+    cpu_seconds 是执行该阶段的线程自身的 CPU 时间；child_cpu_seconds 是期间结束的子进程
+    （FFmpeg）的 CPU 时间，多个任务并发时只是近似值。
+    cpu_seconds is CPU time of the thread running the stage; child_cpu_seconds is CPU time of
+    child processes (FFmpeg) reaped meanwhile, approximate when jobs run concurrently.
+    """
+    job_id: str
+    stage: str
+    started: float
+    wall_seconds: float
+    cpu_seconds: float
+    child_cpu_seconds: Optional[float]
+    bytes_read: int
+    bytes_written: int
+    segments: int
+    exit_code: Optional[int]
+    status: str
+
+    def to_json(self) -> dict:
+        return self._asdict()
+
+
+class JobStats:
+    """一次处理调用的全部 span / All spans of one processing call"""
+
+    def __init__(self, operation: str, job_id: Optional[str] = None):
+        self.operation = operation
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.wall_seconds = 0.0
+        self.status = STATUS_OK
+        self.spans: List[StageSpan] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: StageSpan):
+        with self._lock:
+            self.spans.append(span)
+
+    def by_stage(self) -> Dict[str, float]:
+        """各阶段墙钟时间合计 / Total wall time per stage"""
+        totals: Dict[str, float] = defaultdict(float)
+        for span in self.spans:
+            totals[span.stage] += span.wall_seconds
+        return dict(totals)
+
+    @property
+    def bytes_read(self) -> int:
+        return sum(span.bytes_read for span in self.spans)
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(span.bytes_written for span in self.spans)
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(span.cpu_seconds + (span.child_cpu_seconds or 0.0) for span in self.spans)
+
+    def to_json(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "operation": self.operation,
+            "started": self.started,
+            "wall_seconds": self.wall_seconds,
+            "status": self.status,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "spans": [span.to_json() for span in self.spans],
+        }
+
+    def format(self) -> str:
+        """人类可读的阶段耗时表 / Human-readable stage timing table"""
+        lines = [f"{self.operation} [{self.job_id}] {self.wall_seconds:.3f}s {self.status}"]
+        for span in self.spans:
+            child = f" +{span.child_cpu_seconds:.3f}s ffmpeg" if span.child_cpu_seconds else ""
+            code = f" exit={span.exit_code}" if span.exit_code is not None else ""
+            lines.append(
+                f"  {span.stage:<14} {span.wall_seconds:8.3f}s cpu {span.cpu_seconds:.3f}s{child} "
+                f"r {span.bytes_read / 1048576:.1f} MB w {span.bytes_written / 1048576:.1f} MB "
+                f"seg {span.segments}{code} {span.status}"
+            )
+        return "\n".join(lines)
+
+
+class MergeResult(str):
+    """
+    输出路径（str 子类，兼容原有返回值），附带 .stats
+    Output path (a str subclass, compatible with the old return value) carrying .stats
+    """
+    stats: Optional[JobStats]
+
+    def __new__(cls, path: str, stats: Optional[JobStats] = None):
+        obj = super().__new__(cls, path)
+        obj.stats = stats
+        return obj
+
+
+class SpanBuilder:
+    """阶段进行中可补充的字段 / Fields a stage can fill in while it runs"""
+
+    def __init__(self, bytes_read: int = 0, bytes_written: int = 0, segments: int = 0):
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.segments = segments
+        self.exit_code: Optional[int] = None
+
+
+# --- 输出端 / Sinks ---
+class MetricsSink:
+    """指标输出端基类，子类覆盖需要的方法 / Base sink; subclasses override what they need"""
+
+    def emit_span(self, span: StageSpan, stats: JobStats):
+        pass
+
+    def emit_job(self, stats: JobStats):
+        pass
+
+    def close(self):
+        pass
+
+
+class MultiSink(MetricsSink):
+    """同时写入多个输出端 / Fan out to several sinks"""
+
+    def __init__(self, sinks: List[MetricsSink]):
+        self.sinks = list(sinks)
+
+    def emit_span(self, span: StageSpan, stats: JobStats):
+        for sink in self.sinks:
+            sink.emit_span(span, stats)
+
+    def emit_job(self, stats: JobStats):
+        for sink in self.sinks:
+            sink.emit_job(stats)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class JsonLinesSink(MetricsSink):
+    """
+    追加写入 JSON Lines：每个 span 一行（type=span），任务结束一行（type=job）
+    Append JSON Lines: one line per span (type=span) and one per finished job (type=job)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            print(f"[Metrics] 无法写入指标文件 / Could not write metrics file: {e}")
+
+    def emit_span(self, span: StageSpan, stats: JobStats):
+        self._write(dict(span.to_json(), type="span", operation=stats.operation))
+
+    def emit_job(self, stats: JobStats):
+        record = stats.to_json()
+        del record["spans"]
+        record["stages"] = stats.by_stage()
+        self._write(dict(record, type="job"))
+
+
+# 阶段耗时直方图的桶上界（秒） / Bucket upper bounds for the stage duration histogram (seconds)
+DURATION_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0, 3600.0)
+
+
+class PrometheusSink(MetricsSink):
+    """
+    以 Prometheus 文本格式维护累计计数器，每个任务结束后原子地重写文件
+    （可由 node_exporter 的 textfile collector 采集）
+    Keep cumulative counters in Prometheus text format and atomically rewrite the file after
+    every job (suitable for node_exporter's textfile collector)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stage: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._buckets: Dict[str, List[int]] = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self._runs: Dict[tuple, int] = defaultdict(int)
+        self._exit_codes: Dict[str, int] = defaultdict(int)
+        self._jobs: Dict[tuple, int] = defaultdict(int)
+        self._job_seconds: Dict[str, float] = defaultdict(float)
+
+    def emit_span(self, span: StageSpan, stats: JobStats):
+        with self._lock:
+            totals = self._stage[span.stage]
+            totals["seconds"] += span.wall_seconds
+            totals["cpu"] += span.cpu_seconds
+            totals["child_cpu"] += span.child_cpu_seconds or 0.0
+            totals["read"] += span.bytes_read
+            totals["written"] += span.bytes_written
+            totals["segments"] += span.segments
+            totals["count"] += 1
+            buckets = self._buckets[span.stage]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.wall_seconds <= bound:
+                    buckets[i] += 1
+            self._runs[(span.stage, span.status)] += 1
+            if span.exit_code is not None:
+                self._exit_codes[str(span.exit_code)] += 1
+
+    def emit_job(self, stats: JobStats):
+        with self._lock:
+            self._jobs[(stats.operation, stats.status)] += 1
+            self._job_seconds[stats.operation] += stats.wall_seconds
+        self.flush()
+
+    def render(self) -> str:
+        out: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                out.append(f"{name}{{{label_text}}} {_number(value)}" if label_text else f"{name} {_number(value)}")
+
+        with self._lock:
+            stages = sorted(self._stage.items())
+            for suffix, field, help_text in (
+                ("seconds_total", "seconds", "Wall-clock seconds spent per stage"),
+                ("cpu_seconds_total", "cpu", "CPU seconds of the processing thread per stage"),
+                ("child_cpu_seconds_total", "child_cpu", "CPU seconds of FFmpeg child processes per stage"),
+                ("bytes_read_total", "read", "Bytes read per stage"),
+                ("bytes_written_total", "written", "Bytes written per stage"),
+                ("segments_total", "segments", "Input segments handled per stage"),
+            ):
+                metric(f"m4s_stage_{suffix}", "counter", help_text,
+                       [((("stage", stage),), totals[field]) for stage, totals in stages])
+
+            out.append("# HELP m4s_stage_duration_seconds Stage wall-clock duration")
+            out.append("# TYPE m4s_stage_duration_seconds histogram")
+            for stage, totals in stages:
+                for bound, count in zip(DURATION_BUCKETS, self._buckets[stage]):
+                    out.append(f'm4s_stage_duration_seconds_bucket{{stage="{_escape(stage)}",le="{bound:g}"}} {count}')
+                out.append(f'm4s_stage_duration_seconds_bucket{{stage="{_escape(stage)}",le="+Inf"}} {_number(totals["count"])}')
+                out.append(f'm4s_stage_duration_seconds_sum{{stage="{_escape(stage)}"}} {_number(totals["seconds"])}')
+                out.append(f'm4s_stage_duration_seconds_count{{stage="{_escape(stage)}"}} {_number(totals["count"])}')
+
+            metric("m4s_stage_runs_total", "counter", "Stage runs by outcome",
+                   [((("stage", stage), ("status", status)), n) for (stage, status), n in sorted(self._runs.items())])
+            metric("m4s_ffmpeg_exit_total", "counter", "FFmpeg exits by exit code",
+                   [((("code", code),), n) for code, n in sorted(self._exit_codes.items())])
+            metric("m4s_jobs_total", "counter", "Processing calls by operation and outcome",
+                   [((("operation", op), ("status", status)), n) for (op, status), n in sorted(self._jobs.items())])
+            metric("m4s_job_seconds_total", "counter", "Wall-clock seconds per operation",
+                   [((("operation", op),), s) for op, s in sorted(self._job_seconds.items())])
+        return "\n".join(out) + "\n"
+
+    def flush(self):
+        text = self.render()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".m4s_metrics_", suffix=".tmp", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[Metrics] 无法写入指标文件 / Could not write metrics file: {e}")
+
+    def close(self):
+        self.flush()
+
+
+def _number(value: float) -> str:
+    """整数值按整数输出，保证字节计数精确 / Integral values print as integers so byte counts stay exact"""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _child_cpu() -> Optional[float]:
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _status_of(error: Optional[BaseException]) -> str:
+    if error is None:
+        return STATUS_OK
+    if isinstance(error, (JobCancelledError, KeyboardInterrupt)):
+        return STATUS_CANCELLED
+    return STATUS_ERROR
+
+
+class MetricsRecorder:
+    """
+    记录 span 并归入当前线程（或 asyncio 任务）的 JobStats；嵌套调用（如 process_all 内部的
+    merge_video_segments）共用最外层的 JobStats
+    Records spans into the current thread's (or asyncio task's) JobStats; nested calls
+    (e.g. merge_video_segments inside process_all) share the outermost JobStats
+    """
+
+    def __init__(self, sink: Optional[MetricsSink] = None):
+        self.sink = sink
+        # 上下文变量：每个线程和每个 asyncio 任务各自独立 / Context variable: separate per thread and per asyncio task
+        self._current: contextvars.ContextVar = contextvars.ContextVar(f"m4s_job_stats_{id(self)}", default=None)
+
+    @property
+    def current(self) -> Optional[JobStats]:
+        return self._current.get()
+
+    @contextmanager
+    def job(self, operation: str, stats: Optional[JobStats] = None) -> Iterator[JobStats]:
+        """
+        开始（或加入）一次处理调用；传入 stats 时在当前线程/任务中继续记录到它
+        Start (or join) a processing call; passing stats continues recording into it on this thread/task
+        """
+        outer = self.current
+        if outer is not None and stats is None:
+            yield outer
+            return
+        # 传入的 stats 由创建者负责结束 / A passed-in stats is finished by whoever created it
+        owner = stats is None
+        stats = stats or JobStats(operation)
+        token = self._current.set(stats)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield stats
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._current.reset(token)
+            if owner:
+                stats.wall_seconds = time.perf_counter() - start
+                stats.status = _status_of(error)
+                if self.sink is not None:
+                    self.sink.emit_job(stats)
+
+    @contextmanager
+    def span(self, stage: str, bytes_read: int = 0, segments: int = 0) -> Iterator[SpanBuilder]:
+        """测量一个阶段 / Measure one stage"""
+        builder = SpanBuilder(bytes_read=bytes_read, segments=segments)
+        started = time.time()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        child = _child_cpu()
+        error = None
+        try:
+            yield builder
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            child_end = _child_cpu()
+            self.record(
+                stage, started, time.perf_counter() - wall, time.thread_time() - cpu,
+                child_cpu_seconds=(child_end - child) if child is not None else None,
+                bytes_read=builder.bytes_read, bytes_written=builder.bytes_written,
+                segments=builder.segments, exit_code=builder.exit_code, status=_status_of(error),
+            )
+
+    def record(self, stage: str, started: float, wall_seconds: float, cpu_seconds: float = 0.0,
+               child_cpu_seconds: Optional[float] = None, bytes_read: int = 0, bytes_written: int = 0,
+               segments: int = 0, exit_code: Optional[int] = None, status: str = STATUS_OK) -> StageSpan:
+        """记录一个已测量好的阶段（如 FFmpeg 启动耗时） / Record an already measured stage (e.g. FFmpeg spawn time)"""
+        stats = self.current
+        span = StageSpan(stats.job_id if stats is not None else "", stage, started, wall_seconds, cpu_seconds,
+                         child_cpu_seconds, bytes_read, bytes_written, segments, exit_code, status)
+        if stats is not None:
+            stats.add(span)
+        if self.sink is not None:
+            self.sink.emit_span(span, stats or JobStats(stage, job_id=""))
+        return span
+
+
+def total_size(paths) -> int:
+    """已存在文件的总大小 / Total size of the files that exist"""
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ISO-BMFF (MP4) 盒结构解析工具
+ISO-BMFF (MP4) Box Parsing Utilities
+
+只读取盒头和少量元数据（moov / moof），不触碰媒体数据。
+Only box headers and small metadata boxes (moov / moof) are read; media data is never touched.
+"""
+
+import struct
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional
+
+
+# 可以包含子盒的容器类型 / Box types that contain child boxes
+CONTAINER_BOXES = {
+    b"moov", b"trak", b"mdia", b"minf", b"stbl", b"mvex",
+    b"moof", b"traf", b"edts", b"dinf", b"mfra",
+}
+
+# tfhd 标志位 / tfhd flags
+TFHD_BASE_DATA_OFFSET = 0x000001
+TFHD_SAMPLE_DESCRIPTION_INDEX = 0x000002
+TFHD_DEFAULT_SAMPLE_DURATION = 0x000008
+TFHD_DEFAULT_SAMPLE_SIZE = 0x000010
+TFHD_DEFAULT_SAMPLE_FLAGS = 0x000020
+
+# trun 标志位 / trun flags
+TRUN_DATA_OFFSET = 0x000001
+TRUN_FIRST_SAMPLE_FLAGS = 0x000004
+TRUN_SAMPLE_DURATION = 0x000100
+TRUN_SAMPLE_SIZE = 0x000200
+TRUN_SAMPLE_FLAGS = 0x000400
+TRUN_SAMPLE_CTO = 0x000800
+
+
+class BoxError(ValueError):
+    """盒结构损坏或被截断 / Box structure is corrupt or truncated"""
+
+
+class BoxHeader(NamedTuple):
+    """顶层或子盒的头信息 / Header of a top-level or child box"""
+    type: bytes
+    offset: int
+    size: int
+    header_size: int
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+class TrackInfo(NamedTuple):
+    """moov 中单条轨道的关键信息 / Key facts about one track inside moov"""
+    track_id: int
+    timescale: int
+    duration: int
+    handler: str
+    codec: str
+    default_sample_duration: int
+    stsd: bytes
+
+
+class MovieInfo(NamedTuple):
+    """moov 解析结果 / Parsed moov summary"""
+    timescale: int
+    duration: int
+    fragmented: bool
+    tracks: Dict[int, TrackInfo]
+    mehd_offset: Optional[int]
+    mehd_version: int
+
+
+class TrafInfo(NamedTuple):
+    """
+    单个 traf 的解析结果；*_pos 为相对 moof 起点的字段偏移，便于原地改写
+    Parsed traf; *_pos are field offsets relative to the moof start, for in-place rewriting
+    """
+    track_id: int
+    track_id_pos: int
+    base_data_offset: Optional[int]
+    base_data_offset_pos: Optional[int]
+    decode_time: Optional[int]
+    decode_time_pos: Optional[int]
+    decode_time_version: int
+    sample_count: int
+    duration: Optional[int]
+    data_size: Optional[int]
+
+
+class SidxInfo(NamedTuple):
+    """sidx 段索引摘要 / Segment index (sidx) summary"""
+    timescale: int
+    earliest_presentation_time: int
+    reference_count: int
+    duration: int
+
+
+class FragmentInfo(NamedTuple):
+    """moof 解析结果 / Parsed moof summary"""
+    sequence_number: int
+    sequence_number_pos: int
+    trafs: List[TrafInfo]
+
+
+def read_box_header(f: BinaryIO, offset: int, limit: int) -> Optional[BoxHeader]:
+    """
+    读取 offset 处的盒头；到达 limit 时返回 None
+    Read the box header at offset; return None when limit is reached
+    """
+    if offset >= limit:
+        return None
+    if limit - offset < 8:
+        raise BoxError(f"盒头被截断 / Truncated box header at offset {offset}")
+    f.seek(offset)
+    head = f.read(8)
+    if len(head) < 8:
+        raise BoxError(f"盒头被截断 / Truncated box header at offset {offset}")
+    size, box_type = struct.unpack(">I4s", head)
+    header_size = 8
+    if size == 1:
+        large = f.read(8)
+        if len(large) < 8:
+            raise BoxError(f"盒头被截断 / Truncated box header at offset {offset}")
+        size = struct.unpack(">Q", large)[0]
+        header_size = 16
+    elif size == 0:
+        # 盒一直延伸到文件末尾 / Box extends to the end of the file
+        size = limit - offset
+    if size < header_size:
+        raise BoxError(f"非法盒大小 / Invalid box size {size} for '{_fourcc(box_type)}' at offset {offset}")
+    return BoxHeader(box_type, offset, size, header_size)
+
+
+def iter_boxes(f: BinaryIO, start: int = 0, end: Optional[int] = None, strict: bool = True) -> Iterator[BoxHeader]:
+    """
+    顺序遍历 [start, end) 范围内的盒，只通过 seek 跳过负载
+    Walk the boxes in [start, end), skipping payloads by seeking
+
+    strict 为 True 时，超出 end 的盒会抛出 BoxError。
+    With strict=True a box that runs past end raises BoxError.
+    """
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
+    offset = start
+    while True:
+        header = read_box_header(f, offset, end)
+        if header is None:
+            return
+        if header.end > end and strict:
+            raise BoxError(
+                f"盒被截断 / Truncated '{_fourcc(header.type)}' box at offset {header.offset}: "
+                f"declares {header.size} bytes, only {end - header.offset} available"
+            )
+        yield header
+        offset = header.end
+
+
+def iter_child_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[BoxHeader]:
+    """
+    遍历内存缓冲区中的子盒 / Walk child boxes inside an in-memory buffer
+    """
+    if end is None:
+        end = len(data)
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise BoxError(f"子盒头被截断 / Truncated child box header at {offset}")
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise BoxError(f"子盒大小非法 / Invalid child box '{_fourcc(box_type)}' at {offset}")
+        yield BoxHeader(box_type, offset, size, header_size)
+        offset += size
+
+
+def find_child(data: bytes, box_type: bytes, start: int = 0, end: Optional[int] = None) -> Optional[BoxHeader]:
+    """返回第一个匹配类型的子盒 / Return the first child box of the given type"""
+    for child in iter_child_boxes(data, start, end):
+        if child.type == box_type:
+            return child
+    return None
+
+
+def find_path(data: bytes, path: List[bytes], start: int = 0, end: Optional[int] = None) -> Optional[BoxHeader]:
+    """按路径查找嵌套子盒 / Find a nested child box by path"""
+    box = None
+    for box_type in path:
+        box = find_child(data, box_type, start, end)
+        if box is None:
+            return None
+        start, end = box.payload_offset, box.end
+    return box
+
+
+def read_box(f: BinaryIO, header: BoxHeader, max_size: int = 64 * 1024 * 1024) -> bytes:
+    """把整个（元数据）盒读入内存 / Read a whole (metadata) box into memory"""
+    if header.size > max_size:
+        raise BoxError(
+            f"'{_fourcc(header.type)}' 盒过大 / '{_fourcc(header.type)}' box too large: {header.size} bytes"
+        )
+    f.seek(header.offset)
+    data = f.read(header.size)
+    if len(data) < header.size:
+        raise BoxError(f"盒被截断 / Truncated '{_fourcc(header.type)}' box at offset {header.offset}")
+    return data
+
+
+def parse_moov(data: bytes) -> MovieInfo:
+    """
+    解析 moov 盒（data 从 moov 盒头开始）
+    Parse a moov box (data starts at the moov header)
+    """
+    moov = next(iter_child_boxes(data, 0, len(data)))
+    if moov.type != b"moov":
+        raise BoxError("不是 moov 盒 / Not a moov box")
+    timescale, duration = 0, 0
+    tracks: Dict[int, TrackInfo] = {}
+    trex_defaults: Dict[int, int] = {}
+    fragmented = False
+    mehd_offset, mehd_version = None, 0
+
+    for child in iter_child_boxes(data, moov.payload_offset, moov.end):
+        if child.type == b"mvhd":
+            timescale, duration = _parse_time_header(data, child.payload_offset)
+        elif child.type == b"trak":
+            track = _parse_trak(data, child)
+            if track is not None:
+                tracks[track.track_id] = track
+        elif child.type == b"mvex":
+            fragmented = True
+            for sub in iter_child_boxes(data, child.payload_offset, child.end):
+                if sub.type == b"trex":
+                    track_id, default_duration = struct.unpack_from(">I4xI", data, sub.payload_offset + 4)
+                    trex_defaults[track_id] = default_duration
+                elif sub.type == b"mehd":
+                    mehd_version = data[sub.payload_offset]
+                    mehd_offset = sub.payload_offset + 4
+
+    for track_id, default_duration in trex_defaults.items():
+        if track_id in tracks:
+            tracks[track_id] = tracks[track_id]._replace(default_sample_duration=default_duration)
+    return MovieInfo(timescale, duration, fragmented, tracks, mehd_offset, mehd_version)
+
+
+def parse_moof(data: bytes, trex_durations: Optional[Dict[int, int]] = None) -> FragmentInfo:
+    """
+    解析 moof 盒（data 从 moof 盒头开始），计算每个 traf 的时长和数据量
+    Parse a moof box (data starts at the moof header), computing each traf's duration and data size
+    """
+    moof = next(iter_child_boxes(data, 0, len(data)))
+    if moof.type != b"moof":
+        raise BoxError("不是 moof 盒 / Not a moof box")
+    trex_durations = trex_durations or {}
+    sequence_number, sequence_number_pos = 0, -1
+    trafs: List[TrafInfo] = []
+    for child in iter_child_boxes(data, moof.payload_offset, moof.end):
+        if child.type == b"mfhd":
+            sequence_number_pos = child.payload_offset + 4
+            sequence_number = struct.unpack_from(">I", data, sequence_number_pos)[0]
+        elif child.type == b"traf":
+            trafs.append(_parse_traf(data, child, trex_durations))
+    if sequence_number_pos < 0:
+        raise BoxError("moof 缺少 mfhd / moof has no mfhd")
+    return FragmentInfo(sequence_number, sequence_number_pos, trafs)
+
+
+def parse_sidx(data: bytes) -> SidxInfo:
+    """
+    解析 sidx 盒（data 从 sidx 盒头开始），累加各子段时长
+    Parse a sidx box (data starts at the sidx header), summing the subsegment durations
+    """
+    sidx = next(iter_child_boxes(data, 0, len(data)))
+    if sidx.type != b"sidx":
+        raise BoxError("不是 sidx 盒 / Not a sidx box")
+    pos = sidx.payload_offset
+    version = data[pos]
+    timescale = struct.unpack_from(">I", data, pos + 8)[0]
+    if version == 1:
+        earliest = struct.unpack_from(">Q", data, pos + 12)[0]
+        pos += 28
+    else:
+        earliest = struct.unpack_from(">I", data, pos + 12)[0]
+        pos += 20
+    reference_count = struct.unpack_from(">2xH", data, pos)[0]
+    pos += 4
+    if pos + reference_count * 12 > sidx.end:
+        raise BoxError("sidx 被截断 / Truncated sidx")
+    duration = sum(struct.unpack_from(">4xI4x", data, pos + i * 12)[0] for i in range(reference_count))
+    return SidxInfo(timescale, earliest, reference_count, duration)
+
+
+def _parse_time_header(data: bytes, pos: int):
+    """解析 mvhd/mdhd 的 timescale 与 duration / Parse timescale and duration of mvhd/mdhd"""
+    if data[pos] == 1:
+        return struct.unpack_from(">IQ", data, pos + 20)
+    return struct.unpack_from(">II", data, pos + 12)
+
+
+def _parse_trak(data: bytes, trak: BoxHeader) -> Optional[TrackInfo]:
+    tkhd = find_child(data, b"tkhd", trak.payload_offset, trak.end)
+    mdia = find_child(data, b"mdia", trak.payload_offset, trak.end)
+    if tkhd is None or mdia is None:
+        return None
+    version = data[tkhd.payload_offset]
+    track_id_pos = tkhd.payload_offset + (20 if version == 1 else 12)
+    track_id = struct.unpack_from(">I", data, track_id_pos)[0]
+
+    timescale, duration, handler, codec, stsd_bytes = 0, 0, "", "", b""
+    for child in iter_child_boxes(data, mdia.payload_offset, mdia.end):
+        if child.type == b"mdhd":
+            timescale, duration = _parse_time_header(data, child.payload_offset)
+        elif child.type == b"hdlr":
+            handler = data[child.payload_offset + 8:child.payload_offset + 12].decode("latin-1")
+    stsd = find_path(data, [b"minf", b"stbl", b"stsd"], mdia.payload_offset, mdia.end)
+    if stsd is not None:
+        stsd_bytes = bytes(data[stsd.offset:stsd.end])
+        first_entry = stsd.payload_offset + 8
+        if first_entry + 8 <= stsd.end:
+            codec = data[first_entry + 4:first_entry + 8].decode("latin-1")
+    return TrackInfo(track_id, timescale, duration, handler, codec, 0, stsd_bytes)
+
+
+def _parse_traf(data: bytes, traf: BoxHeader, trex_durations: Dict[int, int]) -> TrafInfo:
+    tfhd = find_child(data, b"tfhd", traf.payload_offset, traf.end)
+    if tfhd is None:
+        raise BoxError("traf 缺少 tfhd / traf has no tfhd")
+    flags = struct.unpack_from(">I", data, tfhd.payload_offset)[0] & 0xFFFFFF
+    track_id_pos = tfhd.payload_offset + 4
+    track_id = struct.unpack_from(">I", data, track_id_pos)[0]
+    pos = track_id_pos + 4
+    base_data_offset, base_data_offset_pos = None, None
+    if flags & TFHD_BASE_DATA_OFFSET:
+        base_data_offset_pos = pos
+        base_data_offset = struct.unpack_from(">Q", data, pos)[0]
+        pos += 8
+    if flags & TFHD_SAMPLE_DESCRIPTION_INDEX:
+        pos += 4
+    default_duration = trex_durations.get(track_id, 0)
+    if flags & TFHD_DEFAULT_SAMPLE_DURATION:
+        default_duration = struct.unpack_from(">I", data, pos)[0]
+        pos += 4
+    default_size = None
+    if flags & TFHD_DEFAULT_SAMPLE_SIZE:
+        default_size = struct.unpack_from(">I", data, pos)[0]
+
+    decode_time, decode_time_pos, decode_time_version = None, None, 0
+    sample_count = 0
+    duration: Optional[int] = 0
+    data_size: Optional[int] = 0
+    for child in iter_child_boxes(data, traf.payload_offset, traf.end):
+        if child.type == b"tfdt":
+            decode_time_version = data[child.payload_offset]
+            decode_time_pos = child.payload_offset + 4
+            fmt = ">Q" if decode_time_version == 1 else ">I"
+            decode_time = struct.unpack_from(fmt, data, decode_time_pos)[0]
+        elif child.type == b"trun":
+            count, run_duration, run_size = _parse_trun(data, child, default_duration, default_size)
+            sample_count += count
+            duration = None if duration is None or run_duration is None else duration + run_duration
+            data_size = None if data_size is None or run_size is None else data_size + run_size
+    return TrafInfo(
+        track_id, track_id_pos, base_data_offset, base_data_offset_pos,
+        decode_time, decode_time_pos, decode_time_version, sample_count, duration, data_size,
+    )
+
+
+def _parse_trun(data: bytes, trun: BoxHeader, default_duration: int, default_size: Optional[int]):
+    """返回 (样本数, 总时长, 总字节数)；无法确定时为 None / Return (count, duration, bytes); None when unknown"""
+    pos = trun.payload_offset
+    flags = struct.unpack_from(">I", data, pos)[0] & 0xFFFFFF
+    count = struct.unpack_from(">I", data, pos + 4)[0]
+    pos += 8
+    if flags & TRUN_DATA_OFFSET:
+        pos += 4
+    if flags & TRUN_FIRST_SAMPLE_FLAGS:
+        pos += 4
+    has_duration = bool(flags & TRUN_SAMPLE_DURATION)
+    has_size = bool(flags & TRUN_SAMPLE_SIZE)
+    if not has_duration and not has_size:
+        total_duration = count * default_duration if default_duration else None
+        total_size = count * default_size if default_size is not None else None
+        return count, total_duration, total_size
+
+    fields = [flag for flag in (TRUN_SAMPLE_DURATION, TRUN_SAMPLE_SIZE, TRUN_SAMPLE_FLAGS, TRUN_SAMPLE_CTO) if flags & flag]
+    stride = 4 * len(fields)
+    if pos + stride * count > trun.end:
+        raise BoxError("trun 样本表被截断 / Truncated trun sample table")
+    values = struct.unpack_from(f">{len(fields) * count}I", data, pos) if count else ()
+    width = len(fields)
+    if has_duration:
+        total_duration = sum(values[fields.index(TRUN_SAMPLE_DURATION)::width])
+    else:
+        total_duration = count * default_duration if default_duration else None
+    if has_size:
+        total_size = sum(values[fields.index(TRUN_SAMPLE_SIZE)::width])
+    else:
+        total_size = count * default_size if default_size is not None else None
+    return count, total_duration, total_size
+
+
+def _fourcc(box_type: bytes) -> str:
+    return box_type.decode("latin-1", errors="replace")
+
+
+def media_duration(path: str) -> Optional[float]:
+    """
+    只根据盒头估算文件时长（秒）：优先 mehd / mvhd，否则累加各 moof 的分片时长
+    Estimate a file's duration in seconds from headers only: mehd / mvhd first,
+    otherwise the sum of fragment durations across moof boxes
+
+    无法确定时返回 None。/ Returns None when it cannot be determined.
+    """
+    try:
+        with open(path, "rb") as f:
+            movie = None
+            mehd_duration = 0
+            totals: Dict[int, int] = {}
+            for header in iter_boxes(f, strict=False):
+                if header.type == b"moov" and movie is None:
+                    moov = read_box(f, header)
+                    movie = parse_moov(moov)
+                    if movie.mehd_offset is not None:
+                        fmt = ">Q" if movie.mehd_version == 1 else ">I"
+                        mehd_duration = struct.unpack_from(fmt, moov, movie.mehd_offset)[0]
+                    if mehd_duration and movie.timescale:
+                        return mehd_duration / movie.timescale
+                    if not movie.fragmented and movie.duration and movie.timescale:
+                        return movie.duration / movie.timescale
+                elif header.type == b"moof" and movie is not None:
+                    defaults = {tid: t.default_sample_duration for tid, t in movie.tracks.items()}
+                    for traf in parse_moof(read_box(f, header), defaults).trafs:
+                        if traf.duration is None:
+                            return None
+                        totals[traf.track_id] = totals.get(traf.track_id, 0) + traf.duration
+    except (OSError, BoxError, struct.error):
+        return None
+    if movie is None or not totals:
+        return None
+    seconds = [totals[tid] / t.timescale for tid, t in movie.tracks.items() if tid in totals and t.timescale]
+    return max(seconds) if seconds else None
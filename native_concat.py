@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+原生 fMP4 分片拼接引擎（不经过 FFmpeg）
+Native fragmented-MP4 segment concatenation engine (bypasses FFmpeg)
+
+.m4s 文件本身就是 fMP4：ftyp + moov（初始化信息）后跟若干 moof/mdat 分片。
+拼接时只需保留第一份初始化信息，改写每个 moof 中的序号与 tfdt 解码时间，
+再用内核拷贝原语把 mdat 原样搬到输出文件即可，无需逐包解复用。
+
+.m4s files are already fMP4: ftyp + moov (init data) followed by moof/mdat fragments.
+Joining them only needs the first init data, rewritten sequence numbers and tfdt decode
+times in each moof, and a kernel-level copy of every mdat - no per-packet demuxing.
+"""
+
+import os
+import struct
+import sys
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Dict, List, NamedTuple, Optional
+
+from mp4_boxes import BoxError, MovieInfo, iter_boxes, parse_moof, parse_moov, read_box
+
+
+# 拼接时忽略的顶层盒 / Top-level boxes dropped while joining
+SKIPPED_BOXES = {b"styp", b"sidx", b"ssix", b"free", b"skip", b"mfra", b"prft", b"emsg", b"uuid", b"udta", b"meta"}
+
+# 内核拷贝不可用时的缓冲区大小 / Buffer size when kernel copy is unavailable
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 写出时同时保持打开的源文件数（交错输出时来回切换） / Source files kept open while writing (interleaved output switches back and forth)
+MAX_OPEN_SOURCES = 4
+
+# 单次 sendfile / copy_file_range 的最大字节数 / Max bytes per sendfile / copy_file_range call
+_KERNEL_CHUNK_SIZE = 1 << 30
+
+
+class NativeConcatError(RuntimeError):
+    """输入不适合原生拼接，应回退到 FFmpeg / Input unsuitable for native joining; fall back to FFmpeg"""
+
+
+class Fragment(NamedTuple):
+    """
+    一个待输出的 moof/mdat 分片（moof 已按输出时间线改写）
+    One moof/mdat fragment ready for output (moof already rewritten for the output timeline)
+    """
+    source: str
+    moof: bytearray
+    moof_offset: int
+    mdat_offset: int
+    mdat_size: int
+    decode_times: Dict[int, int]
+
+
+class SegmentScan(NamedTuple):
+    """一组片段的扫描结果 / Scan result for a list of segments"""
+    init: bytes
+    movie: MovieInfo
+    mehd_pos: Optional[int]
+    fragments: List[Fragment]
+    end_times: Dict[int, int]
+    total_bytes: int
+
+
+_use_copy_file_range = hasattr(os, "copy_file_range")
+_use_sendfile = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    """
+    把 src_fd 的 [offset, offset+count) 追加到 dst_fd 当前位置，优先使用内核零拷贝
+    Append src_fd[offset:offset+count] at dst_fd's position, preferring zero-copy kernel primitives
+    """
+    global _use_copy_file_range, _use_sendfile
+    copied = 0
+    while copied < count and _use_copy_file_range:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, min(count - copied, _KERNEL_CHUNK_SIZE), offset + copied)
+        except OSError:
+            _use_copy_file_range = False
+            break
+        if n == 0:
+            break
+        copied += n
+    while copied < count and _use_sendfile:
+        try:
+            n = os.sendfile(dst_fd, src_fd, offset + copied, min(count - copied, _KERNEL_CHUNK_SIZE))
+        except OSError:
+            _use_sendfile = False
+            break
+        if n == 0:
+            break
+        copied += n
+    if copied < count:
+        copied += _buffered_copy(src_fd, dst_fd, offset + copied, count - copied)
+    if copied != count:
+        raise OSError(f"源文件提前结束 / Source ended early: copied {copied} of {count} bytes")
+    return copied
+
+
+def _buffered_copy(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    """普通的读写拷贝（Windows 等平台） / Plain read/write copy (Windows and other platforms)"""
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    copied = 0
+    while copied < count:
+        chunk = os.read(src_fd, min(COPY_CHUNK_SIZE, count - copied))
+        if not chunk:
+            break
+        _write_all(dst_fd, chunk)
+        copied += len(chunk)
+    return copied
+
+
+class NativeConcatenator:
+    """原生 fMP4 拼接器 / Native fMP4 concatenator"""
+
+    def scan(self, files: List[str], rebase: bool = True) -> SegmentScan:
+        """
+        扫描所有片段的盒结构并计算输出时间线（只读取元数据）
+        Scan every segment's box structure and build the output timeline (metadata only)
+
+        rebase 为 False 时保留第一个文件的原始解码时间（混流时保持音画同步），否则时间线从 0 开始。
+        With rebase=False the first file keeps its original decode times (keeps A/V sync when muxing);
+        otherwise the timeline starts at 0.
+        """
+        if not files:
+            raise ValueError("片段列表为空 / Segment list is empty")
+        init = None
+        movie = None
+        trex_durations: Dict[int, int] = {}
+        mehd_pos = None
+        fragments: List[Fragment] = []
+        next_times: Dict[int, int] = {}
+        output_offset = 0
+        sequence = 0
+
+        for index, path in enumerate(files):
+            with open(path, "rb", buffering=0) as f:
+                file_movie = None
+                file_bases: Dict[int, int] = {}
+                rebase_file = rebase or index > 0
+                file_starts = dict(next_times)
+                pending_moof = None
+                try:
+                    for header in iter_boxes(f):
+                        if pending_moof is not None and header.type != b"mdat":
+                            # trun 的 data_offset 默认从 moof 起算，丢弃 moof 与 mdat 之间的盒会让样本偏移错位
+                            # trun data_offset is relative to the moof by default; dropping a box between moof
+                            # and mdat would shift every sample offset
+                            name = header.type.decode("latin-1", "replace")
+                            raise NativeConcatError(f"moof 与 mdat 之间有 '{name}' 盒 / '{name}' box between moof "
+                                                    f"and mdat in {path}")
+                        if header.type == b"ftyp":
+                            if init is None and movie is None:
+                                init = read_box(f, header)
+                        elif header.type == b"moov":
+                            moov = read_box(f, header)
+                            file_movie = parse_moov(moov)
+                            if movie is None:
+                                if not file_movie.fragmented:
+                                    raise NativeConcatError(f"不是分片 MP4 / Not a fragmented MP4: {path}")
+                                if init is None:
+                                    raise NativeConcatError(f"首个片段缺少 ftyp / First segment has no ftyp: {path}")
+                                movie = file_movie
+                                trex_durations = {tid: t.default_sample_duration for tid, t in movie.tracks.items()}
+                                if file_movie.mehd_offset is not None:
+                                    mehd_pos = len(init) + file_movie.mehd_offset
+                                init += moov
+                            else:
+                                self._check_compatible(movie, file_movie, path)
+                        elif header.type == b"moof":
+                            if movie is None:
+                                raise NativeConcatError(f"首个片段缺少 moov / First segment has no moov: {path}")
+                            pending_moof = (header, bytearray(read_box(f, header)))
+                        elif header.type == b"mdat":
+                            if pending_moof is None:
+                                raise NativeConcatError(f"mdat 前缺少 moof（非分片文件） / mdat without moof (not fragmented): {path}")
+                            moof_header, moof = pending_moof
+                            pending_moof = None
+                            sequence += 1
+                            fragment_offset = len(init) + output_offset
+                            decode_times = self._rewrite_moof(
+                                moof, movie, trex_durations, sequence, moof_header.offset, fragment_offset,
+                                file_bases, file_starts, next_times, path, rebase_file,
+                            )
+                            fragments.append(Fragment(path, moof, moof_header.offset, header.offset, header.size, decode_times))
+                            output_offset += len(moof) + header.size
+                        elif header.type in SKIPPED_BOXES:
+                            continue
+                except BoxError as e:
+                    raise NativeConcatError(f"片段结构无法解析 / Cannot parse segment {path}: {e}")
+                if pending_moof is not None:
+                    raise NativeConcatError(f"文件以 moof 结尾 / File ends with a moof: {path}")
+                if movie is None:
+                    raise NativeConcatError(f"首个片段缺少 moov / First segment has no moov: {path}")
+
+        if not fragments:
+            raise NativeConcatError("没有找到任何 moof/mdat 分片 / No moof/mdat fragments found")
+        return SegmentScan(init, movie, mehd_pos, fragments, next_times, len(init) + output_offset)
+
+    def concat(self, files: List[str], output_path: str,
+               progress_callback: Optional[Callable[[int, int], None]] = None) -> int:
+        """
+        把片段拼接成一个 fMP4 文件，返回写入的字节数
+        Join the segments into one fMP4 file and return the number of bytes written
+
+        Raises:
+            NativeConcatError: 输入不适合原生拼接 / input is unsuitable for native joining
+        """
+        scan = self.scan(files)
+        try:
+            with open(output_path, "wb", buffering=0) as out:
+                self.write(scan, out, progress_callback)
+        except BaseException:
+            if os.path.exists(output_path):
+                try:
+                    os.unlink(output_path)
+                except OSError:
+                    pass
+            raise
+        return scan.total_bytes
+
+    def write(self, scan: SegmentScan, out: BinaryIO,
+              progress_callback: Optional[Callable[[int, int], None]] = None) -> None:
+        """把扫描结果写入已打开的输出文件 / Write a scan result into an open output file"""
+        out_fd = out.fileno()
+        init = bytearray(scan.init)
+        if scan.mehd_pos is not None:
+            self._patch_mehd(init, scan)
+        _write_all(out_fd, init)
+        done = len(init)
+
+        sources: "OrderedDict[str, BinaryIO]" = OrderedDict()
+        try:
+            for fragment in scan.fragments:
+                src = sources.get(fragment.source)
+                if src is None:
+                    if len(sources) >= MAX_OPEN_SOURCES:
+                        sources.popitem(last=False)[1].close()
+                    src = sources[fragment.source] = open(fragment.source, "rb", buffering=0)
+                else:
+                    sources.move_to_end(fragment.source)
+                _write_all(out_fd, fragment.moof)
+                copy_range(src.fileno(), out_fd, fragment.mdat_offset, fragment.mdat_size)
+                done += len(fragment.moof) + fragment.mdat_size
+                if progress_callback:
+                    progress_callback(done, scan.total_bytes)
+        finally:
+            for src in sources.values():
+                src.close()
+
+    @staticmethod
+    def _check_compatible(first: MovieInfo, other: MovieInfo, path: str):
+        """后续片段的初始化信息必须与第一个一致 / Later init data must match the first segment"""
+        if set(first.tracks) != set(other.tracks):
+            raise NativeConcatError(f"轨道 ID 不一致 / Track IDs differ in {path}")
+        for track_id, track in first.tracks.items():
+            candidate = other.tracks[track_id]
+            if track.timescale != candidate.timescale:
+                raise NativeConcatError(f"时间基不一致 / Timescale differs for track {track_id} in {path}")
+            if track.stsd != candidate.stsd:
+                raise NativeConcatError(f"编码参数不一致 / Codec configuration differs for track {track_id} in {path}")
+
+    @staticmethod
+    def _rewrite_moof(moof: bytearray, movie: MovieInfo, trex_durations: Dict[int, int],
+                      sequence: int, source_offset: int,
+                      output_offset: int, file_bases: Dict[int, int], file_starts: Dict[int, int],
+                      next_times: Dict[int, int], path: str, rebase: bool = True) -> Dict[int, int]:
+        """
+        原地改写 moof 的序号、tfdt 和绝对数据偏移，返回各轨道新的解码时间
+        Rewrite moof sequence number, tfdt and absolute data offsets in place;
+        return each track's new decode time
+        """
+        try:
+            info = parse_moof(bytes(moof), trex_durations)
+        except BoxError as e:
+            raise NativeConcatError(f"moof 无法解析 / Cannot parse moof in {path}: {e}")
+        struct.pack_into(">I", moof, info.sequence_number_pos, sequence)
+
+        decode_times: Dict[int, int] = {}
+        for traf in info.trafs:
+            if traf.track_id not in movie.tracks:
+                raise NativeConcatError(f"未知轨道 / Unknown track {traf.track_id} in {path}")
+            if traf.duration is None:
+                raise NativeConcatError(f"无法确定分片时长 / Cannot determine fragment duration in {path}")
+            track_id = traf.track_id
+            current = next_times.get(track_id, 0)
+            if traf.decode_time is not None:
+                base = file_bases.setdefault(track_id, traf.decode_time if rebase else 0)
+                current = traf.decode_time - base + file_starts.get(track_id, 0)
+                if current < 0:
+                    raise NativeConcatError(f"tfdt 倒退 / tfdt goes backwards in {path}")
+                if traf.decode_time_version == 0:
+                    if current > 0xFFFFFFFF:
+                        raise NativeConcatError(f"tfdt 溢出 32 位 / tfdt overflows 32 bits in {path}")
+                    struct.pack_into(">I", moof, traf.decode_time_pos, current)
+                else:
+                    struct.pack_into(">Q", moof, traf.decode_time_pos, current)
+            if traf.base_data_offset_pos is not None:
+                struct.pack_into(">Q", moof, traf.base_data_offset_pos,
+                                 traf.base_data_offset - source_offset + output_offset)
+            decode_times[track_id] = current
+            next_times[track_id] = current + traf.duration
+        return decode_times
+
+    @staticmethod
+    def _patch_mehd(init: bytearray, scan: SegmentScan):
+        """用拼接后的总时长更新 mehd / Update mehd with the joined total duration"""
+        movie = scan.movie
+        longest = 0.0
+        for track_id, track in movie.tracks.items():
+            if track.timescale and track_id in scan.end_times:
+                longest = max(longest, scan.end_times[track_id] / track.timescale)
+        duration = int(longest * movie.timescale)
+        if movie.mehd_version == 1:
+            struct.pack_into(">Q", init, scan.mehd_pos, duration)
+        elif duration <= 0xFFFFFFFF:
+            struct.pack_into(">I", init, scan.mehd_pos, duration)
+
+
+def _write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+合并结果缓存（按输入指纹寻址）
+Merge Result Cache (addressed by input fingerprint)
+
+键由有序输入的内容指纹（见 fingerprint.py）、处理模式和 FFmpeg 版本组成。
+命中时直接返回已有的输出，或把缓存文件硬链接到新的输出目录，不再重复拼接和混流。
+缓存文件本身是原输出的硬链接，不额外占用磁盘空间（除非原输出被删除）。
+
+The key combines content fingerprints of the ordered inputs (see fingerprint.py), the
+processing mode and the FFmpeg version. On a hit the existing output is returned as-is,
+or the cached file is hard-linked into the new output directory, skipping the concat and mux entirely.
+Cached files are hard links to the original outputs, so they take no extra space
+unless the original is deleted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from cache_paths import get_cache_dir
+from fingerprint import fingerprint_files
+
+# 缓存键格式版本，键的组成变化时递增 / Key format version; bump when the key recipe changes
+KEY_VERSION = 2
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 30.0
+
+
+class CacheEntry(NamedTuple):
+    """索引中的一条记录 / One index record"""
+    key: str
+    file: str
+    size: int
+    mtime_ns: int
+    created: float
+    last_used: float
+    source: str
+
+
+def make_key(inputs: List[List[str]], mode: str, ffmpeg_version: str, full_hash: bool = False) -> str:
+    """
+    计算缓存键；输入按内容指纹寻址，移动或复制后的相同片段也能命中
+    Compute a cache key; inputs are addressed by content fingerprint, so moved or copied
+    segments still hit
+
+    Args:
+        inputs: 各组有序输入（如 [视频片段, 音频片段]） / Ordered input groups (e.g. [video, audio])
+        mode: 处理模式 / Processing mode
+        ffmpeg_version: FFmpeg 版本字符串 / FFmpeg version string
+        full_hash: 对输入做全量哈希而不是采样 / Hash inputs in full instead of sampling
+    """
+    recipe = {
+        "v": KEY_VERSION,
+        "mode": mode,
+        "ffmpeg": ffmpeg_version,
+        "inputs": [fingerprint_files(group, full=full_hash) for group in inputs],
+    }
+    payload = json.dumps(recipe, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """
+    合并结果缓存，按总大小和时间淘汰
+    Merge result cache with size- and age-based eviction
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        """
+        Args:
+            root: 缓存目录，默认在用户缓存目录下 / Cache directory, defaults under the user cache dir
+            max_bytes: 缓存文件总大小上限 / Upper bound on the total size of cached files
+            max_age_days: 超过该天数的记录被淘汰 / Entries older than this are evicted
+        """
+        self.root = Path(root) if root else get_cache_dir() / "results"
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / "index.json"
+
+    # --- 索引读写 / Index I/O ---
+    def _load(self) -> Dict[str, CacheEntry]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {key: CacheEntry(key=key, **value) for key, value in data.items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[Cache] 忽略损坏的结果索引 / Ignoring corrupt result index: {e}")
+            return {}
+
+    def _save(self, entries: Dict[str, CacheEntry]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        data = {key: {k: v for k, v in entry._asdict().items() if k != "key"} for key, entry in entries.items()}
+        fd, tmp = tempfile.mkstemp(prefix=".index_", suffix=".tmp", dir=str(self.root))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.index_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _valid(self, entry: CacheEntry) -> bool:
+        """缓存文件仍存在且未被改写 / The cached file still exists and was not modified"""
+        try:
+            st = os.stat(self.root / entry.file)
+        except OSError:
+            return False
+        return st.st_size == entry.size and st.st_mtime_ns == entry.mtime_ns
+
+    # --- 公共接口 / Public API ---
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            if not self._valid(entry):
+                self._drop(entries, key)
+                self._save(entries)
+                return None
+            return entry
+
+    def materialize(self, key: str, output_dir: str, output_name: Optional[str],
+                    default_name: str) -> Optional[str]:
+        """
+        命中时返回可用的输出路径，未命中返回 None
+        Return a usable output path on a hit, None on a miss
+
+        未指定文件名且原输出仍在同一目录时直接返回原输出；否则把缓存文件硬链接
+        （跨文件系统时复制）到 output_dir/output_name。
+        Without an explicit name, the original output is returned if it still sits in the same
+        directory; otherwise the cached file is hard-linked (copied across filesystems) to
+        output_dir/output_name.
+        """
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        cached = self.root / entry.file
+        try:
+            if (output_name is None and os.path.exists(entry.source)
+                    and os.path.samefile(os.path.dirname(entry.source), output_dir)
+                    and os.path.samefile(entry.source, cached)):
+                self._touch(key)
+                return entry.source
+
+            target = Path(output_dir) / (output_name or default_name)
+            if target.exists() and os.path.samefile(target, cached):
+                self._touch(key)
+                return str(target)
+            tmp = target.with_name(f".{target.name}.{os.getpid()}.cache")
+            try:
+                try:
+                    os.link(cached, tmp)
+                except OSError:
+                    shutil.copyfile(cached, tmp)
+                os.replace(tmp, target)
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+        except OSError as e:
+            print(f"[Cache] 无法复用缓存结果 / Could not reuse cached result: {e}")
+            return None
+        self._touch(key)
+        return str(target)
+
+    def store(self, key: str, output_path: str):
+        """
+        把新生成的输出硬链接进缓存；不支持硬链接时跳过（不复制大文件）
+        Hard-link a fresh output into the cache; skipped (never copied) when links are unsupported
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        file_name = key + (Path(output_path).suffix or ".mp4")
+        cached = self.root / file_name
+        try:
+            if cached.exists():
+                cached.unlink()
+            os.link(output_path, cached)
+            st = os.stat(cached)
+        except OSError as e:
+            print(f"[Cache] 无法缓存结果（需要同一文件系统） / Could not cache result (needs the same filesystem): {e}")
+            return
+        now = time.time()
+        with self._lock:
+            entries = self._load()
+            entries[key] = CacheEntry(key, file_name, st.st_size, st.st_mtime_ns, now, now,
+                                      os.path.abspath(output_path))
+            self._evict(entries, now)
+            self._save(entries)
+
+    def evict(self):
+        """按时间和总大小淘汰 / Evict by age and total size"""
+        with self._lock:
+            entries = self._load()
+            self._evict(entries, time.time())
+            self._save(entries)
+
+    def _touch(self, key: str):
+        with self._lock:
+            entries = self._load()
+            if key in entries:
+                entries[key] = entries[key]._replace(last_used=time.time())
+                self._save(entries)
+
+    def _evict(self, entries: Dict[str, CacheEntry], now: float):
+        for key in [k for k, e in entries.items() if now - e.created > self.max_age or not self._valid(e)]:
+            self._drop(entries, key)
+        total = sum(e.size for e in entries.values())
+        for entry in sorted(entries.values(), key=lambda e: e.last_used):
+            if total <= self.max_bytes:
+                break
+            total -= entry.size
+            self._drop(entries, entry.key)
+
+    def _drop(self, entries: Dict[str, CacheEntry], key: str):
+        entry = entries.pop(key, None)
+        if entry is None:
+            return
+        try:
+            (self.root / entry.file).unlink()
+        except OSError:
+            pass
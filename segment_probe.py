@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+片段元数据探测与持久化缓存
+Segment Metadata Probing with a Persistent Cache
+
+纯 Python 读取 ftyp / moov / sidx / 第一个 moof，得到时长、编码、轨道 ID、timescale
+和分片数量，不启动 FFmpeg/ffprobe。精确时长优先取自 mehd 或 sidx；两者都没有时才逐个
+解析 moof 累加 trun 时长。结果按 (路径, 大小, 修改时间) 缓存到磁盘，超过容量时按最近
+最少使用 (LRU) 淘汰。
+
+Pure-Python reads of ftyp / moov / sidx / the first moof give duration, codec, track IDs,
+timescale and fragment count without spawning FFmpeg/ffprobe. The exact duration comes from
+mehd or sidx; only when neither is present is every moof parsed to sum trun durations.
+Results are cached on disk, keyed by (path, size, mtime), with least-recently-used eviction.
+"""
+
+import atexit
+import json
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from cache_paths import get_cache_dir
+from mp4_boxes import BoxError, iter_boxes, parse_moof, parse_moov, parse_sidx, read_box
+
+# 缓存文件格式版本，结构变化时递增 / Cache format version; bump when the layout changes
+CACHE_VERSION = 2
+DEFAULT_MAX_ENTRIES = 50000
+# 延迟写回的合并窗口（秒） / Window in which deferred saves coalesce (seconds)
+SAVE_DELAY = 2.0
+
+
+class TrackSummary(NamedTuple):
+    """单条轨道的摘要 / Summary of one track"""
+    track_id: int
+    handler: str
+    codec: str
+    timescale: int
+
+
+class SegmentInfo(NamedTuple):
+    """
+    单个片段文件的元数据；duration 优先取 mehd/sidx，media_duration 是精确时长：来自 mehd/sidx，
+    两者都没有时逐个 moof 累加（有分片缺少时长信息时为 None）
+    Metadata of one segment file; duration prefers mehd/sidx. media_duration is the exact length: taken
+    from mehd/sidx, or summed over every moof when neither exists (None when a fragment lacks duration information)
+    """
+    path: str
+    size: int
+    mtime_ns: int
+    major_brand: str
+    duration: Optional[float]
+    start_time: Optional[float]
+    fragment_count: int
+    tracks: List[TrackSummary]
+    media_duration: Optional[float] = None
+
+    def to_json(self) -> dict:
+        data = self._asdict()
+        data["tracks"] = [list(t) for t in self.tracks]
+        return data
+
+    @classmethod
+    def from_json(cls, data: dict) -> "SegmentInfo":
+        data = dict(data)
+        data["tracks"] = [TrackSummary(*t) for t in data.get("tracks", [])]
+        return cls(**data)
+
+
+def probe_segment(path: str, st: Optional[os.stat_result] = None) -> SegmentInfo:
+    """
+    只读盒头探测单个片段
+    Probe one segment from its headers only
+
+    Raises:
+        OSError: 无法读取 / unreadable
+        BoxError: 不是有效的 MP4 / not a valid MP4
+    """
+    st = st or os.stat(path)
+    major_brand = ""
+    movie, moov = None, b""
+    sidx = None
+    mehd_duration = None
+    first_moof = None
+    fragment_count = 0
+    # 各轨道累计的分片时长（时间基单位），缺少时长时为 None；只在没有 mehd/sidx 时累加
+    # Summed fragment durations per track (timescale units), None once unknown; summed only without mehd/sidx
+    track_totals: Dict[int, Optional[int]] = {}
+    try:
+        with open(path, "rb") as f:
+            for header in iter_boxes(f, strict=False):
+                if header.type == b"ftyp" and not major_brand:
+                    f.seek(header.payload_offset)
+                    major_brand = f.read(4).decode("latin-1")
+                elif header.type == b"moov" and movie is None:
+                    moov = read_box(f, header)
+                    movie = parse_moov(moov)
+                    if movie.mehd_offset is not None and movie.timescale:
+                        fmt = ">Q" if movie.mehd_version == 1 else ">I"
+                        mehd = struct.unpack_from(fmt, moov, movie.mehd_offset)[0]
+                        mehd_duration = mehd / movie.timescale if mehd else None
+                elif header.type == b"sidx" and sidx is None:
+                    sidx = parse_sidx(read_box(f, header))
+                elif header.type == b"moof":
+                    fragment_count += 1
+                    # 已有精确时长时只解析第一个 moof / With an exact duration known, only the first moof is parsed
+                    header_exact = mehd_duration is not None or (sidx is not None and sidx.timescale)
+                    if movie is None or (first_moof is not None and header_exact):
+                        continue
+                    defaults = {tid: t.default_sample_duration for tid, t in movie.tracks.items()}
+                    fragment = parse_moof(read_box(f, header), defaults)
+                    if first_moof is None:
+                        first_moof = fragment
+                    for traf in fragment.trafs:
+                        total = track_totals.get(traf.track_id, 0)
+                        track_totals[traf.track_id] = (None if total is None or traf.duration is None
+                                                       else total + traf.duration)
+    except struct.error as e:
+        raise BoxError(f"盒结构被截断 / Truncated box structure: {e}")
+    if movie is None:
+        raise BoxError(f"缺少 moov 盒 / Missing moov box: {path}")
+
+    duration = mehd_duration
+    if duration is None and sidx is not None and sidx.timescale:
+        duration = sidx.duration / sidx.timescale
+    if duration is None and not movie.fragmented and movie.timescale:
+        duration = movie.duration / movie.timescale
+
+    media_duration = None
+    if movie.fragmented and duration is not None:
+        media_duration = duration
+    elif movie.fragmented:
+        exact = [total / movie.tracks[tid].timescale for tid, total in track_totals.items()
+                 if total is not None and tid in movie.tracks and movie.tracks[tid].timescale]
+        if track_totals and len(exact) == len(track_totals):
+            media_duration = max(exact)
+    elif movie.timescale:
+        media_duration = movie.duration / movie.timescale
+    if duration is None:
+        duration = media_duration
+
+    start_time = None
+    if first_moof is not None:
+        per_fragment = []
+        for traf in first_moof.trafs:
+            track = movie.tracks.get(traf.track_id)
+            if track is None or not track.timescale:
+                continue
+            if traf.decode_time is not None and start_time is None:
+                start_time = traf.decode_time / track.timescale
+            if traf.duration is not None:
+                per_fragment.append(traf.duration / track.timescale)
+        if duration is None and per_fragment:
+            duration = max(per_fragment) * fragment_count
+
+    tracks = [TrackSummary(t.track_id, t.handler, t.codec, t.timescale) for t in movie.tracks.values()]
+    return SegmentInfo(str(path), st.st_size, st.st_mtime_ns, major_brand, duration, start_time,
+                       fragment_count, tracks, media_duration)
+
+
+class ProbeCache:
+    """
+    线程安全的 LRU 探测缓存，保存为一个 JSON 文件
+    Thread-safe LRU probe cache persisted as a single JSON file
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 persistent: bool = True):
+        """
+        Args:
+            path: 缓存文件路径，默认在用户缓存目录下 / Cache file, defaults under the user cache dir
+            max_entries: 最多保留的条目数 / Maximum number of entries kept
+            persistent: False 时只在内存中缓存 / Keep the cache in memory only when False
+        """
+        self.persistent = persistent
+        self.path = Path(path) if path else (get_cache_dir() / "probe_cache.json" if persistent else None)
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, SegmentInfo]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        if persistent:
+            self._load()
+            # 退出时写回尚未保存的变化 / Write back pending changes at exit
+            atexit.register(self.save)
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION:
+                return
+            for entry in data.get("entries", []):
+                info = SegmentInfo.from_json(entry)
+                self._entries[self._key(info.path)] = info
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            # 缓存损坏时直接丢弃 / Discard a corrupt cache
+            print(f"[Probe] 忽略损坏的缓存 / Ignoring corrupt cache {self.path}: {e}")
+            self._entries.clear()
+
+    def get(self, path: str, st: Optional[os.stat_result] = None) -> Optional[SegmentInfo]:
+        """大小与修改时间都匹配时返回缓存项 / Return the entry only if size and mtime still match"""
+        key = self._key(path)
+        with self._lock:
+            info = self._entries.get(key)
+            if info is None:
+                return None
+        st = st or os.stat(path)
+        with self._lock:
+            if info.size != st.st_size or info.mtime_ns != st.st_mtime_ns:
+                self._entries.pop(key, None)
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+            return info
+
+    def put(self, info: SegmentInfo):
+        key = self._key(info.path)
+        with self._lock:
+            self._entries[key] = info
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def save(self):
+        """原子地写回磁盘（仅在有变化时） / Atomically write back to disk (only when changed)"""
+        with self._lock:
+            if not self._dirty or not self.persistent:
+                return
+            payload = {"version": CACHE_VERSION, "entries": [info.to_json() for info in self._entries.values()]}
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".probe_", suffix=".tmp", dir=str(self.path.parent))
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp, self.path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+        except OSError as e:
+            print(f"[Probe] 无法写入缓存 / Could not write cache {self.path}: {e}")
+
+    def save_later(self, delay: float = SAVE_DELAY):
+        """
+        延迟写回：delay 秒内的多次调用只保存一次，避免分批探测时反复重写整个缓存文件
+        Deferred write-back: calls within delay seconds result in a single save, so probing in
+        batches does not rewrite the whole cache file again and again
+        """
+        if not self.persistent:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(delay, self._save_from_timer)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_from_timer(self):
+        with self._lock:
+            self._save_timer = None
+        self.save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_default_cache: Optional[ProbeCache] = None
+_default_lock = threading.Lock()
+
+
+def default_probe_cache() -> ProbeCache:
+    """进程内共享的默认缓存 / Process-wide default cache"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ProbeCache()
+        return _default_cache
+
+
+def probe_segments(paths: List[str], cache: Optional[ProbeCache] = None,
+                   workers: int = 4) -> List[Optional[SegmentInfo]]:
+    """
+    批量探测片段，命中缓存时只需一次 stat；无法解析的文件返回 None
+    Probe many segments; a cache hit costs a single stat. Unparseable files yield None
+
+    Args:
+        paths: 片段路径（结果顺序与之相同） / Segment paths (results keep this order)
+        cache: 探测缓存，默认使用进程共享缓存 / Probe cache, defaults to the shared one
+        workers: 未命中时的并行探测线程数 / Parallel probe threads for cache misses
+    """
+    cache = cache if cache is not None else default_probe_cache()
+    results: List[Optional[SegmentInfo]] = [None] * len(paths)
+    misses = []
+    for index, path in enumerate(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        info = cache.get(path, st)
+        if info is not None:
+            results[index] = info
+        else:
+            misses.append((index, path, st))
+
+    def probe(item):
+        index, path, st = item
+        try:
+            return index, probe_segment(path, st)
+        except (OSError, BoxError):
+            return index, None
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(misses)))) as pool:
+            for index, info in pool.map(probe, misses):
+                results[index] = info
+                if info is not None:
+                    cache.put(info)
+        cache.save_later()
+    return results
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+片段结构预检（启动 FFmpeg 之前）
+Structural Pre-validation of Segments (before FFmpeg starts)
+
+并行遍历每个片段的顶层盒，只读盒头并用 seek 跳过负载，仅解析 moov。以下问题会在毫秒级
+给出完整报告，而不是等 FFmpeg 处理了几个 GB 之后才失败或写出损坏的文件：
+    - 盒（通常是 mdat）声明的大小超出文件末尾，即文件被截断；
+    - 缺少 ftyp 或 moov；
+    - 片段之间的轨道 ID、timescale、编码或编码参数不一致。
+
+Walks every segment's top-level boxes in parallel, reading headers only and seeking over
+payloads; only moov is parsed. The problems below are reported in full within milliseconds
+instead of surfacing after FFmpeg has processed gigabytes, or as a corrupt output:
+    - a box (usually mdat) declares more bytes than the file holds, i.e. the file is truncated;
+    - ftyp or moov is missing;
+    - track IDs, timescales, codecs or codec configuration differ between segments.
+"""
+
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+from mp4_boxes import BoxError, TrackInfo, iter_boxes, parse_moov, read_box
+
+DEFAULT_WORKERS = 8
+# 报错信息中列出的问题数上限 / Problems listed in error messages at most
+MAX_REPORTED_ISSUES = 20
+
+
+class SegmentIssue(NamedTuple):
+    """一个片段上的一个问题 / One problem in one segment"""
+    path: str
+    message: str
+
+
+class ValidationReport(NamedTuple):
+    """预检结果 / Pre-validation result"""
+    segments: int
+    issues: List[SegmentIssue]
+    seconds: float
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    def format(self, limit: int = MAX_REPORTED_ISSUES) -> str:
+        count = len(self.issues)
+        lines = [f"{count} 个问题，共 {self.segments} 个片段 / {count} problem(s) in {self.segments} segment(s):"]
+        lines += [f"  {issue.path}: {issue.message}" for issue in self.issues[:limit]]
+        if count > limit:
+            lines.append(f"  ... 另有 {count - limit} 个 / {count - limit} more")
+        return "\n".join(lines)
+
+
+class SegmentValidationError(RuntimeError):
+    """片段未通过预检 / Segments failed pre-validation"""
+
+    def __init__(self, report: ValidationReport):
+        super().__init__(f"片段预检失败 / Segment pre-validation failed\n{report.format()}")
+        self.report = report
+
+
+class _Walk(NamedTuple):
+    path: str
+    tracks: Optional[Dict[int, TrackInfo]]
+    issues: List[SegmentIssue]
+
+
+def _box_name(box_type: bytes) -> str:
+    return box_type.decode("latin-1", "replace")
+
+
+def _walk(path: str) -> _Walk:
+    """遍历一个片段的顶层盒 / Walk one segment's top-level boxes"""
+    issues: List[SegmentIssue] = []
+    tracks = None
+    has_ftyp = False
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return _Walk(path, None, [SegmentIssue(path, "空文件 / Empty file")])
+            for header in iter_boxes(f, strict=False):
+                if header.end > size:
+                    name = _box_name(header.type)
+                    issues.append(SegmentIssue(
+                        path, f"'{name}' 盒被截断 / '{name}' box truncated at offset {header.offset}: "
+                              f"declares {header.size} bytes, only {size - header.offset} present"))
+                    break
+                if header.type == b"ftyp":
+                    has_ftyp = True
+                elif header.type == b"moov" and tracks is None:
+                    tracks = parse_moov(read_box(f, header)).tracks
+    except OSError as e:
+        return _Walk(path, None, [SegmentIssue(path, f"无法读取 / Unreadable: {e}")])
+    except (BoxError, struct.error) as e:
+        return _Walk(path, None, [SegmentIssue(path, f"盒结构损坏 / Corrupt box structure: {e}")])
+    # 被截断的文件不再重复报告缺失的盒 / A truncated file is not also reported for missing boxes
+    if not issues:
+        if not has_ftyp:
+            issues.append(SegmentIssue(path, "缺少 ftyp 盒 / Missing ftyp box"))
+        if tracks is None:
+            issues.append(SegmentIssue(path, "缺少 moov 盒 / Missing moov box"))
+        elif not tracks:
+            issues.append(SegmentIssue(path, "moov 中没有轨道 / moov holds no tracks"))
+    return _Walk(path, tracks, issues)
+
+
+def _compare(reference: _Walk, other: _Walk) -> List[SegmentIssue]:
+    """与第一个有效片段比较轨道 / Compare tracks against the first valid segment"""
+    name = os.path.basename(reference.path)
+    if set(reference.tracks) != set(other.tracks):
+        return [SegmentIssue(other.path, f"轨道 ID 不一致 / Track IDs {sorted(other.tracks)} differ from "
+                                         f"{sorted(reference.tracks)} in {name}")]
+    issues = []
+    for track_id, track in reference.tracks.items():
+        candidate = other.tracks[track_id]
+        if candidate.handler != track.handler or candidate.codec != track.codec:
+            issues.append(SegmentIssue(
+                other.path, f"轨道 {track_id} 编码不一致 / Track {track_id} is {candidate.handler}:{candidate.codec}, "
+                            f"{name} has {track.handler}:{track.codec}"))
+        elif candidate.stsd != track.stsd:
+            issues.append(SegmentIssue(
+                other.path, f"轨道 {track_id} 编码参数不一致 / Codec configuration of track {track_id} differs from {name}"))
+        if candidate.timescale != track.timescale:
+            issues.append(SegmentIssue(
+                other.path, f"轨道 {track_id} 时间基不一致 / Track {track_id} timescale {candidate.timescale} "
+                            f"differs from {track.timescale} in {name}"))
+    return issues
+
+
+def validate_segments(paths: List[str], workers: int = DEFAULT_WORKERS) -> ValidationReport:
+    """
+    并行预检一组按顺序拼接的片段，返回全部问题（不抛出异常）
+    Pre-validate segments that will be joined in order, returning every problem (never raises)
+
+    Args:
+        paths: 片段路径 / Segment paths
+        workers: 并行遍历的线程数 / Threads walking segments in parallel
+    """
+    started = time.perf_counter()
+    if len(paths) > 1 and workers > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            walks = list(pool.map(_walk, paths))
+    else:
+        walks = [_walk(path) for path in paths]
+
+    issues: List[SegmentIssue] = []
+    reference = None
+    for walk in walks:
+        issues += walk.issues
+        if not walk.tracks:
+            continue
+        if reference is None:
+            reference = walk
+        else:
+            issues += _compare(reference, walk)
+    return ValidationReport(len(paths), issues, time.perf_counter() - started)
+
+
+def check_segments(paths: List[str], workers: int = DEFAULT_WORKERS) -> ValidationReport:
+    """
+    预检片段，有问题时抛出 SegmentValidationError
+    Pre-validate segments and raise SegmentValidationError on any problem
+
+    Raises:
+        SegmentValidationError: 至少一个片段未通过 / at least one segment failed
+    """
+    report = validate_segments(paths, workers)
+    if not report.ok:
+        raise SegmentValidationError(report)
+    return report
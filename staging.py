@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+临时文件位置规划与原子发布
+Staging Placement and Atomic Publishing
+
+开始处理前检查各候选文件系统的剩余空间，优先把中间文件放在输出目录所在的文件系统上
+（避免跨设备复制）。输出先写入同目录下的隐藏临时文件，完成后通过 os.replace 原子地
+改名为最终文件名，崩溃或取消时不会留下写了一半的 Muxed_Output_*.mp4。
+
+Free space on each candidate filesystem is checked before work starts, and intermediates
+prefer the output directory's filesystem (no cross-device copies). Outputs are written to
+a hidden temp file in the same directory and atomically renamed into place with os.replace,
+so a crash or cancel never leaves a half-written Muxed_Output_*.mp4 behind.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+# 每个文件系统额外预留的空间 / Extra headroom kept free on every filesystem
+RESERVE_BYTES = 64 * 1024 * 1024
+PARTIAL_MARKER = ".partial-"
+STAGING_PREFIX = ".m4s_staging_"
+_PARTIAL_NAME = re.compile(r"^\..+" + re.escape(PARTIAL_MARKER) + r"(?P<pid>\d+)-[0-9a-f]{8}(\.[^.]*)?$")
+_STAGING_NAME = re.compile(r"^" + re.escape(STAGING_PREFIX) + r"(?P<pid>\d+)-")
+
+
+class InsufficientSpaceError(RuntimeError):
+    """没有足够剩余空间的文件系统 / No filesystem has enough free space"""
+
+
+class StagingPlan(NamedTuple):
+    """
+    output_dir: 最终输出目录 / Final output directory
+    temp_root: 中间文件的父目录 / Parent directory for intermediates
+    output_bytes / temp_bytes: 预计写入量 / Expected bytes written
+    """
+    output_dir: str
+    temp_root: str
+    output_bytes: int
+    temp_bytes: int
+
+    @property
+    def same_filesystem(self) -> bool:
+        return same_filesystem(self.output_dir, self.temp_root)
+
+
+def _existing_parent(path: str) -> str:
+    """向上找到第一个已存在的目录 / Walk up to the first directory that exists"""
+    current = os.path.abspath(path)
+    while not os.path.exists(current):
+        parent = os.path.dirname(current)
+        if parent == current:
+            break
+        current = parent
+    return current
+
+
+def free_bytes(path: str) -> int:
+    """path 所在文件系统的剩余空间 / Free space on the filesystem holding path"""
+    return shutil.disk_usage(_existing_parent(path)).free
+
+
+def same_filesystem(a: str, b: str) -> bool:
+    try:
+        return os.stat(_existing_parent(a)).st_dev == os.stat(_existing_parent(b)).st_dev
+    except OSError:
+        return False
+
+
+def plan_staging(output_dir: str, output_bytes: int, temp_bytes: int = 0,
+                 candidates: Optional[List[str]] = None, reserve: int = RESERVE_BYTES) -> StagingPlan:
+    """
+    选择中间文件的位置并确认空间足够
+    Choose where intermediates go and make sure there is room
+
+    Args:
+        output_dir: 最终输出目录 / Final output directory
+        output_bytes: 预计的最终输出大小 / Expected final output size
+        temp_bytes: 预计的中间文件总大小 / Expected total size of intermediates
+        candidates: 输出目录放不下中间文件时的备选目录，默认为系统临时目录
+                    Fallback directories when intermediates do not fit next to the output;
+                    defaults to the system temp directory
+
+    Raises:
+        InsufficientSpaceError: 没有足够空间 / Not enough space anywhere
+    """
+    output_dir = os.path.abspath(output_dir)
+    output_free = free_bytes(output_dir)
+    mb = 1024 * 1024
+    if output_free < output_bytes + reserve:
+        raise InsufficientSpaceError(
+            f"输出目录空间不足 / Not enough space in output directory {output_dir}: "
+            f"需要 / need {(output_bytes + reserve) / mb:.0f} MB, 剩余 / free {output_free / mb:.0f} MB"
+        )
+    # 同一文件系统：中间文件与输出共享空间，且发布时无需跨设备复制
+    # Same filesystem: intermediates share the output's space and publishing never copies across devices
+    if temp_bytes == 0 or output_free >= output_bytes + temp_bytes + reserve:
+        return StagingPlan(output_dir, output_dir, output_bytes, temp_bytes)
+
+    for candidate in candidates if candidates is not None else [tempfile.gettempdir()]:
+        if same_filesystem(candidate, output_dir):
+            continue
+        try:
+            if free_bytes(candidate) >= temp_bytes + reserve:
+                return StagingPlan(output_dir, os.path.abspath(candidate), output_bytes, temp_bytes)
+        except OSError:
+            continue
+    raise InsufficientSpaceError(
+        f"中间文件空间不足 / Not enough space for intermediates: "
+        f"需要 / need {(temp_bytes + reserve) / mb:.0f} MB"
+    )
+
+
+def partial_path(final_path: Path) -> Path:
+    """
+    与最终文件同目录的隐藏临时文件名，保留扩展名以便 FFmpeg 识别封装格式
+    Hidden temp name next to the final file; keeps the extension so FFmpeg picks the right muxer
+    """
+    final_path = Path(final_path)
+    token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    return final_path.with_name(f".{final_path.stem}{PARTIAL_MARKER}{token}{final_path.suffix}")
+
+
+def make_staging_dir(root: str) -> str:
+    """
+    在 root 下创建存放中间文件的隐藏目录，目录名带有所属进程 ID，以便崩溃后清理
+    Create a hidden directory for intermediates under root; its name carries the owner PID
+    so it can be cleaned up after a crash
+    """
+    return tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{os.getpid()}-", dir=root)
+
+
+def publish(partial: Path, final_path: Path) -> str:
+    """原子地把临时文件改名为最终文件 / Atomically rename the temp file to its final name"""
+    os.replace(str(partial), str(final_path))
+    return str(final_path)
+
+
+def pid_alive(pid: int) -> bool:
+    """本机进程是否仍存在；Windows 上无法廉价判断，视为存在 / Whether a local process still exists; assumed alive on Windows"""
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def remove_stale_partials(directory: str) -> int:
+    """
+    删除崩溃进程留下的临时输出和中间文件目录（所属进程已不存在），返回删除数量
+    Remove temp outputs and staging directories left by crashed processes (whose owner no longer
+    exists); returns the count
+    """
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        match = _PARTIAL_NAME.match(name) or _STAGING_NAME.match(name)
+        if not match or int(match.group("pid")) == os.getpid() or pid_alive(int(match.group("pid"))):
+            continue
+        path = Path(directory) / name
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            discard(path)
+        removed += 1
+    return removed
+
+
+def discard(partial: Optional[Path]):
+    """删除未发布的临时文件 / Remove an unpublished temp file"""
+    if partial is None:
+        return
+    try:
+        if os.path.exists(partial):
+            os.unlink(partial)
+    except OSError as e:
+        print(f"[Staging] 无法删除临时文件 / Could not remove temp file {partial}: {e}")
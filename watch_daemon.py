@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+监视目录并自动合并下载完成的片段
+Watch-Folder Daemon that Auto-Merges Completed Downloads
+
+监视一个或多个目录（含子目录）。每个包含 .m4s 的目录视为一组片段：目录内所有 .m4s 的
+大小和修改时间在 settle 秒内保持不变、且没有下载器的锁文件（*.part、*.downloading、
+*.aria2 ...）时，认为下载完成，按盒头中的轨道类型分成视频和音频后排队合并。同时运行的合并
+数量有上限。已处理的组按签名记录在状态文件中，重启后不会重复合并；片段变化后会重新合并。
+
+Linux 上使用 inotify（通过 ctypes，无额外依赖），其他平台或 inotify 不可用时回退到轮询。
+
+Watches one or more directories (recursively). Every directory holding .m4s files is one set:
+once the size and mtime of all its .m4s files have been stable for `settle` seconds and no
+downloader lock file (*.part, *.downloading, *.aria2 ...) is present, the download is considered
+complete, files are split into video and audio by the track type in their box headers, and a merge
+is queued. Concurrent merges are bounded. Processed sets are recorded by signature in a state file,
+so restarts do not merge them again; a set is merged again if its segments change.
+
+Uses inotify on Linux (via ctypes, no extra dependency) and falls back to polling elsewhere or
+when inotify is unavailable.
+"""
+
+import hashlib
+import json
+import os
+import re
+import select
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from cache_paths import get_cache_dir
+from m4s_job import M4SJob
+from segment_probe import probe_segments
+
+if TYPE_CHECKING:
+    from m4s_processor import M4SProcessor
+
+SEGMENT_SUFFIX = ".m4s"
+# 下载器在写入期间留下的锁文件/临时文件后缀 / Lock/temp suffixes downloaders leave while writing
+LOCK_SUFFIXES = (".lock", ".part", ".partial", ".downloading", ".download", ".aria2", ".crdownload", ".tmp", ".!qb")
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_POLL_INTERVAL = 2.0
+# inotify 模式下的兜底全量扫描间隔，弥补丢失的事件 / Safety rescan interval in inotify mode for missed events
+RESCAN_INTERVAL = 300.0
+TICK = 1.0
+# 空闲时的最长等待，保证 stop() 能及时生效 / Longest idle wait, so stop() takes effect promptly
+IDLE_WAIT = 5.0
+
+
+class SegmentSet(NamedTuple):
+    """一个目录中下载完成的片段组 / A completed set of segments in one directory"""
+    directory: str
+    video: List[str]
+    audio: List[str]
+    signature: str
+
+
+def _natural_key(name: str):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def scan_directory(directory: str) -> Tuple[List[Tuple[str, int, int]], bool]:
+    """
+    返回目录中的 .m4s 文件 (名称, 大小, 修改时间) 及是否存在锁文件
+    Return the directory's .m4s files as (name, size, mtime_ns) and whether a lock file exists
+    """
+    files, locked = [], False
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name.lower()
+                if name.endswith(LOCK_SUFFIXES):
+                    locked = True
+                    continue
+                if not name.endswith(SEGMENT_SUFFIX) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                files.append((entry.name, st.st_size, st.st_mtime_ns))
+    except OSError:
+        return [], False
+    files.sort(key=lambda item: _natural_key(item[0]))
+    return files, locked
+
+
+def _signature(files: List[Tuple[str, int, int]]) -> str:
+    payload = json.dumps(files, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=12).hexdigest()
+
+
+def classify_segments(paths: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    按盒头中的轨道类型分成视频和音频；无法解析时参考文件名
+    Split into video and audio by the track type in the box headers; fall back to the file name
+    """
+    video, audio = [], []
+    for path, info in zip(paths, probe_segments(paths)):
+        handlers = {track.handler for track in info.tracks} if info is not None else set()
+        name = os.path.basename(path).lower()
+        if "vide" in handlers or (not handlers and "video" in name):
+            video.append(path)
+        elif "soun" in handlers or (not handlers and "audio" in name):
+            audio.append(path)
+    return video, audio
+
+
+# --- 目录监视 / Directory watchers ---
+class PollingWatcher:
+    """定期扫描目录树，报告有 .m4s 变化的目录 / Periodically scan the trees and report directories whose .m4s changed"""
+
+    mode = "poll"
+
+    def __init__(self, roots: List[str], interval: float = DEFAULT_POLL_INTERVAL):
+        self.roots = roots
+        self.interval = interval
+        self._snapshot: Dict[str, str] = {}
+
+    def _scan(self) -> Set[str]:
+        changed, seen = set(), set()
+        for root in self.roots:
+            for directory, _, names in os.walk(root):
+                if not any(name.lower().endswith(SEGMENT_SUFFIX) for name in names):
+                    continue
+                files, locked = scan_directory(directory)
+                state = _signature(files) + ("L" if locked else "")
+                seen.add(directory)
+                if self._snapshot.get(directory) != state:
+                    self._snapshot[directory] = state
+                    changed.add(directory)
+        for directory in set(self._snapshot) - seen:
+            del self._snapshot[directory]
+        return changed
+
+    def initial(self) -> Set[str]:
+        return self._scan()
+
+    def wait(self, timeout: float) -> Set[str]:
+        time.sleep(min(timeout, self.interval))
+        return self._scan()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    基于 inotify 的递归监视（仅 Linux） / Recursive inotify watcher (Linux only)
+
+    Raises:
+        OSError: inotify 不可用或监视数量超出系统上限 / inotify unavailable or the watch limit was hit
+    """
+
+    mode = "inotify"
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_ONLYDIR)
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, roots: List[str]):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify 仅支持 Linux / inotify is Linux-only")
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._ctypes = ctypes
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = roots
+        self._dirs: Dict[int, str] = {}
+        self._last_rescan = time.monotonic()
+        try:
+            for root in roots:
+                self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory: str):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            errno = self._ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed for {directory}: {os.strerror(errno)}")
+        self._dirs[wd] = directory
+
+    def _add_tree(self, root: str) -> Set[str]:
+        """监视 root 及其全部子目录，返回其中含 .m4s 的目录 / Watch root and all subdirectories; return those holding .m4s"""
+        found = set()
+        for directory, _, names in os.walk(root):
+            self._add_watch(directory)
+            if any(name.lower().endswith(SEGMENT_SUFFIX) for name in names):
+                found.add(directory)
+        return found
+
+    def _rescan(self) -> Set[str]:
+        self._last_rescan = time.monotonic()
+        found = set()
+        for root in self.roots:
+            for directory, _, names in os.walk(root):
+                if any(name.lower().endswith(SEGMENT_SUFFIX) for name in names):
+                    found.add(directory)
+        return found
+
+    def initial(self) -> Set[str]:
+        return self._rescan()
+
+    def wait(self, timeout: float) -> Set[str]:
+        if time.monotonic() - self._last_rescan >= RESCAN_INTERVAL:
+            return self._rescan()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset + self._EVENT.size <= len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # 事件队列溢出：全量扫描 / Event queue overflowed: rescan everything
+                changed |= self._rescan()
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & self.IN_IGNORED:
+                del self._dirs[wd]
+                continue
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        changed |= self._add_tree(os.path.join(directory, name))
+                    except OSError as e:
+                        print(f"[Watch] 无法监视新目录 / Cannot watch new directory: {e}")
+                continue
+            changed.add(directory)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(roots: List[str], force_poll: bool = False,
+                   poll_interval: float = DEFAULT_POLL_INTERVAL):
+    """优先使用 inotify，不可用时回退到轮询 / Prefer inotify, falling back to polling"""
+    if not force_poll:
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as e:
+            print(f"[Watch] inotify 不可用，改用轮询 / inotify unavailable, polling instead: {e}")
+    return PollingWatcher(roots, poll_interval)
+
+
+# --- 守护进程 / Daemon ---
+class WatchDaemon:
+    """
+    监视目录并合并下载完成的片段组
+    Watch directories and merge segment sets once their download completes
+    """
+
+    def __init__(self, processor: "M4SProcessor", roots: List[str], output_dir: Optional[str] = None,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS, workers: int = 2,
+                 state_path: Optional[str] = None, force_poll: bool = False,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, allow_single_stream: bool = False):
+        """
+        Args:
+            processor: 处理器 / Processor
+            roots: 要监视的目录 / Directories to watch
+            output_dir: 输出目录，默认写到片段所在目录 / Output directory; defaults to the set's own directory
+            settle_seconds: 片段保持不变多久后视为下载完成 / How long segments must stay unchanged to count as complete
+            workers: 同时进行的合并数 / Concurrent merges
+            state_path: 已处理记录的路径 / Path of the processed-set record
+            force_poll: 不使用 inotify / Do not use inotify
+            allow_single_stream: 只有视频或只有音频时也合并 / Merge sets with only video or only audio too
+        """
+        self.processor = processor
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.output_dir = output_dir
+        self.settle_seconds = settle_seconds
+        self.workers = max(1, workers)
+        self.state_path = Path(state_path) if state_path else get_cache_dir() / "watch_state.json"
+        self.force_poll = force_poll
+        self.poll_interval = poll_interval
+        self.allow_single_stream = allow_single_stream
+
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # 目录 -> (签名, 首次观察到该签名的时间) / directory -> (signature, when it was first seen)
+        self._pending: Dict[str, Tuple[Optional[str], float]] = {}
+        self._in_flight: Set[str] = set()
+        self._active_jobs: List[M4SJob] = []
+        self._state = self._load_state()
+
+    # --- 状态 / State ---
+    def _load_state(self) -> Dict[str, dict]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".watch_", suffix=".tmp", dir=str(self.state_path.parent))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._state, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"[Watch] 无法保存状态 / Could not save state: {e}")
+
+    @staticmethod
+    def _state_key(directory: str) -> str:
+        return os.path.normcase(os.path.abspath(directory))
+
+    # --- 完成检测 / Completion detection ---
+    def _mark(self, directories: Set[str]):
+        now = time.monotonic()
+        for directory in directories:
+            if directory not in self._pending:
+                self._pending[directory] = (None, now)
+
+    def _check(self, directory: str, now: float) -> Optional[SegmentSet]:
+        """
+        返回已完成的片段组；仍在下载时返回 None 并保留在待定列表中
+        Return the completed set; None (and keep it pending) while it is still downloading
+        """
+        files, locked = scan_directory(directory)
+        if not files:
+            self._pending.pop(directory, None)
+            return None
+        signature = _signature(files)
+        record = self._state.get(self._state_key(directory))
+        if record and record.get("signature") == signature:
+            self._pending.pop(directory, None)
+            return None
+        if locked:
+            self._pending[directory] = (None, now)
+            return None
+
+        previous, since = self._pending.get(directory, (None, now))
+        if previous != signature:
+            # 首次见到：若文件早已不再变化（例如启动时已下载完成）则无需等待
+            # First sight: no need to wait when the files stopped changing long ago (e.g. finished before startup)
+            newest = max(mtime for _, _, mtime in files) / 1e9
+            if previous is None and time.time() - newest >= self.settle_seconds:
+                since = now - self.settle_seconds
+            else:
+                since = now
+            self._pending[directory] = (signature, since)
+        if now - since < self.settle_seconds:
+            return None
+
+        self._pending.pop(directory, None)
+        paths = [os.path.join(directory, name) for name, _, _ in files]
+        video, audio = classify_segments(paths)
+        if not (video and audio) and not (self.allow_single_stream and (video or audio)):
+            print(f"[Watch] 跳过（缺少视频或音频） / Skipped (missing video or audio): {directory}")
+            self._record(directory, signature, "skipped")
+            return None
+        return SegmentSet(directory, video, audio, signature)
+
+    def _record(self, directory: str, signature: str, status: str, output: Optional[str] = None,
+                error: Optional[str] = None):
+        with self._lock:
+            self._state[self._state_key(directory)] = {
+                "signature": signature, "status": status, "output": output, "error": error, "time": time.time(),
+            }
+            self._save_state()
+
+    # --- 合并 / Merging ---
+    def _output_name(self, segment_set: SegmentSet) -> str:
+        base = os.path.basename(segment_set.directory.rstrip(os.sep)) or "output"
+        suffix = ".m4a" if not segment_set.video else ".mp4"
+        return f"{base}{suffix}"
+
+    def _merge(self, segment_set: SegmentSet):
+        directory = segment_set.directory
+        output_dir = self.output_dir or directory
+        handle = M4SJob(os.path.basename(directory))
+        with self._lock:
+            self._active_jobs.append(handle)
+        print(f"[Watch] 开始合并 / Merging: {directory} "
+              f"({len(segment_set.video)} video, {len(segment_set.audio)} audio)")
+        try:
+            handle.run(lambda: self.processor.process_all(
+                segment_set.video, segment_set.audio, output_dir,
+                output_name=self._output_name(segment_set), job=handle,
+            ))
+        finally:
+            with self._lock:
+                self._active_jobs.remove(handle)
+                self._in_flight.discard(directory)
+
+        if handle.status == M4SJob.SUCCEEDED:
+            print(f"[Watch] 完成 / Done: {handle.result}")
+            self._record(directory, segment_set.signature, "done", output=str(handle.result))
+        elif handle.status == M4SJob.CANCELLED:
+            print(f"[Watch] 已取消 / Cancelled: {directory}")
+        else:
+            first_line = str(handle.error).splitlines()[0] if handle.error else ""
+            print(f"[Watch] 失败 / Failed: {directory}: {first_line}")
+            # 记录失败签名，片段变化前不再重试 / Record the failed signature; retry only when the segments change
+            self._record(directory, segment_set.signature, "failed", error=str(handle.error))
+
+    def stop(self):
+        """停止监视并取消正在进行的合并 / Stop watching and cancel running merges"""
+        self._stop.set()
+        with self._lock:
+            jobs = list(self._active_jobs)
+        for job in jobs:
+            job.cancel()
+
+    def run(self):
+        """阻塞运行直到 stop() 或 Ctrl+C / Run until stop() or Ctrl+C"""
+        for root in self.roots:
+            if not os.path.isdir(root):
+                raise RuntimeError(f"目录不存在 / Directory not found: {root}")
+        watcher = create_watcher(self.roots, self.force_poll, self.poll_interval)
+        print(f"[Watch] 监视 / Watching ({watcher.mode}): {', '.join(self.roots)}; "
+              f"settle {self.settle_seconds:g}s, {self.workers} worker(s)")
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="m4s-watch")
+        try:
+            self._mark(watcher.initial())
+            while not self._stop.is_set():
+                # 有待定目录时按 TICK 检查，否则一直等待事件 / Tick while sets are pending, otherwise wait for events
+                timeout = TICK if self._pending else IDLE_WAIT
+                self._mark(watcher.wait(timeout))
+                now = time.monotonic()
+                for directory in list(self._pending):
+                    with self._lock:
+                        if directory in self._in_flight:
+                            continue
+                    segment_set = self._check(directory, now)
+                    if segment_set is None:
+                        continue
+                    with self._lock:
+                        self._in_flight.add(directory)
+                    executor.submit(self._merge, segment_set)
+        except KeyboardInterrupt:
+            print("[Watch] 已中断，正在停止 / Interrupted, stopping")
+        finally:
+            self.stop()
+            executor.shutdown(wait=True)
+            watcher.close()
+
+
+def add_watch_arguments(parser):
+    parser.add_argument("dirs", nargs="+", help="要监视的目录 / Directories to watch")
+    parser.add_argument("-o", "--output", help="输出目录，默认写到片段所在目录 / Output directory (default: next to the segments)")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="片段保持不变多少秒后开始合并 / Seconds segments must stay unchanged before merging")
+    parser.add_argument("--workers", type=int, default=2, help="同时进行的合并数 / Concurrent merges")
+    parser.add_argument("--poll", action="store_true", help="使用轮询而不是 inotify / Poll instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="轮询间隔秒数 / Polling interval in seconds")
+    parser.add_argument("--allow-single", action="store_true",
+                        help="只有视频或音频时也合并 / Also merge sets with only video or only audio")
+    parser.add_argument("--state", help="已处理记录文件 / Processed-set state file")
+
+
+def run_watch_cli(args, processor: "M4SProcessor") -> int:
+    daemon = WatchDaemon(
+        processor, args.dirs, output_dir=args.output, settle_seconds=args.settle, workers=args.workers,
+        state_path=args.state, force_poll=args.poll, poll_interval=args.poll_interval,
+        allow_single_stream=args.allow_single,
+    )
+    try:
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    except (ImportError, ValueError, AttributeError):
+        pass
+    daemon.run()
+    return 0